@@ -1,18 +1,181 @@
 import pygame
 import time
 import imp
-from fcntl import fcntl, F_GETFL, F_SETFL
-from os import O_NONBLOCK, read
+import io
+import os
+import Queue
+import mmap
+import struct
+import multiprocessing
+import gc
+from os import read, write
+from threading import Thread, Condition, Lock, RLock, Event
 
 import subprocess
 import shlex
+import select
+import re
 
 from utils import GenericClassFactory
-from shutil import copyfile
+from memory_watchdog import read_private_memory
+from pygame_utils import decode_jpeg, convert_image, load_image
+from shutil import copyfile, move
 from datetime import datetime
 
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
 from subprocess import Popen, PIPE
+from distutils.spawn import find_executable
+
+
+class PreviewProducer(object):
+    """
+    Background thread that continuously acquires preview images and keeps only the newest one in a single slot.
+    Frames are published as they are acquired, the slot only swaps references.
+    Frames that are replaced before anybody fetched them are counted as dropped.
+    """
+
+    def __init__(self, acquire_callback, lock, max_fps=30, failure_sleep_time=0.1, frame_callback=None):
+        """
+        :param acquire_callback: function returning a new preview image or None
+        :param lock: lock that is held while acquiring, used to serialize camera access with other threads
+        :param max_fps: upper bound of acquired frames per second, 0 for no limit
+        :param failure_sleep_time: pause in seconds after a failed acquisition
+        :param frame_callback: optional function called in the producer thread after each new frame
+        """
+        self._acquire_callback = acquire_callback
+        self._frame_callback = frame_callback
+        self._lock = lock
+        self._min_interval = 1.0 / max_fps if max_fps else 0
+        self._failure_sleep_time = failure_sleep_time
+        self._slot_lock = Lock()
+        self._frame = None
+        self._frame_consumed = True
+        self._thread = None
+        self._running = False
+        self.produced_frames = 0
+        self.dropped_frames = 0
+        self.failure_count = 0
+
+    def start(self):
+        if self.is_running():
+            return
+        self._running = True
+        self._thread = Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop the producer and wait until a running acquisition has finished
+        """
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._slot_lock:
+            self._frame = None
+            self._frame_consumed = True
+
+    def is_running(self):
+        return self._running
+
+    def latest_frame(self):
+        """
+        :return: newest frame or None if no frame was acquired yet
+        """
+        with self._slot_lock:
+            self._frame_consumed = True
+            return self._frame
+
+    def _worker(self):
+        """
+        worker function for the producer thread
+        """
+        while self._running:
+            start = time.time()
+            frame = None
+            try:
+                with self._lock:
+                    if not self._running:
+                        break
+                    frame = self._acquire_callback()
+            except Exception as e:
+                print("Preview acquisition failed: " + str(e))
+
+            if frame:
+                self.failure_count = 0
+                self.produced_frames += 1
+                with self._slot_lock:
+                    if not self._frame_consumed:
+                        self.dropped_frames += 1
+                    self._frame = frame
+                    self._frame_consumed = False
+                if self._frame_callback:
+                    self._frame_callback()
+                sleep_time = self._min_interval - (time.time() - start)
+            else:
+                self.failure_count += 1
+                sleep_time = self._failure_sleep_time
+
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+
+
+class CaptureHandle(object):
+    """
+    Handle of an asynchronous photo capture. The camera already released the shutter when the handle is returned,
+    downloading and decoding of the photo are finished by a worker thread.
+    """
+
+    def __init__(self, finish_callback, lock, screen_size=None):
+        """
+        :param finish_callback: function that downloads and decodes the photo, returns (photo pygame.image, PATH_TO_PHOTO)
+        :param lock: camera lock that is held while finishing the capture
+        :param screen_size: optional size of an additional screen sized version of the photo
+        """
+        self._finish_callback = finish_callback
+        self._lock = lock
+        self._screen_size = screen_size
+        self._done = Event()
+        self._result = None
+        self._exception = None
+        self.screen_photo = None
+
+        self._thread = Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _worker(self):
+        try:
+            with self._lock:
+                result = self._finish_callback()
+            if self._screen_size:
+                self.screen_photo = pygame.transform.scale(result[0], self._screen_size)
+            self._result = result
+        except Exception as e:
+            self._exception = e
+        self._done.set()
+
+    def done(self):
+        """
+        :return: True if the photo is available or the capture failed
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the photo
+        :param timeout: max time to wait in seconds, None waits forever
+        :return: tuple (photo pygame.image, PATH_TO_PHOTO)
+        """
+        if not self._done.wait(timeout):
+            raise Exception("Capture not finished")
+        if self._exception:
+            raise self._exception
+        return self._result
+
 
 class AbstractCamera(object):
     """
@@ -20,6 +183,9 @@ class AbstractCamera(object):
     """
     __metaclass__ = ABCMeta
 
+    # set True in implementations that provide get_preview_jpeg
+    supports_jpeg_preview = False
+
     @abstractmethod
     def set_memory_capture(self):
         """
@@ -42,14 +208,84 @@ class AbstractCamera(object):
         """
         raise NotImplementedError
 
-    @abstractmethod
+    def get_preview_jpeg(self):
+        """
+        Get the encoded preview frame, only available if supports_jpeg_preview is True
+        :return: jpeg data of the preview or None
+        """
+        raise NotImplementedError
+
+    def get_preview_scaled(self, size=None, mirror=False):
+        """
+        Get a preview image that is already scaled and optionally mirrored.
+        Cameras providing encoded previews decode them directly at the target size, the decoded surface wraps the
+        buffer of the decoder and is returned without converting it, blitting it to the screen converts the pixels.
+        :param size: target size (width, height) or None to keep the preview size
+        :param mirror: mirror the image horizontally
+        :return: preview pygame.image or None
+        """
+        if self.supports_jpeg_preview:
+            data = self.get_preview_jpeg()
+            if data:
+                return decode_jpeg(data, size=size, mirror=mirror)
+            return None
+
+        picture = self.get_preview()
+        if picture:
+            if size and picture.get_size() != tuple(size):
+                picture = pygame.transform.scale(picture, size)
+            if mirror:
+                picture = pygame.transform.flip(picture, True, False)
+            picture = convert_image(picture)
+        return picture
+
     def take_photo(self):
         """
         Trigger a photo on the camera
         :return: (photo pygame.image,PATH_TO_PHOTO)
         """
+        file = self.take_photo_file()
+        return pygame.image.load(file), file
+
+    @abstractmethod
+    def take_photo_file(self):
+        """
+        Trigger a photo on the camera without decoding it, e.g. in a process that only passes the path on
+        :return: PATH_TO_PHOTO
+        """
         raise NotImplementedError
 
+    def take_photo_async(self, screen_size=None):
+        """
+        Trigger a photo and return as soon as the shutter was released
+        :param screen_size: if given, the worker additionally scales the photo to this size (handle.screen_photo)
+        :return: CaptureHandle, its result() is the tuple (photo pygame.image,PATH_TO_PHOTO)
+        """
+        with self.camera_lock:
+            finish_callback = self._trigger_capture()
+        return CaptureHandle(finish_callback=finish_callback, lock=self.camera_lock, screen_size=screen_size)
+
+    def _trigger_capture(self):
+        """
+        Release the shutter, see _trigger_capture_file
+        :return: function finishing the capture, returns (photo pygame.image,PATH_TO_PHOTO)
+        """
+        finish_file = self._trigger_capture_file()
+
+        def finish():
+            file = finish_file()
+            return pygame.image.load(file), file
+
+        return finish
+
+    def _trigger_capture_file(self):
+        """
+        Release the shutter, override this in implementations that can separate triggering from downloading.
+        The default implementation does the entire capture in the worker.
+        :return: function finishing the capture without decoding the photo, returns PATH_TO_PHOTO
+        """
+        return self.take_photo_file
+
     @abstractmethod
     def enable_live_autofocus(self):
         """
@@ -70,6 +306,96 @@ class AbstractCamera(object):
         """
         pass
 
+    @contextmanager
+    def config_transaction(self):
+        """
+        optional context manager that batches all configuration changes made inside it,
+        implementations without batching support apply them immediately
+        """
+        yield
+
+    @property
+    def camera_lock(self):
+        """
+        Lock serializing camera access between the preview producer thread and other callers,
+        hold it for any camera command while the preview stream might be running
+        :return: threading.RLock
+        """
+        lock = getattr(self, '_camera_lock', None)
+        if lock is None:
+            lock = self._camera_lock = RLock()
+        return lock
+
+    def start_preview_stream(self, max_fps=30, size=None, mirror=False, frame_callback=None):
+        """
+        Start acquiring preview images in a background thread, afterwards latest_frame() never blocks on the camera
+        :param max_fps: upper bound of acquired frames per second
+        :param size: frames are decoded directly at this size (width, height)
+        :param mirror: frames are mirrored horizontally while decoding
+        :param frame_callback: optional function called in the producer thread after each new frame
+        """
+        producer = getattr(self, '_preview_producer', None)
+        if producer and producer.is_running():
+            if self._preview_format == (size, mirror):
+                return
+            producer.stop()
+        self._preview_format = (size, mirror)
+        self._preview_producer = PreviewProducer(acquire_callback=lambda: self.get_preview_scaled(size, mirror),
+                                                 lock=self.camera_lock, max_fps=max_fps,
+                                                 frame_callback=frame_callback)
+        self._preview_producer.start()
+
+    def stop_preview_stream(self):
+        """
+        Stop the background preview acquisition, blocks until a running acquisition has finished
+        """
+        producer = getattr(self, '_preview_producer', None)
+        if producer:
+            producer.stop()
+
+    def is_preview_stream_running(self):
+        producer = getattr(self, '_preview_producer', None)
+        return producer is not None and producer.is_running()
+
+    def latest_frame(self, size=None, mirror=False):
+        """
+        Get the newest preview image. If the preview stream is not running, a preview is acquired synchronously.
+        :param size: size for synchronously acquired frames, the stream uses the size given at its start
+        :param mirror: mirror synchronously acquired frames, the stream uses the setting given at its start
+        :return: preview pygame.image or None
+        """
+        if self.is_preview_stream_running():
+            return self._preview_producer.latest_frame()
+
+        frame = None
+        with self.camera_lock:
+            try:
+                frame = self.get_preview_scaled(size, mirror)
+            except Exception as e:
+                print("Preview acquisition failed: " + str(e))
+        if frame:
+            self._sync_preview_failure_count = 0
+        else:
+            self._sync_preview_failure_count = getattr(self, '_sync_preview_failure_count', 0) + 1
+        return frame
+
+    @property
+    def preview_failure_count(self):
+        """
+        :return: number of consecutive failed preview acquisitions
+        """
+        if self.is_preview_stream_running():
+            return self._preview_producer.failure_count
+        return getattr(self, '_sync_preview_failure_count', 0)
+
+    @property
+    def dropped_frames(self):
+        """
+        :return: number of preview frames that were replaced by a newer one before they were fetched
+        """
+        producer = getattr(self, '_preview_producer', None)
+        return producer.dropped_frames if producer else 0
+
 
 # Create singleton factory object
 camera_factory = GenericClassFactory(AbstractCamera)
@@ -121,6 +447,8 @@ if found_piggyphoto_module:
             config_value = self.cam.config.get_child_by_name("viewfinder")
             config_value.value = 0
 
+        supports_jpeg_preview = True
+
         def get_preview(self):
             file = self._tmp_directory +'/preview.jpg'
             cfile = self.cam.capture_preview(destpath=file)
@@ -128,6 +456,13 @@ if found_piggyphoto_module:
             picture = pygame.image.load(file)
             return picture
 
+        def get_preview_jpeg(self):
+            file = self._tmp_directory +'/preview.jpg'
+            cfile = self.cam.capture_preview(destpath=file)
+            cfile.clean()
+            with open(file, 'rb') as f:
+                return f.read()
+
         def enable_live_autofocus(self):
             config_value = self.cam.config.get_child_by_name("liveviewaffocus")
             config_value.value = 'Full-time-servo AF'
@@ -136,17 +471,18 @@ if found_piggyphoto_module:
             config_value = self.cam.config.get_child_by_name("liveviewaffocus")
             config_value.value = 'Single-servo AF'
 
-        def take_photo(self):
+        def take_photo_file(self):
             """
             Trigger photo capture
             TODO it seems like capture_image of the library has a memory leak
-            :return:  tuple of pygame image and path to file
+            piggyphoto cannot separate triggering from downloading, hence take_photo_async runs this in the worker
+            :return: path to file
             """
             #disable liveview to use better internal autofocus of camera
             self.disable_liveview()
             file = self._photo_directory + "/dsc_" + str(datetime.now()).replace(':','-') + ".jpg"
             self.cam.capture_image(destpath=file)
-            return pygame.image.load(file), file
+            return file
 
         def close(self):
             if self.cam:
@@ -203,6 +539,8 @@ if found_gphoto2_cffi_module:
             except:
                 print("disable liveview failed")
 
+        supports_jpeg_preview = True
+
         def get_preview(self):
             file = self._tmp_directory +'/preview.jpg'
             preview = self.cam.get_preview()
@@ -210,6 +548,9 @@ if found_gphoto2_cffi_module:
             picture = pygame.image.load(file)
             return picture
 
+        def get_preview_jpeg(self):
+            return self.cam.get_preview()
+
         def enable_live_autofocus(self):            
             try:
                 self.cam.config['capturesettings']['liveviewaffocus'].set('Full-time-servo AF')
@@ -222,17 +563,33 @@ if found_gphoto2_cffi_module:
             except:
                 print('could not change liveview AF settings, please enable AF on lens')
 
-        def take_photo(self):
+        def take_photo_file(self):
             """
             Trigger photo capture
-            :return:  tuple of pygame image and path to file
+            :return: path to file
             """
             #disable liveview to use better internal autofocus of camera
             self.disable_liveview()
             file = self._photo_directory + "/dsc_" + str(datetime.now()).replace(':','-') + ".jpg"
             photo = self.cam.capture()
             self._save_picture(filename=file, data=photo)
-            return pygame.image.load(file), file
+            return file
+
+        def _trigger_capture_file(self):
+            """
+            Release the shutter and leave the photo on the camera, it is downloaded by the worker
+            :return: function finishing the capture
+            """
+            self.disable_liveview()
+            file = self._photo_directory + "/dsc_" + str(datetime.now()).replace(':','-') + ".jpg"
+            camera_file = self.cam.capture(to_camera_storage=True)
+
+            def finish():
+                self._save_picture(filename=file, data=camera_file.get_data())
+                camera_file.remove()
+                return file
+
+            return finish
 
         def close(self):
             pass
@@ -256,9 +613,15 @@ class DummyCamera(AbstractCamera):
         else:
             self._tmp_directory = ""
 
-        self._previews = [pygame.image.load(self._tmp_directory + "dummy_preview00.jpg"), pygame.image.load(self._tmp_directory + "dummy_preview01.jpg")]
+        self._previews = [load_image(self._tmp_directory + "dummy_preview00.jpg"), load_image(self._tmp_directory + "dummy_preview01.jpg")]
+        self._preview_data = []
+        for file in ["dummy_preview00.jpg", "dummy_preview01.jpg"]:
+            with open(self._tmp_directory + file, 'rb') as f:
+                self._preview_data.append(f.read())
         self._photo = pygame.image.load(self._tmp_directory + "dummy_snap.jpg")
 
+    supports_jpeg_preview = True
+
     def set_memory_capture(self):
         pass
 
@@ -275,30 +638,436 @@ class DummyCamera(AbstractCamera):
         self._preview_cnt = (self._preview_cnt + 1) % len(self._previews)
         return self._previews[self._preview_cnt]
 
+    def get_preview_jpeg(self):
+        self._preview_cnt = (self._preview_cnt + 1) % len(self._preview_data)
+        return self._preview_data[self._preview_cnt]
+
     def take_photo(self):
+        return self._photo, self.take_photo_file()
+
+    def take_photo_file(self):
         photo_file = self._photo_directory + "/dummy_snap_" +str(datetime.now()).replace(':','-')+ ".jpg"
         copyfile(self._tmp_directory + "dummy_snap.jpg", photo_file)
-        return self._photo, photo_file
+        return photo_file
+
+    def _trigger_capture_file(self):
+        photo_file = self._photo_directory + "/dummy_snap_" +str(datetime.now()).replace(':','-')+ ".jpg"
+
+        def finish():
+            copyfile(self._tmp_directory + "dummy_snap.jpg", photo_file)
+            return photo_file
+
+        return finish
 
     def __del__(self):
         pass
 
 camera_factory.register_algorithm("dummy", DummyCamera)
 
+
+class MJPEGStreamReader(object):
+    """
+    Reads a motion jpeg stream (concatenated jpeg frames) from the stdout of a process, e.g.
+    'gphoto2 --capture-movie --stdout', and keeps only the newest complete frame in memory.
+    A background thread drains the pipe continuously, hence frames never pile up in the pipe buffer
+    and no temporary file is written.
+    """
+
+    JPEG_SOI = b'\xff\xd8'
+    JPEG_EOI = b'\xff\xd9'
+
+    def __init__(self, command, chunk_size=65536, max_buffer_size=8*1024*1024):
+        """
+        :param command: full command string of the streaming process
+        :param chunk_size: number of bytes read from the pipe at once
+        :param max_buffer_size: unparsed data is discarded if it grows beyond this size (stream corruption)
+        """
+        self._command = command
+        self._chunk_size = chunk_size
+        self._max_buffer_size = max_buffer_size
+        self._process = None
+        self._thread = None
+        self._condition = Condition()
+        self._frame = None
+        self._frame_id = 0
+
+    def start(self):
+        """
+        start the streaming process and the reader thread
+        """
+        if self.is_running():
+            return
+        cmd = shlex.split(self._command)
+        with open(os.devnull, 'w') as devnull:
+            self._process = Popen(cmd, stdout=PIPE, stderr=devnull, bufsize=0)
+        self._thread = Thread(target=self._reader_worker, args=(self._process,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop the streaming process and wait for the reader thread
+        """
+        process = self._process
+        self._process = None
+        if process:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._condition:
+            self._frame = None
+            self._condition.notify_all()
+
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def get_frame(self, last_frame_id=None, timeout=2.0):
+        """
+        Get the newest jpeg frame
+        :param last_frame_id: if given, wait until a frame newer than this id is available
+        :param timeout: max time to wait for a frame in seconds
+        :return: tuple (frame id, jpeg data) or (None, None) if no frame became available in time
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while self._frame is None or (last_frame_id is not None and self._frame_id == last_frame_id):
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.is_running():
+                    return None, None
+                self._condition.wait(remaining)
+            return self._frame_id, self._frame
+
+    def _reader_worker(self, process):
+        """
+        worker function for the reader thread, splits the byte stream into jpeg frames
+        """
+        fd = process.stdout.fileno()
+        buf = bytearray()
+        search_pos = 0
+        while True:
+            try:
+                chunk = read(fd, self._chunk_size)
+            except OSError:
+                break
+            if not chunk:
+                break
+            buf.extend(chunk)
+            while True:
+                start = buf.find(self.JPEG_SOI)
+                if start < 0:
+                    # keep last byte, it might be the first half of a marker
+                    del buf[:-1]
+                    search_pos = 0
+                    break
+                end = buf.find(self.JPEG_EOI, max(start + 2, search_pos))
+                if end < 0:
+                    del buf[:start]
+                    search_pos = max(len(buf) - 1, 0)
+                    break
+                frame = bytes(buf[start:end + 2])
+                del buf[:end + 2]
+                search_pos = 0
+                with self._condition:
+                    self._frame = frame
+                    self._frame_id += 1
+                    self._condition.notify_all()
+            if len(buf) > self._max_buffer_size:
+                del buf[:]
+                search_pos = 0
+        with self._condition:
+            self._condition.notify_all()
+
+
+class GPhotoConfigCache(object):
+    """
+    Configuration layer for gphoto2 config values. It remembers the last value written for each key and skips writes
+    that would not change anything. Changes made inside a transaction are collected and written together with a
+    single call of the write callback, e.g. one gphoto2 invocation or one shell round trip.
+    """
+
+    def __init__(self, write_callback):
+        """
+        :param write_callback: function receiving a list of (key, value, by_index) tuples that have to be written
+        """
+        self._write_callback = write_callback
+        self._values = {}
+        self._pending = OrderedDict()
+        self._transaction_depth = 0
+
+    def set(self, key, value, by_index=False):
+        """
+        set a config value, it is written immediately unless a transaction is open
+        :param key: config key
+        :param value: config value or option index
+        :param by_index: value is an option index
+        """
+        entry = (value, by_index)
+        if key in self._pending:
+            if self._pending[key] == entry:
+                return
+        elif self._values.get(key) == entry:
+            return
+
+        self._pending[key] = entry
+        if self._transaction_depth == 0:
+            self.commit()
+
+    def commit(self):
+        """
+        write all pending changes, the cached values of failed writes are forgotten
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = OrderedDict()
+        try:
+            self._write_callback([(key, value, by_index) for key, (value, by_index) in pending.items()])
+        except Exception:
+            for key in pending:
+                self._values.pop(key, None)
+            raise
+        self._values.update(pending)
+
+    @contextmanager
+    def transaction(self):
+        """
+        context manager collecting all changes and writing them at once when the outermost transaction ends,
+        changes are discarded if the block raises an exception
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._pending = OrderedDict()
+            raise
+        finally:
+            self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.commit()
+
+    def invalidate(self, key=None):
+        """
+        forget cached values, e.g. if the camera changed them on its own
+        :param key: the key to forget, None for all keys
+        """
+        if key is None:
+            self._values = {}
+        else:
+            self._values.pop(key, None)
+
+
+class GPhotoCommandError(Exception):
+    """
+    A gphoto2 shell command reported an error, the shell itself is still usable
+    """
+    pass
+
+
+class GPhotoShell(object):
+    """
+    Protocol driver for the interactive gphoto2 shell ('gphoto2 --shell').
+    Commands are queued and executed strictly one after another by a worker thread. The worker watches stdout and
+    stderr with select, recognizes the shell prompt as the end of a command and enforces a deadline per command.
+    All output is consumed, hence nothing piles up in the pipes.
+    A command that reports an error fails with GPhotoCommandError, the shell is only terminated if it does not respond
+    in time or its pipes break.
+    """
+
+    PROMPT = re.compile(r'gphoto2: \{[^}\n]*\}[^>\n]*> ')
+
+    def __init__(self, command='gphoto2 --shell --force-overwrite', startup_timeout=10, default_timeout=5):
+        """
+        :param command: full command string starting the shell
+        :param startup_timeout: max time in seconds until the first prompt has to appear
+        :param default_timeout: deadline in seconds for commands without an explicit timeout
+        """
+        self._command = command
+        self._startup_timeout = startup_timeout
+        self._default_timeout = default_timeout
+        self._process = None
+        self._queue = Queue.Queue()
+        self._worker_thread = None
+
+    def start(self):
+        """
+        start the shell and wait for its first prompt
+        """
+        # gphoto2 translates its messages, errors are recognized by the english text
+        self._process = Popen(shlex.split(self._command), stdin=PIPE, stdout=PIPE, stderr=PIPE, bufsize=0,
+                              env=dict(os.environ, LC_ALL='C'))
+        self._worker_thread = Thread(target=self._worker)
+        self._worker_thread.daemon = True
+        self._worker_thread.start()
+        try:
+            self.execute([], timeout=self._startup_timeout)
+        except Exception as e:
+            self.stop()
+            raise Exception("Gphoto2 shell failed: " + str(e))
+
+    def stop(self):
+        """
+        leave the shell, queued commands that were not executed yet fail
+        """
+        if self._worker_thread:
+            self._queue.put(None)
+            self._worker_thread.join()
+            self._worker_thread = None
+
+    def is_running(self):
+        return self._worker_thread is not None and self._process is not None and self._process.poll() is None
+
+    def execute(self, commands, timeout=None):
+        """
+        Queue commands and wait until the shell finished them
+        :param commands: a command string or a list of commands that are sent in one round trip
+        :param timeout: deadline in seconds for the whole round trip
+        :return: tuple (stdout, stderr) output of the commands
+        """
+        if isinstance(commands, basestring):
+            commands = [commands]
+        if not self.is_running():
+            raise Exception("Gphoto2 shell mode not running")
+        job = {'commands': commands, 'timeout': timeout or self._default_timeout, 'done': Event(),
+               'result': None, 'exception': None}
+        self._queue.put(job)
+        job['done'].wait()
+        if job['exception']:
+            raise job['exception']
+        return job['result']
+
+    def _worker(self):
+        """
+        worker function executing the queued commands
+        """
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if not self.is_running():
+                job['exception'] = Exception("Gphoto2 shell mode not running")
+            else:
+                try:
+                    job['result'] = self._round_trip(job['commands'], job['timeout'])
+                except GPhotoCommandError as e:
+                    # the shell answered with its prompt, it can run the next command
+                    job['exception'] = e
+                except Exception as e:
+                    job['exception'] = e
+                    # the shell is in an unknown state, it is restarted on the next use
+                    self._terminate()
+            job['done'].set()
+
+        self._exit()
+        # fail everything that was queued after the stop request
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if job:
+                job['exception'] = Exception("Gphoto2 shell mode not running")
+                job['done'].set()
+
+    def _round_trip(self, commands, timeout):
+        """
+        send commands and read stdout and stderr until a prompt for each command was received
+        """
+        stdout_fd = self._process.stdout.fileno()
+        stderr_fd = self._process.stderr.fileno()
+        if commands:
+            write(self._process.stdin.fileno(), "\n".join(commands) + "\n")
+
+        expected_prompts = max(len(commands), 1)
+        deadline = time.time() + timeout
+        stdout = ''
+        stderr = ''
+        while len(self.PROMPT.findall(stdout)) < expected_prompts:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise Exception("Gphoto2 shell cmd timed out: " + "; ".join(commands))
+            for fd in select.select([stdout_fd, stderr_fd], [], [], remaining)[0]:
+                data = read(fd, 4096)
+                if not data:
+                    raise Exception("Gphoto2 shell terminated")
+                if fd == stdout_fd:
+                    stdout += data
+                else:
+                    stderr += data
+
+        # stderr is a separate pipe, collect messages written right before the prompt
+        while select.select([stderr_fd], [], [], 0)[0]:
+            data = read(stderr_fd, 4096)
+            if not data:
+                break
+            stderr += data
+
+        if 'Error' in stderr: # the shell runs with LC_ALL=C, see start
+            raise GPhotoCommandError("Shell cmd failed: " + stderr.strip())
+        return stdout, stderr
+
+    def _exit(self):
+        """
+        ask the shell to exit and make sure the process is gone
+        """
+        if self._process and self._process.poll() is None:
+            try:
+                write(self._process.stdin.fileno(), "exit\n")
+            except OSError:
+                pass
+            deadline = time.time() + 2
+            while self._process.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+        self._terminate()
+
+    def _terminate(self):
+        if self._process and self._process.poll() is None:
+            self._process.kill()
+        if self._process:
+            self._process.wait()
+
+
 class GPhotoCMDCamera(AbstractCamera):
     """
     Class wrapping camera access through piggyphoto gphoto2 library for Nikon DSLR, you probably have to adjust it
     for other camera brands
     """
 
-    def __init__(self,  photo_directory, tmp_directory, **kwargs):
+    PREVIEW_MODE_SHELL = 'shell'
+    PREVIEW_MODE_STREAM = 'stream'
+
+    CAPTURE_MODE_PROCESS = 'process'
+    CAPTURE_MODE_TRIGGER = 'trigger'
+
+    CONFIG_VIEWFINDER = '/main/actions/viewfinder'
+
+    def __init__(self,  photo_directory, tmp_directory, preview_mode=PREVIEW_MODE_SHELL,
+                 capture_mode=CAPTURE_MODE_PROCESS, download_timeout=30, shell_timeout=5,
+                 gphoto2_command='gphoto2', **kwargs):
         """
         :param photobooth: app instance
+        :param preview_mode: 'shell' captures every preview frame to a file using the interactive gphoto2 shell,
+                             'stream' reads the frames from a 'gphoto2 --capture-movie --stdout' stream into memory
+        :param capture_mode: 'process' captures with a new 'gphoto2 --capture-image-and-download' process,
+                             'trigger' keeps the gphoto2 shell session open and uses 'trigger-capture'
+        :param download_timeout: max time in seconds to wait for the photo in trigger mode
+        :param shell_timeout: deadline in seconds for a gphoto2 shell command
+        :param gphoto2_command: gphoto2 executable, e.g. the emulator fake_gphoto2.py for testing without camera
         :param kwargs:
         """
         self._photo_directory = photo_directory
         self._tmp_directory = tmp_directory
-        self._shell_p = None
+        self._shell = None
+        self._preview_mode = preview_mode
+        self._capture_mode = capture_mode
+        self._download_timeout = download_timeout
+        self._shell_timeout = shell_timeout
+        self._gphoto2 = gphoto2_command
+        self._preview_stream = None
+        self._preview_frame_id = None
+        self._config = GPhotoConfigCache(write_callback=self._write_config)
 
     def set_memory_capture(self):
         # set capturetarget to memory card
@@ -306,13 +1075,19 @@ class GPhotoCMDCamera(AbstractCamera):
         self._set_config_by_index('/main/settings/capturetarget', 1)
 
     def set_idle(self):
+        self._stop_preview_stream()
         self._disable_shell()
 
     def disable_liveview(self):
-        self._set_config('/main/actions/viewfinder', 0)
+        self._set_config(self.CONFIG_VIEWFINDER, 0)
 
     def enable_liveview(self):
-        self._set_config('/main/actions/viewfinder', 1)
+        self._set_config(self.CONFIG_VIEWFINDER, 1)
+
+    def config_transaction(self):
+        return self._config.transaction()
+
+    supports_jpeg_preview = True
 
     def get_preview(self):
         """
@@ -320,21 +1095,80 @@ class GPhotoCMDCamera(AbstractCamera):
         :return: pygame image
         """
         preview_picture = None
+        data = self.get_preview_jpeg()
+        if data:
+            preview_picture = pygame.image.load(io.BytesIO(data), 'preview.jpg')
+
+        return preview_picture
+
+    def get_preview_jpeg(self):
+        """
+        get an encoded camera preview
+        :return: jpeg data or None
+        """
+        if self._preview_mode == self.PREVIEW_MODE_STREAM:
+            return self._get_stream_preview()
+
+        data = None
         try:
-            if not self._shell_p:
+            if not self._shell:
                 self._enable_shell()
 
             command = "capture-preview "
             self._input_shell(command)
+            # capture-preview implicitly enables liveview
+            self._config.invalidate(self.CONFIG_VIEWFINDER)
             file = 'capture_preview.jpg'
-            preview_picture = pygame.image.load(file)
-            if not preview_picture:
+            with open(file, 'rb') as f:
+                data = f.read()
+            if not data:
                 self._disable_shell()
         except Exception as e :
             print(e)
             pass
 
-        return preview_picture
+        return data
+
+    def _get_stream_preview(self):
+        """
+        get the newest frame of the movie stream, the stream is started on demand
+        :return: jpeg data or None
+        """
+        data = None
+        try:
+            if not self._preview_stream or not self._preview_stream.is_running():
+                self._start_preview_stream()
+
+            frame_id, data = self._preview_stream.get_frame(last_frame_id=self._preview_frame_id)
+            if data:
+                self._preview_frame_id = frame_id
+            else:
+                self._stop_preview_stream()
+        except Exception as e:
+            print(e)
+
+        return data
+
+    def _start_preview_stream(self):
+        """
+        start streaming preview frames from gphoto2 stdout
+        """
+        # the stream process claims the camera exclusively
+        self._disable_shell()
+        self._stop_preview_stream()
+        self._preview_stream = MJPEGStreamReader(self._gphoto2 + " --capture-movie --stdout")
+        self._preview_stream.start()
+
+    def _stop_preview_stream(self):
+        """
+        stop the preview stream, check if it was started at all
+        """
+        if self._preview_stream:
+            self._preview_stream.stop()
+            self._preview_stream = None
+            self._preview_frame_id = None
+            # the camera leaves liveview once gphoto2 releases it
+            self._config.invalidate(self.CONFIG_VIEWFINDER)
 
     def enable_live_autofocus(self):
         try:
@@ -350,127 +1184,232 @@ class GPhotoCMDCamera(AbstractCamera):
         except:
             print('could not change liveview AF settings, please enable AF on lens')
 
-    def take_photo(self):
+    def take_photo_file(self):
         """
         Trigger photo capture
-        :return:  tuple of pygame image and path to file
+        :return: path to file
         """
+        if self._capture_mode == self.CAPTURE_MODE_TRIGGER:
+            return self._trigger_capture_file()()
+
         # disable liveview to use better internal autofocus of camera by disabling shell mode
+        self._stop_preview_stream()
         self._disable_shell()
 
         file = self._photo_directory + "/dsc_" + str(datetime.now()).replace(':','-') + ".jpg"
-        command = "gphoto2  --capture-image-and-download --filename {filename}".format(filename=r'"%s"' % file)
+        command = "{gphoto2}  --capture-image-and-download --filename {filename}".format(gphoto2=self._gphoto2,
+                                                                                         filename=r'"%s"' % file)
         self._execute_process(command)
+        self._config.invalidate(self.CONFIG_VIEWFINDER)
 
-        return pygame.image.load(file), file
+        return file
+
+    def _trigger_capture_file(self):
+        """
+        Release the shutter, the download is finished by the worker
+        :return: function finishing the capture
+        """
+        if self._capture_mode == self.CAPTURE_MODE_TRIGGER:
+            return self._trigger_capture_shell()
+        return self._trigger_capture_process()
+
+    def _trigger_capture_shell(self):
+        """
+        Release the shutter with 'trigger-capture' in the gphoto2 shell, the camera session stays open.
+        The worker collects the photo with 'wait-event-and-download' and the shell is
+        immediately available for previews again afterwards.
+        :return: function finishing the capture
+        """
+        self._stop_preview_stream()
+        if not self._shell:
+            self._enable_shell()
+
+        # disable liveview to use better internal autofocus of camera, both settings are written in one round trip,
+        # the autofocus is skipped if the countdown disabled it already
+        with self.config_transaction():
+            self.disable_live_autofocus()
+            self.disable_liveview()
+        self._input_shell("trigger-capture")
+
+        file = self._photo_directory + "/dsc_" + str(datetime.now()).replace(':','-') + ".jpg"
+
+        def finish():
+            downloaded_file = self._wait_for_download()
+            move(downloaded_file, file)
+            return file
+
+        return finish
+
+    def _wait_for_download(self):
+        """
+        wait until the camera reports the new file and gphoto2 has downloaded it to the working directory
+        :return: path of the downloaded file
+        """
+        stdout, _ = self._input_shell("wait-event-and-download FILEADDED", timeout=self._download_timeout)
+        # this is unfortunately language specific, see ReadMe
+        match = re.search(r'Saving file as (.+?)\s*$', stdout, re.MULTILINE)
+        if not match:
+            raise Exception("Gphoto2 download failed")
+        return match.group(1)
+
+    def _trigger_capture_process(self):
+        """
+        Start the capture process and return once gphoto2 reports the new file on the camera,
+        the download is finished by the worker
+        :return: function finishing the capture
+        """
+        self._stop_preview_stream()
+        self._disable_shell()
+
+        file = self._photo_directory + "/dsc_" + str(datetime.now()).replace(':','-') + ".jpg"
+        command = "{gphoto2}  --capture-image-and-download --filename {filename}".format(gphoto2=self._gphoto2,
+                                                                                         filename=r'"%s"' % file)
+        # gphoto2 writes block buffered into a pipe, the message about the new file would only arrive at its exit
+        if find_executable('stdbuf'):
+            command = "stdbuf -oL " + command
+        # the message is recognized by its english text
+        p = subprocess.Popen(shlex.split(command), shell=False, stdout=PIPE, stderr=subprocess.STDOUT,
+                             env=dict(os.environ, LC_ALL='C'))
+        self._config.invalidate(self.CONFIG_VIEWFINDER)
+
+        self._read_capture_output(p, 'New file is in location', time.time() + self._download_timeout)
+
+        def finish():
+            self._read_capture_output(p, None, time.time() + self._download_timeout)
+            if p.wait() != 0:
+                raise Exception("Gphoto2 capture failed")
+            return file
+
+        return finish
+
+    def _read_capture_output(self, p, text, deadline):
+        """
+        read the output of the capture process until a text appears or the process exits,
+        the process is killed if this takes longer than the deadline
+        :param p: capture process
+        :param text: text to wait for, None waits for the exit
+        :param deadline: time.time() at which the capture fails
+        """
+        fd = p.stdout.fileno()
+        output = ''
+        while text is None or text not in output:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                p.kill()
+                p.wait()
+                raise Exception("Gphoto2 capture timed out")
+            data = read(fd, 4096)
+            if not data:
+                break
+            if text:
+                # keep only the tail, the text might be split between two reads
+                output = output[-len(text):] + data
 
     def _set_config_by_index(self, key, value):
         """
         set a gphoto2 config value using the option index in order to avoid language problems
-        function automatically handles non-shell and shell mode
+        unchanged values are skipped, inside a config transaction the write is deferred
         :param key: config key
         :param value: config value
         """
-        value = int(value)
-
-        if not self._shell_p:
-            command = "gphoto2 --set-config-index {key}={value}".format(key=key, value=value)
-            self._execute_process(command)
-        else:
-
-            command = "set-config-index {key}={value}".format(key=key, value=value)
-            self._input_shell(command)
+        self._config.set(key, int(value), by_index=True)
 
     def _set_config(self, key, value):
         """
         set a gphoto2 config value
-        function automatically handles non-shell and shell mode
+        unchanged values are skipped, inside a config transaction the write is deferred
         :param key: config key
         :param value: config value
         """
+        self._config.set(key, value)
 
-        if not self._shell_p:
-            if isinstance(value, basestring):
-                command = "gphoto2  --set-config {key}={value}".format(key=key, value=r'"%s"' % value)
-            else:
-                command = "gphoto2  --set-config {key}={value}".format(key=key, value=value)
-            self._execute_process(command)
+    def _write_config(self, changes):
+        """
+        write config values with one gphoto2 process or one shell round trip
+        function automatically handles non-shell and shell mode
+        :param changes: list of (key, value, by_index) tuples
+        """
+        if not self._shell:
+            # a running preview stream blocks the camera for other processes
+            self._stop_preview_stream()
+            args = []
+            for key, value, by_index in changes:
+                if by_index:
+                    args.append("--set-config-index {key}={value}".format(key=key, value=value))
+                elif isinstance(value, basestring):
+                    args.append("--set-config {key}={value}".format(key=key, value=r'"%s"' % value))
+                else:
+                    args.append("--set-config {key}={value}".format(key=key, value=value))
+            command = self._gphoto2 + " " + " ".join(args)
+            if self._execute_process(command) != 0:
+                raise Exception("Gphoto2 config failed: " + command)
         else:
-            if isinstance(value, basestring):
-                command = "set-config {key}={value}".format(key=key, value=value)
-            else:
-                command = "set-config {key}={value}".format(key=key, value=value)
+            commands = []
+            for key, value, by_index in changes:
+                if by_index:
+                    commands.append("set-config-index {key}={value}".format(key=key, value=value))
+                else:
+                    commands.append("set-config {key}={value}".format(key=key, value=value))
 
-            self._input_shell(command)
+            self._input_shell(commands)
 
     def _execute_process(self, command):
         """
         Execute a process command
         :param command: full command string
+        :return: process return code
         """
         cmd = shlex.split(command)
 
         p = subprocess.Popen(cmd, shell=False, stderr=subprocess.STDOUT)
-        p.wait()
+        return p.wait()
 
     def _enable_shell(self):
         """
         enable gphoto2 interactive shell mode
         """
-        command = 'gphoto2 --shell --force-overwrite'
-
-        cmd = shlex.split(command)
-
-        if self._shell_p:
+        if self._shell:
             self._disable_shell()
 
-        self._shell_p = subprocess.Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        # set the O_NONBLOCK flag of p.stdout file descriptor:
-        flags = fcntl(self._shell_p.stderr, F_GETFL)  # get current p.stdout flags
-        fcntl(self._shell_p.stderr, F_SETFL, flags | O_NONBLOCK)
-        time.sleep(0.5)
-        if self._shell_p.poll():
-            raise Exception("Gphoto2 shell failed ")
-
+        shell = GPhotoShell(self._gphoto2 + ' --shell --force-overwrite', default_timeout=self._shell_timeout)
+        shell.start()
+        self._shell = shell
 
     def _disable_shell(self):
         """
         disable gphoto2 interactive shell mode
         check if it was started at all
         """
-        if self._shell_p:
+        if self._shell:
             try:
-                self._shell_p.stdin.write('exit\n')
-                self._shell_p.wait()
-                self._shell_p = None
+                self._shell.stop()
             except Exception as e:
                 print("Failed closing shell mode: "+ str(e))
+            self._shell = None
+            self._config.invalidate(self.CONFIG_VIEWFINDER)
 
-    def _input_shell(self, cmd):
+    def _input_shell(self, cmd, timeout=None):
         """
-        send a command to a running interactive gphoto shell
-        :param cmd: the gphoto2 command
+        send a command to a running interactive gphoto shell and wait until it was executed
+        the shell is closed if it does not respond in time, a command error is raised as GPhotoCommandError
+        :param cmd: the gphoto2 command or a list of commands sent in one round trip
+        :param timeout: optional deadline in seconds, defaults to the shell timeout
+        :return: tuple (stdout, stderr) output of the command
         """
-        if self._shell_p and self._shell_p.poll() is None:
-            self._shell_p.stdin.write(cmd + '\n')
-            self._shell_p.stdin.flush()
-            while True:
-                try:
-                    res = self._shell_p.stderr.readline()
-                except Exception as e:
-                    if e.errno == 11: # corresponds to "Resource temporarily unavailable" and indicates we do not have more data
-                        break
-                    else:
-                        raise e
-                if 'Error' in res: # this is unfortunately language specific
-                    self._disable_shell()
-                    raise Exception("Shell cmd failed: " + res)
+        if self._shell and self._shell.is_running():
+            try:
+                return self._shell.execute(cmd, timeout=timeout)
+            except GPhotoCommandError:
+                raise
+            except Exception:
+                self._disable_shell()
+                raise
         else:
-            self._shell_p = None
+            self._disable_shell()
             raise Exception("Gphoto2 shell mode not running")
 
     def close(self):
-        if self._shell_p:
+        if self._shell or self._preview_stream:
             self.set_idle()
 
     def __del__(self):
@@ -478,6 +1417,414 @@ class GPhotoCMDCamera(AbstractCamera):
 
 camera_factory.register_algorithm("gphotocmd", GPhotoCMDCamera)
 
+
+class SharedFrameRing(object):
+    """
+    Ring buffer of encoded preview frames in anonymous shared memory, written by the camera server process
+    and read by the application. Create it before forking the server, the mapping is inherited by the child.
+    """
+
+    HEADER = struct.Struct('=Q')        # id of the latest frame
+    SLOT_HEADER = struct.Struct('=QI')  # frame id, data length
+
+    def __init__(self, slots=3, slot_size=4*1024*1024):
+        """
+        :param slots: number of frames kept in the ring
+        :param slot_size: max size of an encoded frame in bytes
+        """
+        self._slots = slots
+        self._slot_size = slot_size
+        self._memory = mmap.mmap(-1, self.HEADER.size + slots * (self.SLOT_HEADER.size + slot_size))
+        self._lock = multiprocessing.Lock()
+
+    def _slot_offset(self, frame_id):
+        return self.HEADER.size + (frame_id % self._slots) * (self.SLOT_HEADER.size + self._slot_size)
+
+    def write(self, frame_id, data):
+        """
+        store a frame, it replaces the oldest frame in the ring
+        :param frame_id: id of the frame, has to be larger than the ids written before
+        :param data: encoded frame
+        :return: False if the frame does not fit into a slot
+        """
+        if len(data) > self._slot_size:
+            return False
+        offset = self._slot_offset(frame_id)
+        data_offset = offset + self.SLOT_HEADER.size
+        with self._lock:
+            self._memory[data_offset:data_offset + len(data)] = data
+            self.SLOT_HEADER.pack_into(self._memory, offset, frame_id, len(data))
+            self.HEADER.pack_into(self._memory, 0, frame_id)
+        return True
+
+    def latest_id(self):
+        """
+        :return: id of the newest frame, 0 if no frame was written yet
+        """
+        return self.HEADER.unpack_from(self._memory, 0)[0]
+
+    def read(self, frame_id):
+        """
+        :param frame_id: id of the frame
+        :return: encoded frame or None if it was already replaced by a newer one
+        """
+        offset = self._slot_offset(frame_id)
+        data_offset = offset + self.SLOT_HEADER.size
+        if not self._lock.acquire(True, 1.0):
+            return None
+        try:
+            slot_id, length = self.SLOT_HEADER.unpack_from(self._memory, offset)
+            if slot_id != frame_id:
+                return None
+            return self._memory[data_offset:data_offset + length]
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._memory.close()
+
+
+def _camera_server_main(conn, ring, frame_event, backend, backend_kwargs, max_memory):
+    """
+    Main loop of the camera server process. Commands are received as tuples (command, args) and answered with
+    ('ok', result) or ('error', message). While streaming, preview frames are written to the ring between commands.
+    The process ends after its answer if its memory grew by more than max_memory bytes since it started,
+    the client starts a fresh one.
+    """
+    try:
+        cam = camera_factory.create_algorithm(id_class=backend, **backend_kwargs)
+        if not cam.supports_jpeg_preview:
+            raise Exception("Camera type " + backend + " does not provide encoded previews")
+    except Exception as e:
+        conn.send(('error', "Could not create camera: " + str(e)))
+        return
+    conn.send(('ok', os.getpid()))
+
+    # only memory the server allocated itself counts, not the pages of the user interface process shared since the
+    # fork. A full collection touches every inherited object once, they are private afterwards and in the baseline.
+    gc.collect()
+    memory_baseline = read_private_memory()
+
+    frame_id = 0
+    streaming = False
+    frame_interval = 0
+    next_frame_time = 0
+    pending_capture = None
+    transactions = []
+
+    while True:
+        timeout = max(0, next_frame_time - time.time()) if streaming else None
+        if conn.poll(timeout):
+            try:
+                cmd, args = conn.recv()
+            except EOFError:
+                break
+            if cmd == 'exit':
+                break
+            try:
+                result = None
+                if cmd == 'preview':
+                    data = cam.get_preview_jpeg()
+                    if data:
+                        frame_id += 1
+                        if not ring.write(frame_id, data):
+                            raise Exception("Preview frame too large for the frame ring")
+                        result = frame_id
+                elif cmd == 'stream':
+                    streaming, max_fps = args
+                    frame_interval = 1.0 / max_fps if max_fps else 0
+                elif cmd == 'call':
+                    getattr(cam, args[0])()
+                elif cmd == 'take_photo':
+                    # only the path is passed on, the client decodes the photo
+                    result = cam.take_photo_file()
+                elif cmd == 'trigger':
+                    pending_capture = cam._trigger_capture_file()
+                elif cmd == 'finish':
+                    if not pending_capture:
+                        raise Exception("No capture pending")
+                    finish, pending_capture = pending_capture, None
+                    result = finish()
+                elif cmd == 'transaction':
+                    if args[0] == 'begin':
+                        transaction = cam.config_transaction()
+                        transaction.__enter__()
+                        transactions.append(transaction)
+                    elif transactions:
+                        transaction = transactions.pop()
+                        if args[0] == 'commit':
+                            transaction.__exit__(None, None, None)
+                        else:
+                            error = Exception("Transaction aborted")
+                            transaction.__exit__(Exception, error, None)
+                else:
+                    raise Exception("Unknown camera server command " + cmd)
+                conn.send(('ok', result))
+            except Exception as e:
+                conn.send(('error', str(e)))
+        elif streaming:
+            next_frame_time = time.time() + frame_interval
+            try:
+                data = cam.get_preview_jpeg()
+            except Exception as e:
+                print("Camera server preview failed: " + str(e))
+                data = None
+            if data:
+                frame_id += 1
+                if ring.write(frame_id, data):
+                    frame_event.set()
+
+        if max_memory and read_private_memory() - memory_baseline > max_memory:
+            print("Camera server grew by more than %d MB, restarting it" % (max_memory / (1024 * 1024)))
+            break
+
+    try:
+        cam.close()
+    except Exception as e:
+        print("Closing camera failed: " + str(e))
+
+
+class CameraServerCamera(AbstractCamera):
+    """
+    Runs another camera implementation in a separate process, e.g. the leaking gphoto2 library bindings.
+    Camera work does not compete with the user interface for the interpreter lock, preview frames are
+    passed through a shared memory ring and decoded in this process. The server is restarted if it crashes,
+    stops answering or grows by more than max_memory_mb.
+    """
+
+    def __init__(self, photo_directory, tmp_directory, server_backend='gphoto2cffi', max_memory_mb=300,
+                 command_timeout=10, capture_timeout=60, startup_timeout=30, ring_slots=3,
+                 ring_slot_size=4*1024*1024, **kwargs):
+        """
+        :param server_backend: camera type run by the server, it has to support encoded previews
+        :param max_memory_mb: the server is restarted if its memory grows by more than this since its start,
+                              0 disables the limit
+        :param command_timeout: max time in seconds for a camera command
+        :param capture_timeout: max time in seconds for taking a photo
+        :param startup_timeout: max time in seconds for starting the server and opening the camera
+        :param ring_slots: number of preview frames in the shared memory ring
+        :param ring_slot_size: max size of an encoded preview frame
+        :param kwargs: passed to the camera created by the server
+        """
+        self._backend = server_backend
+        self._backend_kwargs = dict(kwargs, photo_directory=photo_directory, tmp_directory=tmp_directory)
+        self._max_memory = max_memory_mb * 1024 * 1024
+        self._command_timeout = command_timeout
+        self._capture_timeout = capture_timeout
+        self._startup_timeout = startup_timeout
+        self._ring_slots = ring_slots
+        self._ring_slot_size = ring_slot_size
+        self._server_lock = RLock()
+        self._process = None
+        self._conn = None
+        self._ring = None
+        self._frame_event = None
+        self._frame_id = 0
+        self._streaming = False
+        self._stream_fps = 0
+        # configuration calls replayed on a restarted server
+        self._state_calls = OrderedDict()
+        self.restart_count = 0
+        self._start_server()
+
+    supports_jpeg_preview = True
+
+    @property
+    def server_pid(self):
+        """
+        :return: process id of the camera server or None
+        """
+        return self._process.pid if self._process else None
+
+    def _start_server(self):
+        self._ring = SharedFrameRing(slots=self._ring_slots, slot_size=self._ring_slot_size)
+        self._frame_event = multiprocessing.Event()
+        self._frame_id = 0
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_camera_server_main,
+                                                args=(child_conn, self._ring, self._frame_event, self._backend,
+                                                      self._backend_kwargs, self._max_memory))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+
+        reply = self._exchange(None, timeout=self._startup_timeout)
+        if not reply or reply[0] != 'ok':
+            self._stop_server()
+            raise Exception("Could not start camera server: " + (reply[1] if reply else "no answer"))
+
+        for method in self._state_calls.values():
+            reply = self._exchange(('call', (method,)), timeout=self._command_timeout)
+            if not reply or reply[0] != 'ok':
+                print("Camera server could not restore " + method)
+        if self._streaming:
+            self._exchange(('stream', (True, self._stream_fps)), timeout=self._command_timeout)
+
+    def _stop_server(self):
+        if self._process:
+            if self._process.is_alive():
+                try:
+                    self._conn.send(('exit', ()))
+                except (IOError, EOFError):
+                    pass
+                self._process.join(2)
+                if self._process.is_alive():
+                    self._process.terminate()
+            self._process.join()
+            self._process = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+        if self._ring:
+            self._ring.close()
+            self._ring = None
+
+    def _restart_server(self):
+        self.restart_count += 1
+        self._stop_server()
+        self._start_server()
+
+    def _exchange(self, request, timeout):
+        """
+        send a request and wait for the answer without any error handling
+        :param request: tuple (command, args) or None to only receive
+        :return: answer tuple (status, result) or None if the server crashed or did not answer in time
+        """
+        try:
+            if request:
+                self._conn.send(request)
+            if not self._conn.poll(timeout):
+                return None
+            return self._conn.recv()
+        except (IOError, EOFError):
+            return None
+
+    def _request(self, cmd, args=(), timeout=None):
+        """
+        execute a command in the camera server, a crashed or hanging server is restarted
+        :return: result of the command
+        """
+        with self._server_lock:
+            if not self._process.is_alive():
+                print("Camera server exited with code " + str(self._process.exitcode) + ", restarting it")
+                self._restart_server()
+            reply = self._exchange((cmd, args), timeout or self._command_timeout)
+            if reply is None:
+                self._restart_server()
+                raise Exception("Camera server failed executing " + cmd + ", restarted it")
+            status, result = reply
+            if status != 'ok':
+                raise Exception(result)
+            return result
+
+    def _call_state(self, key, method):
+        self._state_calls[key] = method
+        self._request('call', (method,))
+
+    def set_memory_capture(self):
+        self._call_state('capture_target', 'set_memory_capture')
+
+    def set_idle(self):
+        self._request('call', ('set_idle',))
+
+    def enable_live_autofocus(self):
+        self._call_state('live_autofocus', 'enable_live_autofocus')
+
+    def disable_live_autofocus(self):
+        self._call_state('live_autofocus', 'disable_live_autofocus')
+
+    @contextmanager
+    def config_transaction(self):
+        self._request('transaction', ('begin',))
+        try:
+            yield
+        except:
+            self._request('transaction', ('abort',))
+            raise
+        self._request('transaction', ('commit',))
+
+    def get_preview(self):
+        data = self.get_preview_jpeg()
+        if data:
+            return pygame.image.load(io.BytesIO(data), 'preview.jpg')
+        return None
+
+    def get_preview_jpeg(self):
+        """
+        get an encoded preview, the newest streamed frame while the preview stream is running
+        :return: jpeg data or None
+        """
+        if self._streaming:
+            return self._wait_for_stream_frame(1.0)
+        frame_id = self._request('preview')
+        if frame_id is None:
+            return None
+        self._frame_id = frame_id
+        return self._ring.read(frame_id)
+
+    def _wait_for_stream_frame(self, timeout):
+        """
+        wait for a streamed frame that is newer than the last returned one
+        :return: jpeg data or None if no frame arrived in time
+        """
+        end_time = time.time() + timeout
+        while True:
+            with self._server_lock:
+                if not self._process.is_alive():
+                    print("Camera server exited with code " + str(self._process.exitcode) + ", restarting it")
+                    self._restart_server()
+                    return None
+                ring = self._ring
+                frame_event = self._frame_event
+            latest_id = ring.latest_id()
+            if latest_id > self._frame_id:
+                self._frame_id = latest_id
+                data = ring.read(latest_id)
+                if data:
+                    return data
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return None
+            frame_event.clear()
+            if ring.latest_id() == latest_id:
+                # wake up regularly to notice a crashed server
+                frame_event.wait(min(remaining, 0.5))
+
+    def start_preview_stream(self, max_fps=30, size=None, mirror=False, frame_callback=None):
+        with self._server_lock:
+            self._request('stream', (True, max_fps))
+            self._streaming = True
+            self._stream_fps = max_fps
+        super(CameraServerCamera, self).start_preview_stream(max_fps=max_fps, size=size, mirror=mirror,
+                                                             frame_callback=frame_callback)
+
+    def stop_preview_stream(self):
+        super(CameraServerCamera, self).stop_preview_stream()
+        if self._streaming:
+            self._streaming = False
+            try:
+                self._request('stream', (False, 0))
+            except Exception as e:
+                print("Stopping the camera server stream failed: " + str(e))
+
+    def take_photo_file(self):
+        return self._request('take_photo', timeout=self._capture_timeout)
+
+    def _trigger_capture_file(self):
+        self._request('trigger', timeout=self._capture_timeout)
+
+        def finish():
+            return self._request('finish', timeout=self._capture_timeout)
+
+        return finish
+
+    def close(self):
+        if self._process:
+            self.stop_preview_stream()
+            self._stop_server()
+
+camera_factory.register_algorithm("camera_server", CameraServerCamera)
+
 if __name__ == '__main__':
 
     cam = GPhotoCMDCamera('images', 'tmp')
@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+"""
+Benchmark for the registered camera backends
+
+Measures per backend:
+    preview fps and p50/p99 latency of scaled preview frames
+    trigger (shutter) and capture-to-file latency
+    config set latency (live autofocus on/off)
+    recovery time (new camera instance until the first preview frame)
+
+Without a camera attached use --fake to benchmark the gphotocmd backend against fake_gphoto2.py, e.g.
+    python camera_bench.py --fake --backends dummy gphotocmd
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from timeit import default_timer as timer
+
+import pygame
+
+from camera import get_camera_factory
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, p):
+    """
+    nearest rank percentile
+    :param values: list of numbers
+    :param p: percentile in range 0..100
+    :return: percentile value or None for an empty list
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def bench_preview(cam, frames, size):
+    latencies = []
+    start = timer()
+    for _ in range(frames):
+        t = timer()
+        cam.get_preview_scaled(size, True)
+        latencies.append(timer() - t)
+    total = timer() - start
+    return {'preview_fps': frames / total,
+            'preview_p50': percentile(latencies, 50),
+            'preview_p99': percentile(latencies, 99)}
+
+
+def bench_capture(cam, captures, size):
+    trigger_latencies = []
+    file_latencies = []
+    for _ in range(captures):
+        start = timer()
+        handle = cam.take_photo_async(screen_size=size)
+        trigger_latencies.append(timer() - start)
+        handle.result()
+        file_latencies.append(timer() - start)
+        # preview has to work again after each capture
+        cam.get_preview()
+    return {'trigger_p50': percentile(trigger_latencies, 50),
+            'capture_p50': percentile(file_latencies, 50),
+            'capture_p99': percentile(file_latencies, 99)}
+
+
+def bench_config(cam, changes):
+    latencies = []
+    for i in range(changes):
+        start = timer()
+        if i % 2 == 0:
+            cam.enable_live_autofocus()
+        else:
+            cam.disable_live_autofocus()
+        latencies.append(timer() - start)
+    return {'config_p50': percentile(latencies, 50),
+            'config_p99': percentile(latencies, 99)}
+
+
+def create_camera(backend, kwargs):
+    return get_camera_factory().create_algorithm(id_class=backend, **kwargs)
+
+
+def bench_recovery(cam, backend, kwargs):
+    """
+    time to replace a camera instance, like the photobooth does after camera errors
+    :return: tuple of (result dict, new camera)
+    """
+    start = timer()
+    cam.close()
+    cam = create_camera(backend, kwargs)
+    cam.get_preview()
+    return {'recovery': timer() - start}, cam
+
+
+def bench_backend(backend, args, work_dir):
+    photo_dir = os.path.join(work_dir, backend, 'images')
+    tmp_dir = os.path.join(work_dir, backend, 'tmp')
+    os.makedirs(photo_dir)
+    shutil.copytree(os.path.join(BASE_DIR, 'tmp'), tmp_dir)
+    if not os.path.exists(os.path.join(tmp_dir, 'dummy_snap.jpg')):
+        shutil.copyfile(args.photo_image, os.path.join(tmp_dir, 'dummy_snap.jpg'))
+
+    # backends ignore the arguments of other backends
+    kwargs = {'photo_directory': photo_dir, 'tmp_directory': tmp_dir, 'preview_mode': args.preview_mode,
+              'capture_mode': args.capture_mode, 'server_backend': args.server_backend}
+    if args.fake:
+        kwargs['gphoto2_command'] = '"%s" "%s"' % (sys.executable, os.path.join(BASE_DIR, 'fake_gphoto2.py'))
+
+    # the gphoto2 backends work relative to the current directory
+    cwd = os.getcwd()
+    os.chdir(os.path.join(work_dir, backend))
+    results = {}
+    cam = None
+    try:
+        start = timer()
+        cam = create_camera(backend, kwargs)
+        cam.get_preview()
+        results['startup'] = timer() - start
+        results.update(bench_preview(cam, args.frames, args.size))
+        results.update(bench_config(cam, args.config_changes))
+        results.update(bench_capture(cam, args.captures, args.size))
+        recovery, cam = bench_recovery(cam, backend, kwargs)
+        results.update(recovery)
+    except Exception as e:
+        results['error'] = str(e)
+    finally:
+        if cam is not None:
+            cam.close()
+        os.chdir(cwd)
+    return results
+
+
+COLUMNS = [('startup', 's'), ('preview_fps', ''), ('preview_p50', 's'), ('preview_p99', 's'),
+           ('config_p50', 's'), ('config_p99', 's'), ('trigger_p50', 's'), ('capture_p50', 's'),
+           ('capture_p99', 's'), ('recovery', 's')]
+
+
+def print_results(all_results):
+    print('%-12s' % 'backend' + ''.join('%13s' % name for name, _ in COLUMNS))
+    for backend, results in all_results:
+        line = '%-12s' % backend
+        for name, unit in COLUMNS:
+            value = results.get(name)
+            line += '%13s' % ('-' if value is None else '%.3f%s' % (value, unit))
+        print(line)
+        if 'error' in results:
+            print('  error: ' + results['error'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the camera backends')
+    parser.add_argument('--backends', nargs='+', default=get_camera_factory().get_algorithm_ids(),
+                        help='backends to benchmark, available: ' + ', '.join(get_camera_factory().get_algorithm_ids()))
+    parser.add_argument('--frames', type=int, default=100, help='number of preview frames')
+    parser.add_argument('--captures', type=int, default=3, help='number of photos')
+    parser.add_argument('--config-changes', type=int, default=10, help='number of config changes')
+    parser.add_argument('--size', type=int, nargs=2, default=[800, 480], help='preview size')
+    parser.add_argument('--preview-mode', default='shell', help='gphotocmd preview mode (shell or stream)')
+    parser.add_argument('--capture-mode', default='process', help='gphotocmd capture mode (process or trigger)')
+    parser.add_argument('--server-backend', default='dummy', help='camera type run by the camera_server backend')
+    parser.add_argument('--fake', action='store_true', help='use fake_gphoto2.py instead of gphoto2')
+    parser.add_argument('--photo-image', default=os.path.join(BASE_DIR, 'tmp', 'dummy_preview00.jpg'),
+                        help='photo used if tmp/dummy_snap.jpg does not exist')
+    for name in ['startup', 'preview', 'capture', 'download', 'config']:
+        parser.add_argument('--fake-%s-delay' % name, type=float, help='fake gphoto2 %s delay in seconds' % name)
+    parser.add_argument('--fake-failure-rate', type=float, help='fake gphoto2 probability for command errors')
+    args = parser.parse_args()
+    args.size = tuple(args.size)
+
+    for name in ['startup', 'preview', 'capture', 'download', 'config']:
+        value = getattr(args, 'fake_%s_delay' % name)
+        if value is not None:
+            os.environ['FAKE_GPHOTO2_%s_DELAY' % name.upper()] = str(value)
+    if args.fake_failure_rate is not None:
+        os.environ['FAKE_GPHOTO2_FAILURE_RATE'] = str(args.fake_failure_rate)
+    if args.fake:
+        os.environ.setdefault('FAKE_GPHOTO2_PHOTO_IMAGE', os.path.abspath(args.photo_image))
+
+    pygame.init()
+    work_dir = tempfile.mkdtemp(prefix='camera_bench_')
+    all_results = []
+    try:
+        for backend in args.backends:
+            print('Benchmarking ' + backend)
+            all_results.append((backend, bench_backend(backend, args, work_dir)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_results(all_results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import pygame
+from collections import OrderedDict
+
+
+def _hashable(value):
+    """
+    convert lists and dicts of drawing arguments to hashable tuples
+    """
+    if isinstance(value, list) or isinstance(value, tuple):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+class Layer(object):
+    """
+    One drawing call of a frame. Layers with equal keys draw the same pixels.
+    """
+
+    def __init__(self, key, rect, function, args, kwargs):
+        self.key = key
+        self.rect = rect
+        self._function = function
+        self._args = args
+        self._kwargs = kwargs
+
+    def draw(self, screen):
+        self._function(screen, *self._args, **self._kwargs)
+
+
+class Compositor(object):
+    """
+    Collects the drawing calls of a frame as layers and only repaints and updates the screen regions whose layers
+    changed since the last frame. Static screens do not cause any drawing or display updates.
+
+    Each frame begins with begin_frame(), the states add their layers from bottom to top with draw() or
+    draw_background(), update() repaints the changed regions and pushes them to the display.
+    Layers are drawn by the usual drawing functions of pygame_utils, all of them take the screen as first argument.
+    Anything drawn directly to the screen, like the wait message thread, has to call invalidate() afterwards.
+    The layers are drawn to the surface of the render target (see pygame_utils.RenderTarget) if one is set,
+    otherwise directly to the display.
+    """
+
+    def __init__(self, max_cached_bounds=256, full_update_ratio=0.5):
+        """
+        :param max_cached_bounds: number of cached layer bounds
+        :param full_update_ratio: the entire screen is updated at once if the changed area is larger than this ratio
+        """
+        self._layers = []
+        self._shown_layers = []
+        self._bounds = OrderedDict()
+        self._max_cached_bounds = max_cached_bounds
+        self._full_update_ratio = full_update_ratio
+        self._measure_surface = None
+        self._invalid = True
+        self._target = None
+        self.updated_rects = []
+
+    def set_target(self, target):
+        """
+        :param target: pygame_utils.RenderTarget the layers are drawn to, None draws to the display
+        """
+        self._target = target
+        self._measure_surface = None
+        self._bounds.clear()
+        self.invalidate()
+
+    def _surface(self):
+        if self._target:
+            return self._target.surface
+        return pygame.display.get_surface()
+
+    def begin_frame(self):
+        self._layers = []
+
+    def invalidate(self):
+        """
+        repaint the entire screen with the next update, e.g. after drawing directly to the screen
+        """
+        self._invalid = True
+
+    def draw(self, function, *args, **kwargs):
+        """
+        Add a layer drawn by function(screen, *args, **kwargs). The arguments identify the layer content,
+        its bounds are measured once per distinct argument set.
+        """
+        key = (function, _hashable(args), _hashable(kwargs))
+        self._layers.append(Layer(key, self._get_bounds(key, function, args, kwargs), function, args, kwargs))
+
+    def draw_background(self, function, *args, **kwargs):
+        """
+        Add a layer covering the entire screen, e.g. a camera preview or photo. Its bounds are not measured.
+        """
+        key = (function, _hashable(args), _hashable(kwargs))
+        rect = self._surface().get_rect()
+        self._layers.append(Layer(key, rect, function, args, kwargs))
+
+    def _get_bounds(self, key, function, args, kwargs):
+        """
+        measure the bounding rectangle of a layer by drawing it to a transparent surface
+        """
+        rect = self._bounds.pop(key, None)
+        if rect is None:
+            size = self._surface().get_size()
+            if not self._measure_surface or self._measure_surface.get_size() != size:
+                self._measure_surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+            self._measure_surface.fill((0, 0, 0, 0))
+            function(self._measure_surface, *args, **kwargs)
+            # inflate to be safe with anti-aliased edges
+            rect = self._measure_surface.get_bounding_rect().inflate(4, 4)
+            while self._bounds and len(self._bounds) >= self._max_cached_bounds:
+                self._bounds.popitem(last=False)
+        self._bounds[key] = rect
+        return rect
+
+    def _dirty_rects(self, screen_rect):
+        """
+        :return: list of screen regions whose layers changed since the last update
+        """
+        if self._invalid:
+            return [screen_rect]
+
+        shown = dict((layer.key, i) for i, layer in enumerate(self._shown_layers))
+        current = dict((layer.key, i) for i, layer in enumerate(self._layers))
+        rects = []
+        for i, layer in enumerate(self._layers):
+            # new layers or layers with a different layer order
+            if shown.get(layer.key, -1) != i:
+                rects.append(layer.rect)
+        for i, layer in enumerate(self._shown_layers):
+            if current.get(layer.key, -1) != i:
+                rects.append(layer.rect)
+        rects = [rect.clip(screen_rect) for rect in rects if rect.width and rect.height]
+
+        # merge overlapping regions
+        merged = []
+        for rect in rects:
+            i = rect.collidelist(merged)
+            while i >= 0:
+                rect = rect.union(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+
+        area = sum(rect.width * rect.height for rect in merged)
+        if area > self._full_update_ratio * screen_rect.width * screen_rect.height:
+            return [screen_rect]
+        return merged
+
+    def update(self):
+        """
+        repaint the changed regions of the current frame and push them to the display
+        :return: list of updated rectangles
+        """
+        screen = self._surface()
+        rects = self._dirty_rects(screen.get_rect())
+        for rect in rects:
+            screen.set_clip(rect)
+            for layer in self._layers:
+                if layer.rect.colliderect(rect):
+                    layer.draw(screen)
+        screen.set_clip(None)
+
+        if rects:
+            if self._target:
+                self._target.update(rects)
+            else:
+                pygame.display.update(rects)
+        self._shown_layers = self._layers
+        self._layers = list(self._layers)
+        self._invalid = False
+        self.updated_rects = rects
+        return rects
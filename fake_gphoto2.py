@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+"""
+Minimal gphoto2 command line emulator for testing and benchmarking without a camera.
+
+It understands the subset of gphoto2 used by the GPhotoCMDCamera backend:
+    --shell (capture-preview, set-config, set-config-index, trigger-capture, wait-event-and-download,
+             capture-image-and-download, exit)
+    --capture-movie --stdout
+    --capture-image-and-download --filename FILE
+    --set-config KEY=VALUE, --set-config-index KEY=INDEX
+
+Delays and failures are configured with environment variables (delays in seconds):
+    FAKE_GPHOTO2_STARTUP_DELAY   camera open time of every process (default 0.1)
+    FAKE_GPHOTO2_PREVIEW_DELAY   time per preview frame (default 0.03)
+    FAKE_GPHOTO2_CAPTURE_DELAY   shutter and autofocus time (default 0.3)
+    FAKE_GPHOTO2_DOWNLOAD_DELAY  photo download time (default 0.5)
+    FAKE_GPHOTO2_CONFIG_DELAY    time per config change (default 0.05)
+    FAKE_GPHOTO2_FAILURE_RATE    probability that a command fails with an error (default 0)
+    FAKE_GPHOTO2_PREVIEW_IMAGES  colon separated jpeg files used as preview frames
+    FAKE_GPHOTO2_PHOTO_IMAGE     jpeg file used as captured photo
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import getopt
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROMPT = 'gphoto2: {{{cwd}}} /> '
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+STARTUP_DELAY = _env_float('FAKE_GPHOTO2_STARTUP_DELAY', 0.1)
+PREVIEW_DELAY = _env_float('FAKE_GPHOTO2_PREVIEW_DELAY', 0.03)
+CAPTURE_DELAY = _env_float('FAKE_GPHOTO2_CAPTURE_DELAY', 0.3)
+DOWNLOAD_DELAY = _env_float('FAKE_GPHOTO2_DOWNLOAD_DELAY', 0.5)
+CONFIG_DELAY = _env_float('FAKE_GPHOTO2_CONFIG_DELAY', 0.05)
+FAILURE_RATE = _env_float('FAKE_GPHOTO2_FAILURE_RATE', 0)
+
+PREVIEW_IMAGES = os.environ.get('FAKE_GPHOTO2_PREVIEW_IMAGES',
+                                os.path.join(BASE_DIR, 'tmp', 'dummy_preview00.jpg') + ':' +
+                                os.path.join(BASE_DIR, 'tmp', 'dummy_preview01.jpg')).split(':')
+PHOTO_IMAGE = os.environ.get('FAKE_GPHOTO2_PHOTO_IMAGE', PREVIEW_IMAGES[0])
+
+
+class FakeCamera(object):
+    """
+    State of the emulated camera
+    """
+
+    def __init__(self):
+        self.config = {}
+        self.preview_cnt = 0
+        self.photo_cnt = 0
+        self.pending_photos = 0
+        self.previews = []
+        for file in PREVIEW_IMAGES:
+            with open(file, 'rb') as f:
+                self.previews.append(f.read())
+
+    def fail(self):
+        """
+        :return: True if the current command should fail
+        """
+        if FAILURE_RATE > 0 and random.random() < FAILURE_RATE:
+            sys.stderr.write("*** Error (-7: 'I/O problem') ***\n")
+            sys.stderr.flush()
+            return True
+        return False
+
+    def next_preview(self):
+        time.sleep(PREVIEW_DELAY)
+        self.preview_cnt = (self.preview_cnt + 1) % len(self.previews)
+        return self.previews[self.preview_cnt]
+
+    def capture_preview(self):
+        with open('capture_preview.jpg', 'wb') as f:
+            f.write(self.next_preview())
+        print('Saving file as capture_preview.jpg')
+
+    def set_config(self, assignment):
+        key, _, value = assignment.partition('=')
+        time.sleep(CONFIG_DELAY)
+        self.config[key.strip()] = value.strip()
+
+    def trigger(self):
+        time.sleep(CAPTURE_DELAY)
+        self.pending_photos += 1
+        self.config['/main/actions/viewfinder'] = '0'
+
+    def download(self, filename=None):
+        """
+        download the oldest pending photo
+        :return: name of the written file
+        """
+        self.pending_photos -= 1
+        camera_name = 'capt%04d.jpg' % self.photo_cnt
+        self.photo_cnt += 1
+        print('New file is in location /store_00010001/DCIM/100NIKON/%s on the camera' % camera_name)
+        sys.stdout.flush()
+        time.sleep(DOWNLOAD_DELAY)
+        filename = filename or camera_name
+        shutil.copyfile(PHOTO_IMAGE, filename)
+        print('Saving file as %s' % filename)
+        return filename
+
+
+def run_shell(camera):
+    """
+    emulate the interactive shell, a prompt is printed after startup and after each command
+    """
+    def prompt():
+        sys.stdout.write(PROMPT.format(cwd=os.getcwd()))
+        sys.stdout.flush()
+
+    prompt()
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        args = line.split()
+        if not args:
+            prompt()
+            continue
+        cmd = args[0]
+        if cmd in ('exit', 'quit', 'q'):
+            break
+        if not camera.fail():
+            if cmd == 'capture-preview':
+                camera.capture_preview()
+            elif cmd in ('set-config', 'set-config-index', 'set-config-value') and len(args) > 1:
+                camera.set_config(args[1])
+            elif cmd == 'trigger-capture':
+                camera.trigger()
+            elif cmd == 'capture-image-and-download':
+                camera.trigger()
+                camera.download()
+            elif cmd == 'wait-event-and-download':
+                if camera.pending_photos > 0:
+                    print('FILEADDED capt%04d.jpg /store_00010001/DCIM/100NIKON' % camera.photo_cnt)
+                    camera.download()
+                else:
+                    time.sleep(1)
+            else:
+                sys.stderr.write("*** Error: Unknown command '%s' ***\n" % cmd)
+                sys.stderr.flush()
+        sys.stdout.flush()
+        prompt()
+
+
+def run_movie(camera):
+    """
+    write an endless motion jpeg stream to stdout
+    """
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    sys.stderr.write("Capturing preview frames as movie to 'stdout'. Press Ctrl-C to abort.\n")
+    try:
+        while True:
+            out.write(camera.next_preview())
+            out.flush()
+    except (IOError, KeyboardInterrupt):
+        pass
+
+
+def main(argv):
+    opts, _ = getopt.getopt(argv, '', ['shell', 'force-overwrite', 'capture-movie', 'stdout',
+                                       'capture-image-and-download', 'filename=', 'set-config=',
+                                       'set-config-index='])
+    time.sleep(STARTUP_DELAY)
+    camera = FakeCamera()
+    options = [opt for opt, _ in opts]
+
+    if '--shell' in options:
+        run_shell(camera)
+        return 0
+    if '--capture-movie' in options:
+        run_movie(camera)
+        return 0
+
+    for opt, value in opts:
+        if opt in ('--set-config', '--set-config-index'):
+            if camera.fail():
+                return 1
+            camera.set_config(value)
+
+    if '--capture-image-and-download' in options:
+        if camera.fail():
+            return 1
+        camera.trigger()
+        camera.download(dict(opts).get('--filename'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,4 +1,5 @@
 from decoration import Decoration
+from instagram_filters import native
 
 
 class Border(Decoration):
@@ -10,6 +11,7 @@ class Border(Decoration):
     def apply(self, filter):
         filter.add_filter_step(
             process_step_cmd="-bordercolor {color} -border {bwidth}x{bwidth}",
+            native_operation=filter._native_operation(native.Border, self.color, self.width),
             color=self.color,
             bwidth=self.width
         )
\ No newline at end of file
@@ -1,4 +1,5 @@
 from decoration import Decoration
+from instagram_filters import native
 
 import os, inspect
 
@@ -10,7 +11,9 @@ class Frame(Decoration):
 
     def apply(self, filter):
         path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+        frame = os.path.join(path, "frames", self.frame)
         filter.add_filter_step(
             process_step_cmd="\( '{frame}' -resize {width}x{width}! -unsharp 1.5x1.0+1.5+0.02 \) -flatten",
-            frame = os.path.join(path, "frames", self.frame)
+            native_operation=filter._native_operation(native.Overlay, frame, 'NorthWest', (0, 0), True, True),
+            frame = frame
         )
\ No newline at end of file
@@ -1,4 +1,5 @@
 from decoration import Decoration
+from instagram_filters import native
 
 class Logo(Decoration):
 
@@ -9,6 +10,7 @@ class Logo(Decoration):
 
         filter.add_filter_step(
             process_step_cmd="'{logo}' -gravity NorthEast -geometry +200+150 -composite",
+            native_operation=filter._native_operation(native.Overlay, self.logo_path, 'NorthEast', (200, 150)),
             logo=self.logo_path
         )
 
@@ -1,5 +1,6 @@
 
 from decoration import Decoration
+from instagram_filters import native
 import math
 
 
@@ -19,6 +20,7 @@ class Vignette(Decoration):
 
         filter.add_filter_step(
             process_step_cmd="\( -size {crop_x}x{crop_y} radial-gradient:{color_1}-{color_2} -gravity center -crop {width}x{height}+0+0 +repage \) -compose multiply -flatten",
+            native_operation=filter._native_operation(native.Vignette, self.color_1, self.color_2, self.crop_factor),
             crop_x=crop_x,
             crop_y=crop_y,
             color_1=self.color_1,
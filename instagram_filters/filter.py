@@ -3,24 +3,44 @@
 from PIL import Image
 
 import imagemagick
+import native
+import lut
+
+BACKEND_IMAGEMAGICK = 'imagemagick'
+BACKEND_NATIVE = 'native'
+# native with runs of point-wise steps compiled to cached 3D color lookup tables, see lut
+BACKEND_LUT = 'lut'
+# lut if numpy is available and all steps have a native implementation, otherwise imagemagick
+BACKEND_AUTO = 'auto'
 
 class Filter(imagemagick.Convert):
     """
     Common image filter class
+    Every filter step is registered as ImageMagick command and as native (NumPy/PIL) operation, the backend
+    that applies the steps can be chosen per apply call.
     """
 
-    def __init__(self, filename, output_filename=None, width=None, height=None):
+    def __init__(self, filename, output_filename=None, width=None, height=None, backend=BACKEND_IMAGEMAGICK,
+                 cancel_event=None, memory_limit=None):
         """
         :param filename: input file path
         :param output_filename:  output file path, if None, input file will be replaced
         :param width: optional width of the image, might speed up filter process
         :param height: optional height of the image, might speed up filter process
+        :param backend: default backend of apply, 'imagemagick', 'native', 'lut' or 'auto'
+        :param cancel_event: optional threading.Event, apply stops with an exception once it is set
+        :param memory_limit: optional limit in bytes of the imagemagick pixel cache in memory
         """
         if not output_filename:
             output_filename = filename
         super(Filter, self).__init__(input_file=filename,output_file=output_filename)
 
         self._image = False
+        self.backend = backend
+        self.cancel_event = cancel_event
+        self.memory_limit = memory_limit
+        # native operation of each filter step, None if a step has no native implementation
+        self._native_operations = []
 
         if not width or not height:
             image = self.image()
@@ -32,6 +52,7 @@ class Filter(imagemagick.Convert):
 
         self._post_decorations = []
         self._pre_decorations = []
+        self._steps_registered = False
 
     def close_image(self):
         if self._image:
@@ -42,6 +63,35 @@ class Filter(imagemagick.Convert):
             self._image = Image.open(self.input_file)
         return self._image
 
+    def add_filter_step(self, process_step_cmd, native_operation=None, **kwargs):
+        """
+        Registers a new filter step
+        :param process_step_cmd: imagemagick sub command string
+        :param native_operation: native.Operation doing the same, None if the step is only supported by imagemagick
+        :param kwargs: parameters of the command string
+        """
+        super(Filter, self).add_filter_step(process_step_cmd, **kwargs)
+        self._native_operations.append(native_operation)
+
+    def clear_filter_steps(self):
+        super(Filter, self).clear_filter_steps()
+        self._native_operations = []
+
+    def _native_operation(self, operation_class, *args):
+        """
+        :return: native operation or None if the native backend is not available
+        """
+        if native.is_available():
+            return operation_class(*args)
+        return None
+
+    def supports_native(self):
+        """
+        :return: True if the native backend can apply all steps of the filter
+        """
+        self._register_steps()
+        return native.is_available() and None not in self._native_operations
+
     def colortone(self, color, level, type = 0):
 
         arg0 = level
@@ -51,10 +101,59 @@ class Filter(imagemagick.Convert):
         else:
             negate = ''
 
-        self.add_filter_step(process_step_cmd="\( -clone 0 -fill '{color}' -colorize 100% \)", color=color)
-        self.add_filter_step(process_step_cmd="\( -clone 0 -colorspace gray {negate} \)", negate = negate)
-        self.add_filter_step(process_step_cmd="-compose blend -define compose:args={arg0},{arg1}", arg0 = arg0, arg1 = arg1)
-        self.add_filter_step(process_step_cmd="-composite")
+        self.add_filter_step(process_step_cmd="\( -clone 0 -fill '{color}' -colorize 100% \) "
+                                              "\( -clone 0 -colorspace gray {negate} \) "
+                                              "-compose blend -define compose:args={arg0},{arg1} -composite",
+                             native_operation=self._native_operation(native.ColorTone, color, level, type == 0),
+                             color=color, negate=negate, arg0=arg0, arg1=arg1)
+
+    def modulate(self, brightness, saturation=100, hue=100):
+        self.add_filter_step(process_step_cmd="-modulate {brightness},{saturation},{hue}",
+                             native_operation=self._native_operation(native.Modulate, brightness, saturation, hue),
+                             brightness=brightness, saturation=saturation, hue=hue)
+
+    def colorize(self, color, percent):
+        self.add_filter_step(process_step_cmd="-fill '{color}' -colorize {percent}",
+                             native_operation=self._native_operation(native.Colorize, color, percent),
+                             color=color, percent=percent)
+
+    def gamma(self, value):
+        self.add_filter_step(process_step_cmd="-gamma {value}",
+                             native_operation=self._native_operation(native.Gamma, value),
+                             value=value)
+
+    def auto_gamma(self):
+        self.add_filter_step(process_step_cmd="-auto-gamma",
+                             native_operation=self._native_operation(native.AutoGamma))
+
+    def contrast(self, sharpen=True):
+        self.add_filter_step(process_step_cmd="-contrast" if sharpen else "+contrast",
+                             native_operation=self._native_operation(native.Contrast, sharpen))
+
+    def sigmoidal_contrast(self, contrast, midpoint=50):
+        self.add_filter_step(process_step_cmd="-sigmoidal-contrast {contrast},{midpoint}%",
+                             native_operation=self._native_operation(native.SigmoidalContrast, contrast, midpoint),
+                             contrast=contrast, midpoint=midpoint)
+
+    def level(self, black_point, white_point=100, gamma=1.0, channels='RGB'):
+        self.add_filter_step(process_step_cmd="-channel {channels} -level {black}%,{white}%,{level_gamma} +channel",
+                             native_operation=self._native_operation(native.Level, black_point, white_point, gamma, channels),
+                             channels=channels, black=black_point, white=white_point, level_gamma=gamma)
+
+    def gray_polynomial(self, terms):
+        """
+        gray image of the weighted channels
+        :param terms: list of (weight, exponent) for red, green and blue
+        """
+        poly = ', '.join('%s,%s' % term for term in terms)
+        self.add_filter_step(process_step_cmd="-separate -poly '{poly}'",
+                             native_operation=self._native_operation(native.GrayPolynomial, terms),
+                             poly=poly)
+
+    def multiply_color(self, color):
+        self.add_filter_step(process_step_cmd="\( -size {width}x{height} xc:'{color}' \) -compose multiply -composite",
+                             native_operation=self._native_operation(native.MultiplyColor, color),
+                             color=color)
 
     def _filter_callback(self):
         """
@@ -69,10 +168,80 @@ class Filter(imagemagick.Convert):
     def add_pre_decoration(self, decoration):
         self._pre_decorations.append(decoration)
 
-    def apply(self):
+    def _register_steps(self):
+        """
+        Register the steps of the decorations and the filter, only once
+        """
+        if self._steps_registered:
+            return
+        self._steps_registered = True
         for decorator in self._pre_decorations:
             decorator.apply(filter=self)
         self._filter_callback()
         for decorator in self._post_decorations:
             decorator.apply(filter=self)
-        super(Filter, self).apply()
+
+    def format_steps(self):
+        self._register_steps()
+        return super(Filter, self).format_steps()
+
+    def _apply_native(self, compile_luts=False):
+        if not self.supports_native():
+            raise Exception("Native filter backend does not support all steps of " + type(self).__name__)
+        operations = self._native_operations
+        if compile_luts:
+            operations = lut.compile_operations(operations)
+        native.apply_operations(self.image(), operations, self.output_file, cancel_event=self.cancel_event)
+
+    def apply(self, backend=None):
+        """
+        Apply the filter and write the output file
+        :param backend: 'imagemagick', 'native', 'lut' or 'auto', defaults to the backend given at construction
+        """
+        self._register_steps()
+        backend = resolve_backend(backend or self.backend, [self])
+        if backend in (BACKEND_NATIVE, BACKEND_LUT):
+            self._apply_native(compile_luts=backend == BACKEND_LUT)
+        else:
+            super(Filter, self).apply()
+
+
+def resolve_backend(backend, filters=()):
+    """
+    :param backend: 'imagemagick', 'native', 'lut' or 'auto'
+    :param filters: filters that are applied, 'auto' only selects lut if it supports all of them
+    :return: 'imagemagick', 'native' or 'lut'
+    """
+    if backend == BACKEND_AUTO:
+        if native.is_available() and all(fil.supports_native() for fil in filters):
+            return BACKEND_LUT
+        return BACKEND_IMAGEMAGICK
+    return backend
+
+
+def apply_filters(filters, backend=BACKEND_IMAGEMAGICK):
+    """
+    Apply several filters to the same input file, e.g. all variants of a photo, and decode the input only once.
+    The imagemagick backend runs all filters in a single convert process, the native backend shares the
+    decoded image between the filters.
+    :param filters: Filter objects with the same input file and different output files
+    :param backend: 'imagemagick', 'native', 'lut' or 'auto'
+    """
+    if not filters:
+        return
+    if len(filters) == 1:
+        filters[0].apply(backend)
+        return
+    backend = resolve_backend(backend, filters)
+    if backend in (BACKEND_NATIVE, BACKEND_LUT):
+        image = filters[0].image()
+        for fil in filters:
+            fil._image = image
+            fil._apply_native(compile_luts=backend == BACKEND_LUT)
+    else:
+        multi_convert = imagemagick.MultiOutputConvert(input_file=filters[0].input_file)
+        multi_convert.cancel_event = filters[0].cancel_event
+        multi_convert.memory_limit = filters[0].memory_limit
+        for fil in filters:
+            multi_convert.add_convert(fil)
+        multi_convert.apply()
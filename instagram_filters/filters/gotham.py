@@ -5,5 +5,8 @@ from instagram_filters.decorations import Border
 class Gotham(Filter):
 
     def _filter_callback(self):
-        self.add_filter_step(process_step_cmd="-modulate 120,10,100 -fill '#222b6d' -colorize 20 -gamma 0.5 -contrast")
+        self.modulate(120, 10, 100)
+        self.colorize('#222b6d', 20)
+        self.gamma(0.5)
+        self.contrast()
         #Border(self).border()
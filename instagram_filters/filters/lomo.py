@@ -5,5 +5,6 @@ from instagram_filters.decorations import Vignette
 class Lomo(Filter):
 
     def _filter_callback(self):
-        self.add_filter_step(process_step_cmd="-channel R -level 33% -channel G -level 33%")
+        self.level(33, channels='R')
+        self.level(33, channels='G')
         Vignette().apply(filter=self)
\ No newline at end of file
@@ -7,5 +7,7 @@ class Nashville(Filter):
     def _filter_callback(self):
         self.colortone('#222b6d', 50, 0)
         self.colortone('#f7daae', 120, 1)
-        self.add_filter_step(process_step_cmd="-contrast -modulate 100,150,100 -auto-gamma")
+        self.contrast()
+        self.modulate(100, 150, 100)
+        self.auto_gamma()
         #Frame("Nashville.jpg").apply(filter=self)
@@ -1,6 +1,29 @@
+import os
 import subprocess
 import shlex
 
+
+def _remove_outputs(input_file, output_files):
+    """
+    Delete outputs of an earlier run, a failed run must not leave them behind as if they were its result
+    :param input_file: input file path, kept if a filter replaces its input
+    :param output_files: list of file paths
+    """
+    for output_file in output_files:
+        if output_file != input_file and os.path.exists(output_file):
+            os.remove(output_file)
+
+
+def _check_outputs(output_files):
+    """
+    :param output_files: list of file paths
+    :raise Exception: if convert did not write an output
+    """
+    for output_file in output_files:
+        if not os.path.exists(output_file):
+            raise Exception("imagemagick did not write " + output_file)
+
+
 class Convert(object):
     """
     imagemagick convert tool wrapper
@@ -19,6 +42,12 @@ class Convert(object):
 
         self.default_params = {}
 
+        # optional threading.Event, the imagemagick process is killed once it is set
+        self.cancel_event = None
+
+        # optional limit in bytes of the pixel cache in memory, imagemagick caches larger images on disk
+        self.memory_limit = None
+
     def add_filter_step(self, process_step_cmd, **kwargs):
         """
         Registers a new sub command (filter step) that is chained into the imagemagick command queue
@@ -34,10 +63,10 @@ class Convert(object):
         """
         self._process_steps = []
 
-    def apply(self):
+    def format_steps(self):
         """
-        Applying the filter and producing the output file
-        First all sub commands are combined to one command string together with replacing parameter placeholders
+        Combine all sub commands to one command string together with replacing parameter placeholders
+        :return: command string of all steps
         """
         steps = ''
 
@@ -47,18 +76,94 @@ class Convert(object):
             step = cmd.format(**format)
             steps += " {} ".format(step)
 
-        command = "convert {input_filename} {steps} {output_filename}".format(input_filename=r'"%s"' % self.input_file,
-                                                                              output_filename=r'"%s"' % self.output_file,
-                                                                              steps=steps)
+        return steps
+
+    def format_limits(self):
+        """
+        :return: resource limit options of the command string
+        """
+        if not self.memory_limit:
+            return ''
+        return "-limit memory {limit} -limit map {limit}".format(limit=self.memory_limit)
+
+    def apply(self):
+        """
+        Applying the filter and producing the output file
+        """
+        command = "convert {limits} {input_filename} {steps} {output_filename}".format(
+            limits=self.format_limits(), input_filename=r'"%s"' % self.input_file,
+            output_filename=r'"%s"' % self.output_file, steps=self.format_steps())
+        _remove_outputs(self.input_file, [self.output_file])
         self._execute_process(command)
+        _check_outputs([self.output_file])
 
     def _execute_process(self, command):
         """
         Execute the imagemagick command
         :param command: full command string
+        :raise Exception: if convert failed or was cancelled
         """
 
         cmd = shlex.split(command)
 
         p = subprocess.Popen(cmd,shell=False, stderr=subprocess.STDOUT)
-        p.wait()
\ No newline at end of file
+        if self.cancel_event:
+            while p.poll() is None:
+                if self.cancel_event.wait(0.05):
+                    p.kill()
+                    p.wait()
+                    raise Exception("imagemagick process was cancelled")
+        returncode = p.wait()
+        if returncode != 0:
+            raise Exception("imagemagick failed with exit code " + str(returncode) + ": " + command)
+
+
+class MultiOutputConvert(Convert):
+    """
+    Applies the steps of several Convert objects to the same input file in a single imagemagick process.
+    The input is decoded once into the memory register mpr:source, every chain works on its own copy in
+    parentheses and writes its output file with -write. The image of the last chain is kept, it is the final
+    output of convert, which fails if no image is left at the end of the command.
+    """
+
+    def __init__(self, input_file):
+        """
+        :param input_file: input file path
+        """
+        super(MultiOutputConvert, self).__init__(input_file=input_file, output_file=None)
+
+        self._converts = []
+
+    def add_convert(self, convert):
+        """
+        Registers a chain
+        :param convert: Convert whose steps are applied to the input file and written to its output file,
+                        its input file is ignored
+        """
+        self._converts.append(convert)
+
+    def command(self):
+        """
+        :return: full command string
+        """
+        # -respect-parentheses keeps settings like -compose or -gravity within their chain
+        branches = ''
+        for convert in self._converts[:-1]:
+            branches += " \( mpr:source {steps} -write {output_filename} +delete \) ".format(
+                steps=convert.format_steps(), output_filename=r'"%s"' % convert.output_file)
+        last = self._converts[-1]
+        branches += " \( mpr:source {steps} \) ".format(steps=last.format_steps())
+
+        return "convert {limits} -respect-parentheses {input_filename} -write mpr:source +delete {branches} " \
+               "{output_filename}".format(limits=self.format_limits(), input_filename=r'"%s"' % self.input_file,
+                                          branches=branches, output_filename=r'"%s"' % last.output_file)
+
+    def apply(self):
+        """
+        Applying all chains and producing their output files
+        """
+        if self._converts:
+            output_files = [convert.output_file for convert in self._converts]
+            _remove_outputs(self.input_file, output_files)
+            self._execute_process(self.command())
+            _check_outputs(output_files)
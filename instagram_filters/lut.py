@@ -0,0 +1,191 @@
+"""
+Compiles runs of point-wise native operations into 3D color lookup tables.
+A point-wise operation maps every pixel by its color only (modulate, colorize, gamma, contrast, level, poly,
+colortone, ...), hence a whole chain of them is one function of the input color. The chain is rendered once for a
+grid of colors and the photo is mapped with a single trilinear lookup per pixel, spatial operations like the
+vignette and operations that need image statistics stay separate.
+The tables are cached in memory and optionally on disk, see lut_cache.
+"""
+import os
+import hashlib
+from threading import Lock
+
+from PIL import ImageFilter
+
+import native
+
+if native.is_available():
+    import numpy
+
+# number of grid points per channel
+LUT_SIZE = 33
+
+# increase if the operations change, cached tables of older versions are not used anymore
+LUT_VERSION = 1
+
+# runs of fewer operations are cheaper to apply directly
+MIN_RUN_LENGTH = 2
+
+
+def _value_key(value):
+    return value.tolist() if hasattr(value, 'tolist') else value
+
+
+def operations_key(operations, size=LUT_SIZE):
+    """
+    :param operations: list of native.Operation
+    :param size: grid points per channel
+    :return: hex string identifying the color transform of the operations
+    """
+    description = [(type(operation).__name__, sorted((name, _value_key(value))
+                                                     for name, value in vars(operation).items()))
+                   for operation in operations]
+    return hashlib.md5(repr((LUT_VERSION, size, description)).encode('utf-8')).hexdigest()
+
+
+def compile_table(operations, size=LUT_SIZE):
+    """
+    Render the color transform of point-wise operations
+    :param operations: list of point-wise native.Operation
+    :param size: grid points per channel
+    :return: float32 array (size**3, 3) in range 0..1, red changes fastest, then green, then blue
+    """
+    steps = numpy.linspace(0, 1, size).astype(numpy.float32)
+    blue, green, red = numpy.meshgrid(steps, steps, steps, indexing='ij')
+    # the grid is filtered like a photo of size x size**2 pixels
+    pixels = numpy.stack([red, green, blue], axis=-1).reshape(size * size, size, 3)
+    for operation in operations:
+        pixels = operation.apply(pixels, (0, size * size), (size, size * size))
+    return numpy.clip(pixels, 0, 1).reshape(size ** 3, 3).astype(numpy.float32)
+
+
+class LookupTable(native.Operation):
+    """
+    Point-wise operations compiled into a 3D color lookup table, applied with trilinear interpolation by PIL
+    or by NumPy if PIL is too old
+    """
+
+    pointwise = True
+    whole_image = hasattr(ImageFilter, 'Color3DLUT')
+
+    def __init__(self, table, size=LUT_SIZE):
+        """
+        :param table: float32 array (size**3, 3), see compile_table
+        :param size: grid points per channel
+        """
+        self.table = table
+        self.size = size
+        self._pil_filter = None
+
+    def apply_image(self, image):
+        if self._pil_filter is None:
+            self._pil_filter = ImageFilter.Color3DLUT(self.size, self.table, channels=3)
+        return image.filter(self._pil_filter)
+
+    def apply(self, pixels, rows, size):
+        n = self.size
+        position = numpy.clip(pixels, 0, 1) * (n - 1)
+        lower = numpy.minimum(position.astype(numpy.int32), n - 2)
+        fraction = position - lower
+        table = self.table
+        result = 0
+        # sum over the 8 corners of the grid cell of each pixel
+        for corner in range(8):
+            offset = [(corner >> c) & 1 for c in range(3)]
+            index = (lower[..., 0] + offset[0]) + (lower[..., 1] + offset[1]) * n + (lower[..., 2] + offset[2]) * n * n
+            weight = 1
+            for c in range(3):
+                weight = weight * (fraction[..., c] if offset[c] else 1 - fraction[..., c])
+            result = result + weight[..., numpy.newaxis] * table[index]
+        return result
+
+
+class LutCache(object):
+    """
+    Compiled lookup tables by the key of their operations, kept in memory and optionally stored as .npy files
+    """
+
+    def __init__(self, directory=None):
+        """
+        :param directory: optional directory for the table files, created if necessary
+        """
+        self._tables = {}
+        self._lock = Lock()
+        self.directory = None
+        self.set_directory(directory)
+
+    def set_directory(self, directory):
+        self.directory = directory
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get(self, operations, size=LUT_SIZE):
+        """
+        :param operations: list of point-wise native.Operation
+        :param size: grid points per channel
+        :return: LookupTable of the operations, compiled if it is not cached yet
+        """
+        key = operations_key(operations, size)
+        with self._lock:
+            table = self._tables.get(key)
+        if table is None:
+            table = self._load(key, size)
+        if table is None:
+            table = compile_table(operations, size)
+            self._store(key, table)
+        with self._lock:
+            self._tables[key] = table
+        return LookupTable(table, size)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def _load(self, key, size):
+        if not self.directory:
+            return None
+        try:
+            table = numpy.load(self._path(key))
+        except (IOError, OSError, ValueError):
+            return None
+        if table.shape != (size ** 3, 3):
+            return None
+        return table
+
+    def _store(self, key, table):
+        if not self.directory:
+            return
+        # written with a file object, numpy.save would append .npy to the temporary name
+        tmp_path = self._path(key) + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                numpy.save(f, table)
+            # readers never see partially written tables
+            os.rename(tmp_path, self._path(key))
+        except (IOError, OSError) as e:
+            print("Writing lookup table failed: " + str(e))
+
+
+lut_cache = LutCache()
+
+
+def compile_operations(operations, size=LUT_SIZE):
+    """
+    Replace every run of point-wise operations by its lookup table
+    :param operations: list of native.Operation
+    :param size: grid points per channel
+    :return: list of native.Operation
+    """
+    compiled = []
+    run = []
+    for operation in operations + [None]:
+        if operation is not None and operation.pointwise:
+            run.append(operation)
+            continue
+        if len(run) >= MIN_RUN_LENGTH:
+            compiled.append(lut_cache.get(run, size))
+        else:
+            compiled.extend(run)
+        run = []
+        if operation is not None:
+            compiled.append(operation)
+    return compiled
@@ -0,0 +1,464 @@
+"""
+In-process implementation of the ImageMagick operations used by the filters, based on NumPy and PIL.
+The photo is decoded once, all operations work on float RGB pixels in range 0..1 and the result is encoded once.
+Pixel operations are applied to horizontal strips of the photo to bound the memory, operations that need image
+statistics (auto gamma) or change the image size (border, frame, logo) end a strip pass.
+The formulas follow ImageMagick 6 (-modulate uses HSL, -contrast HSB, -colorspace gray Rec601 luma).
+"""
+import imp
+import math
+
+from PIL import Image, ImageColor, ImageFilter
+
+try:
+    imp.find_module('numpy')
+    found_numpy_module = True
+except ImportError:
+    found_numpy_module = False
+    print("Couldn't find numpy module, proceeding without native filter backend")
+
+if found_numpy_module:
+    import numpy
+
+# -colorspace gray of ImageMagick 6
+REC601_LUMA = (0.298839, 0.586811, 0.114350)
+
+# X11 colors used by the filters that PIL does not know
+X11_COLORS = {
+    'lavenderblush3': (205, 193, 197),
+}
+
+STRIP_ROWS = 256
+
+
+def is_available():
+    return found_numpy_module
+
+
+def parse_color(color):
+    """
+    :param color: ImageMagick color, e.g. '#222b6d', 'rgba(255,153,0,0.5)', 'none' or a color name
+    :return: tuple (r, g, b, a) in range 0..1
+    """
+    color = color.strip().lower()
+    if color == 'none':
+        return 0.0, 0.0, 0.0, 0.0
+    if color.startswith('rgba(') and color.endswith(')'):
+        values = [float(v) for v in color[5:-1].split(',')]
+        return values[0] / 255.0, values[1] / 255.0, values[2] / 255.0, values[3]
+    rgb = X11_COLORS.get(color) or ImageColor.getrgb(color)
+    return rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0, (rgb[3] / 255.0 if len(rgb) > 3 else 1.0)
+
+
+def intensity(pixels):
+    """
+    :param pixels: float array (rows, width, 3)
+    :return: float array (rows, width, 1) of the Rec601 luma
+    """
+    return numpy.dot(pixels, numpy.array(REC601_LUMA, dtype=numpy.float32))[..., numpy.newaxis]
+
+
+def rgb_to_hsl(pixels):
+    """
+    :return: tuple of float arrays hue (0..1), saturation, luminosity
+    """
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    max_c = pixels.max(axis=-1)
+    min_c = pixels.min(axis=-1)
+    chroma = max_c - min_c
+    luminosity = (max_c + min_c) / 2
+    safe_chroma = numpy.where(chroma > 0, chroma, 1)
+    hue = numpy.where(max_c == r, ((g - b) / safe_chroma) % 6,
+                      numpy.where(max_c == g, (b - r) / safe_chroma + 2, (r - g) / safe_chroma + 4)) / 6
+    hue = numpy.where(chroma > 0, hue, 0)
+    denominator = numpy.where(luminosity <= 0.5, 2 * luminosity, 2 - 2 * luminosity)
+    saturation = numpy.where(chroma > 0, chroma / numpy.where(denominator > 0, denominator, 1), 0)
+    return hue, saturation, luminosity
+
+
+def hsl_to_rgb(hue, saturation, luminosity):
+    """
+    :return: float array (rows, width, 3), not clipped
+    """
+    chroma = (1 - numpy.abs(2 * luminosity - 1)) * saturation
+    h = (hue % 1) * 6
+    x = chroma * (1 - numpy.abs(h % 2 - 1))
+    zero = numpy.zeros_like(h)
+    sector = numpy.floor(h).astype(numpy.int8) % 6
+    r = numpy.choose(sector, [chroma, x, zero, zero, x, chroma])
+    g = numpy.choose(sector, [x, chroma, chroma, x, zero, zero])
+    b = numpy.choose(sector, [zero, zero, x, chroma, chroma, x])
+    m = (luminosity - chroma / 2)[..., numpy.newaxis]
+    return numpy.stack([r, g, b], axis=-1) + m
+
+
+def sigmoid_map(values, contrast, midpoint):
+    """
+    scaled sigmoidal function of ImageMagick, maps 0 to 0 and 1 to 1
+    """
+    def sigmoid(x):
+        return 1 / (1 + numpy.exp(contrast * (midpoint - x)))
+    low = sigmoid(0.0)
+    high = sigmoid(1.0)
+    return (sigmoid(values) - low) / (high - low)
+
+
+class Operation(object):
+    """
+    Native implementation of one filter step
+    """
+
+    # the operation needs statistics of the entire image, see prepare()
+    needs_statistics = False
+    # the operation works on the entire PIL image, see apply_image()
+    whole_image = False
+    # the result of a pixel only depends on its color, runs of these operations can be compiled to a lookup table
+    pointwise = False
+
+    def prepare(self, pixels):
+        """
+        collect image statistics before apply() is called for the strips
+        :param pixels: uint8 array (height, width, 3) of the entire image
+        """
+        pass
+
+    def apply(self, pixels, rows, size):
+        """
+        :param pixels: float array (rows, width, 3) of a horizontal strip
+        :param rows: tuple (first, last) row of the strip
+        :param size: tuple (width, height) of the entire image
+        :return: float array of the filtered strip
+        """
+        return pixels
+
+    def apply_image(self, image):
+        """
+        :param image: PIL image
+        :return: filtered PIL image
+        """
+        return image
+
+
+class Modulate(Operation):
+    """
+    -modulate brightness,saturation,hue
+    """
+
+    pointwise = True
+
+    def __init__(self, brightness, saturation=100, hue=100):
+        self.brightness = brightness / 100.0
+        self.saturation = saturation / 100.0
+        self.hue = (hue - 100) / 200.0
+
+    def apply(self, pixels, rows, size):
+        if self.hue:
+            hue, saturation, luminosity = rgb_to_hsl(pixels)
+            return hsl_to_rgb(hue + self.hue, saturation * self.saturation, luminosity * self.brightness)
+
+        # Without a hue change the HSL round trip reduces to scaling the distance of the channels to the
+        # luminosity: rgb' = l' + (c' / c) * (rgb - l) with chroma c = s * (1 - |2l - 1|)
+        luminosity = ((pixels.max(axis=-1) + pixels.min(axis=-1)) / 2)[..., numpy.newaxis]
+        new_luminosity = luminosity * self.brightness
+        old_range = 1 - numpy.abs(2 * luminosity - 1)
+        new_range = 1 - numpy.abs(2 * new_luminosity - 1)
+        scale = self.saturation * new_range / numpy.where(old_range > 0, old_range, 1)
+        return new_luminosity + scale * (pixels - luminosity)
+
+
+class Colorize(Operation):
+    """
+    -fill color -colorize percent
+    """
+
+    pointwise = True
+
+    def __init__(self, color, percent):
+        self.color = numpy.array(parse_color(color)[:3], dtype=numpy.float32)
+        self.amount = percent / 100.0
+
+    def apply(self, pixels, rows, size):
+        return pixels * (1 - self.amount) + self.color * self.amount
+
+
+class Gamma(Operation):
+    """
+    -gamma value
+    """
+
+    pointwise = True
+
+    def __init__(self, value):
+        self.exponent = 1.0 / value
+
+    def apply(self, pixels, rows, size):
+        return numpy.power(numpy.clip(pixels, 0, 1), self.exponent)
+
+
+class AutoGamma(Gamma):
+    """
+    -auto-gamma, the gamma maps the mean of all channels to 0.5
+    """
+
+    needs_statistics = True
+    pointwise = False
+
+    def __init__(self):
+        self.exponent = 1.0
+
+    def prepare(self, pixels):
+        total = 0.0
+        for first in range(0, pixels.shape[0], STRIP_ROWS):
+            total += pixels[first:first + STRIP_ROWS].sum(dtype=numpy.float64)
+        mean = total / pixels.size / 255.0
+        if 0 < mean < 1:
+            self.exponent = math.log(0.5) / math.log(mean)
+
+
+class Contrast(Operation):
+    """
+    -contrast (sharpen) or +contrast, changes the HSB brightness with a sine curve
+    """
+
+    pointwise = True
+
+    def __init__(self, sharpen=True):
+        self.sign = 1 if sharpen else -1
+
+    def apply(self, pixels, rows, size):
+        brightness = pixels.max(axis=-1)
+        new_brightness = brightness + 0.5 * self.sign * (0.5 * (numpy.sin(math.pi * (brightness - 0.5)) + 1) -
+                                                         brightness)
+        new_brightness = numpy.clip(new_brightness, 0, 1)
+        # hue and saturation stay the same, hence the channels scale with the brightness
+        scale = new_brightness / numpy.where(brightness > 0, brightness, 1)
+        return numpy.where((brightness > 0)[..., numpy.newaxis], pixels * scale[..., numpy.newaxis],
+                           new_brightness[..., numpy.newaxis])
+
+
+class SigmoidalContrast(Operation):
+    """
+    -sigmoidal-contrast contrast,midpoint%
+    """
+
+    pointwise = True
+
+    def __init__(self, contrast, midpoint=50):
+        self.contrast = contrast
+        self.midpoint = midpoint / 100.0
+
+    def apply(self, pixels, rows, size):
+        return sigmoid_map(numpy.clip(pixels, 0, 1), self.contrast, self.midpoint)
+
+
+class Level(Operation):
+    """
+    -channel channels -level black%,white%,gamma
+    """
+
+    pointwise = True
+
+    def __init__(self, black_point, white_point=100, gamma=1.0, channels='RGB'):
+        self.black = black_point / 100.0
+        self.white = white_point / 100.0
+        self.exponent = 1.0 / gamma
+        self.channels = ['RGB'.index(c) for c in channels.upper()]
+
+    def apply(self, pixels, rows, size):
+        for c in self.channels:
+            scaled = numpy.clip((pixels[..., c] - self.black) / (self.white - self.black), 0, 1)
+            pixels[..., c] = numpy.power(scaled, self.exponent) if self.exponent != 1 else scaled
+        return pixels
+
+
+class GrayPolynomial(Operation):
+    """
+    -separate -poly 'weight,exponent, ...', the weighted sum of the channels as gray image
+    """
+
+    pointwise = True
+
+    def __init__(self, terms):
+        """
+        :param terms: list of (weight, exponent) for red, green and blue
+        """
+        self.terms = terms
+
+    def apply(self, pixels, rows, size):
+        gray = 0
+        for c, (weight, exponent) in enumerate(self.terms):
+            channel = pixels[..., c]
+            gray = gray + weight * (numpy.power(numpy.clip(channel, 0, 1), exponent) if exponent != 1 else channel)
+        pixels[...] = gray[..., numpy.newaxis]
+        return pixels
+
+
+class ColorTone(Operation):
+    """
+    Blend with a solid color through a gray (or negated gray) mask of the image:
+    \\( -clone 0 -fill color -colorize 100% \\) \\( -clone 0 -colorspace gray [-negate] \\)
+    -compose blend -define compose:args=level,100-level -composite
+    """
+
+    pointwise = True
+
+    def __init__(self, color, level, negate):
+        self.color = numpy.array(parse_color(color)[:3], dtype=numpy.float32)
+        self.source_amount = level / 100.0
+        self.destination_amount = (100 - level) / 100.0
+        self.negate = negate
+
+    def apply(self, pixels, rows, size):
+        mask = intensity(numpy.clip(pixels, 0, 1))
+        if self.negate:
+            mask = 1 - mask
+        blended = numpy.clip(self.color * self.source_amount + pixels * self.destination_amount, 0, 1)
+        return pixels + mask * (blended - pixels)
+
+
+class MultiplyColor(Operation):
+    """
+    Multiply with a solid, optionally translucent color:
+    \\( -size WxH xc:color \\) -compose multiply -composite
+    """
+
+    pointwise = True
+
+    def __init__(self, color):
+        rgba = parse_color(color)
+        self.color = numpy.array(rgba[:3], dtype=numpy.float32)
+        self.alpha = rgba[3]
+
+    def apply(self, pixels, rows, size):
+        return pixels * (self.color * self.alpha + 1 - self.alpha)
+
+
+class Vignette(Operation):
+    """
+    Multiply with a centered radial gradient:
+    \\( -size CXxCY radial-gradient:color_1-color_2 -gravity center -crop WxH+0+0 +repage \\)
+    -compose multiply -flatten
+    """
+
+    def __init__(self, color_1, color_2, crop_factor):
+        self.color_1 = numpy.array(parse_color(color_1), dtype=numpy.float32)
+        self.color_2 = numpy.array(parse_color(color_2), dtype=numpy.float32)
+        self.crop_factor = crop_factor
+
+    def apply(self, pixels, rows, size):
+        width, height = size
+        # the gradient fills the larger dimension of the uncropped gradient image
+        radius = max(math.floor(width * self.crop_factor), math.floor(height * self.crop_factor)) / 2.0
+        x = numpy.arange(width, dtype=numpy.float32) + 0.5 - width / 2.0
+        y = numpy.arange(rows[0], rows[1], dtype=numpy.float32) + 0.5 - height / 2.0
+        distance = numpy.sqrt(x[numpy.newaxis, :] ** 2 + y[:, numpy.newaxis] ** 2) / radius
+        t = numpy.clip(distance, 0, 1)[..., numpy.newaxis]
+        gradient = self.color_1 * (1 - t) + self.color_2 * t
+        color, alpha = gradient[..., :3], gradient[..., 3:]
+        return pixels * (color * alpha + 1 - alpha)
+
+
+class Border(Operation):
+    """
+    -bordercolor color -border width x width
+    """
+
+    whole_image = True
+
+    def __init__(self, color, width):
+        self.color = tuple(int(round(c * 255)) for c in parse_color(color)[:3])
+        self.width = width
+
+    def apply_image(self, image):
+        bordered = Image.new('RGB', (image.size[0] + 2 * self.width, image.size[1] + 2 * self.width), self.color)
+        bordered.paste(image, (self.width, self.width))
+        return bordered
+
+
+class Overlay(Operation):
+    """
+    Composite an image over the photo, e.g. a logo with -gravity NorthEast -geometry +x+y -composite
+    or a frame with -resize WxW! -unsharp ... -flatten
+    """
+
+    whole_image = True
+
+    def __init__(self, overlay_file, gravity='NorthWest', offset=(0, 0), resize_to_width=False, unsharp=False):
+        self.overlay_file = overlay_file
+        self.gravity = gravity
+        self.offset = offset
+        self.resize_to_width = resize_to_width
+        self.unsharp = unsharp
+
+    def apply_image(self, image):
+        overlay = Image.open(self.overlay_file)
+        overlay = overlay.convert('RGBA' if overlay.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        if self.resize_to_width:
+            overlay = overlay.resize((image.size[0], image.size[0]), Image.BICUBIC)
+        if self.unsharp:
+            overlay = overlay.filter(ImageFilter.UnsharpMask(radius=1.5, percent=150, threshold=5))
+        x, y = self.offset
+        if self.gravity.lower().endswith('east'):
+            x = image.size[0] - overlay.size[0] - x
+        if self.gravity.lower().startswith('south'):
+            y = image.size[1] - overlay.size[1] - y
+        image = image.copy()
+        image.paste(overlay, (x, y), overlay if overlay.mode == 'RGBA' else None)
+        return image
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event and cancel_event.is_set():
+        raise Exception("filtering was cancelled")
+
+
+def _apply_strips(pixels, operations, cancel_event=None):
+    """
+    apply pixel operations strip by strip, the result replaces the uint8 pixels
+    """
+    height, width = pixels.shape[:2]
+    for first in range(0, height, STRIP_ROWS):
+        _check_cancelled(cancel_event)
+        last = min(height, first + STRIP_ROWS)
+        strip = pixels[first:last].astype(numpy.float32) / 255
+        for operation in operations:
+            strip = operation.apply(strip, (first, last), (width, height))
+        pixels[first:last] = numpy.clip(strip * 255 + 0.5, 0, 255).astype(numpy.uint8)
+
+
+def apply_operations(image, operations, output_file, quality=92, cancel_event=None):
+    """
+    Filter an image and save the result
+    :param image: PIL image
+    :param operations: list of Operation
+    :param output_file: output file path
+    :param quality: jpeg quality, ImageMagick uses 92 if the quality of the input is unknown
+    :param cancel_event: optional threading.Event, filtering stops with an exception once it is set
+    """
+    # the photo is held as uint8 array for the strip passes and as PIL image for whole image operations,
+    # it is only converted when the kind of operation changes
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    pixels = None
+    pending = []
+    for operation in operations + [None]:
+        if pending and (operation is None or operation.needs_statistics or operation.whole_image):
+            _apply_strips(pixels, pending, cancel_event)
+            pending = []
+        if operation is None:
+            break
+        _check_cancelled(cancel_event)
+        if operation.whole_image:
+            if pixels is not None:
+                image = Image.fromarray(pixels)
+                pixels = None
+            image = operation.apply_image(image)
+            continue
+        if pixels is None:
+            pixels = numpy.array(image)
+        if operation.needs_statistics:
+            operation.prepare(pixels)
+        pending.append(operation)
+    if pixels is not None:
+        image = Image.fromarray(pixels)
+    image.save(output_file, quality=quality)
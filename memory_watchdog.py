@@ -0,0 +1,255 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+MB = 1024 * 1024
+
+
+class ProcessInfo(object):
+    """
+    Information about a process read from /proc
+    """
+
+    def __init__(self, pid, name, state, ppid, rss):
+        self.pid = pid
+        self.name = name
+        self.state = state
+        self.ppid = ppid
+        self.rss = rss
+
+    @property
+    def is_zombie(self):
+        return self.state == 'Z'
+
+    def __repr__(self):
+        return "%s(%d) %.1f MB" % (self.name, self.pid, self.rss / float(MB))
+
+
+def read_process_info(pid):
+    """
+    read name, state, parent and resident memory of a process from /proc/<pid>/stat
+    :param pid: process id
+    :return: ProcessInfo or None if the process does not exist (anymore)
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            stat = f.read()
+    except (IOError, OSError):
+        return None
+    # the name is in parentheses and may contain spaces
+    name = stat[stat.find('(') + 1:stat.rfind(')')]
+    fields = stat[stat.rfind(')') + 2:].split()
+    return ProcessInfo(pid=pid, name=name, state=fields[0], ppid=int(fields[1]), rss=int(fields[21]) * PAGE_SIZE)
+
+
+def child_processes(pid=None):
+    """
+    find all descendants of a process, e.g. gphoto2 shells, convert calls and camera servers
+    :param pid: parent process id, defaults to this process
+    :return: list of ProcessInfo
+    """
+    pid = pid or os.getpid()
+    processes = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            info = read_process_info(int(entry))
+            if info:
+                processes.append(info)
+
+    children = {}
+    for info in processes:
+        children.setdefault(info.ppid, []).append(info)
+
+    descendants = []
+    parents = [pid]
+    while parents:
+        for child in children.get(parents.pop(), []):
+            descendants.append(child)
+            parents.append(child.pid)
+    return descendants
+
+
+def read_private_memory(pid=None):
+    """
+    memory that only this process uses, unlike the resident memory it does not count the pages a forked process
+    still shares with its parent
+    :param pid: process id, defaults to this process
+    :return: private clean and dirty memory in bytes, 0 if unknown
+    """
+    pid = pid or os.getpid()
+    # smaps_rollup sums up all mappings and is much faster to read, it requires Linux 4.14
+    for name in ('smaps_rollup', 'smaps'):
+        try:
+            memory = 0
+            with open('/proc/%d/%s' % (pid, name)) as f:
+                for line in f:
+                    if line.startswith('Private_Clean:') or line.startswith('Private_Dirty:'):
+                        memory += int(line.split()[1]) * 1024
+            return memory
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+    return 0
+
+
+def count_open_fds(pid=None):
+    """
+    :param pid: process id, defaults to this process
+    :return: number of open file descriptors
+    """
+    try:
+        return len(os.listdir('/proc/%d/fd' % (pid or os.getpid())))
+    except OSError:
+        return 0
+
+
+class MemoryWatchdog(object):
+    """
+    Watches the memory of the application and its child processes, open file descriptors and zombie processes.
+    If a limit is exceeded, recycle_reasons lists the violations. The application recycles the camera backend
+    at a suitable point, e.g. between two photo sessions, and acknowledges this with reset().
+    A violation that persists after max_recycles recycles is only reported, recycling does not fix it.
+    Zombies are reported only, they are waited for by the code that started them (multiprocessing, Popen).
+    Optionally tracemalloc snapshots of the application are stored on every check (only available on Python 3).
+    """
+
+    def __init__(self, max_memory_mb=600, max_child_memory_mb=300, max_open_fds=512, max_zombies=10,
+                 check_interval=30, max_recycles=3, camera_process_names=('gphoto2',), camera_pids=None,
+                 tracemalloc_directory=None, tracemalloc_frames=10):
+        """
+        :param max_memory_mb: limit for the resident memory of the application
+        :param max_child_memory_mb: limit for the private memory of a single camera process, pages a forked process
+                                    shares with the application do not count
+        :param max_open_fds: limit for open file descriptors of the application
+        :param max_zombies: limit for exited child processes that were not waited for
+        :param check_interval: seconds between two checks
+        :param max_recycles: number of recycles in a row for the same violation, e.g. the memory of the application
+        :param camera_process_names: names of child processes that belong to the camera backend, recycling the camera
+                                     replaces them, other children like convert are not checked
+        :param camera_pids: optional function returning the ids of further camera processes, e.g. the camera server
+        :param tracemalloc_directory: if given, tracemalloc snapshots are stored in this directory
+        :param tracemalloc_frames: number of stack frames stored per memory block
+        """
+        self.max_memory = max_memory_mb * MB
+        self.max_child_memory = max_child_memory_mb * MB
+        self.max_open_fds = max_open_fds
+        self.max_zombies = max_zombies
+        self.check_interval = check_interval
+        self.max_recycles = max_recycles
+        self.camera_process_names = camera_process_names
+        self._camera_pids = camera_pids
+        self._violations = OrderedDict()
+        # recycles in a row by violation key
+        self._recycles = {}
+        self.last_check_time = 0
+        self.memory = 0
+        self.children = []
+        self.open_fds = 0
+        self.zombies = []
+
+        self._tracemalloc_directory = None
+        if tracemalloc_directory:
+            if tracemalloc:
+                if not os.path.exists(tracemalloc_directory):
+                    os.makedirs(tracemalloc_directory)
+                self._tracemalloc_directory = tracemalloc_directory
+                tracemalloc.start(tracemalloc_frames)
+            else:
+                print("Couldn't find tracemalloc module, proceeding without memory snapshots")
+
+    def update(self):
+        """
+        check the limits if the check interval elapsed
+        :return: True if the camera backend should be recycled
+        """
+        if time.time() - self.last_check_time >= self.check_interval:
+            self.check()
+        return len(self._violations) > 0
+
+    @property
+    def recycle_reasons(self):
+        """
+        :return: list of exceeded limits since the last reset
+        """
+        return list(self._violations.values())
+
+    def check(self):
+        """
+        check all limits now, violations are added to recycle_reasons
+        """
+        self.last_check_time = time.time()
+        own_info = read_process_info(os.getpid())
+        self.memory = own_info.rss if own_info else 0
+        self.children = child_processes()
+        self.open_fds = count_open_fds()
+        self.zombies = [child for child in self.children if child.is_zombie]
+
+        violations = []
+        if self.max_memory and self.memory > self.max_memory:
+            violations.append(('memory', "application uses %.1f MB" % (self.memory / float(MB))))
+        if self.max_child_memory:
+            camera_pids = self._camera_pids() if self._camera_pids else []
+            for child in self.children:
+                if child.is_zombie:
+                    continue
+                if child.pid in camera_pids:
+                    role = 'camera server'
+                elif child.name in self.camera_process_names:
+                    role = child.name
+                else:
+                    continue
+                memory = read_private_memory(child.pid)
+                if memory > self.max_child_memory:
+                    # keyed by role, a recycled camera process has a new pid
+                    violations.append((('child', role), "%s process %s(%d) uses %.1f MB private memory" %
+                                       (role, child.name, child.pid, memory / float(MB))))
+        if self.max_open_fds and self.open_fds > self.max_open_fds:
+            violations.append(('fds', "%d open file descriptors" % self.open_fds))
+        if self.max_zombies and len(self.zombies) > self.max_zombies:
+            violations.append(('zombies', "%d zombie processes" % len(self.zombies)))
+
+        # a violation that disappeared may be recycled again if it comes back
+        keys = set(key for key, _ in violations)
+        for key in list(self._recycles):
+            if key not in keys:
+                del self._recycles[key]
+
+        for key, reason in violations:
+            recycles = self._recycles.get(key, 0)
+            if self.max_recycles and recycles >= self.max_recycles:
+                if recycles == self.max_recycles:
+                    print("Watchdog: " + reason + ", not recycling anymore, it persisted after %d recycles" % recycles)
+                    # reported once
+                    self._recycles[key] = recycles + 1
+                continue
+            if key not in self._violations:
+                print("Watchdog: " + reason)
+            self._violations[key] = reason
+
+        if self._tracemalloc_directory:
+            self.take_snapshot()
+
+    def take_snapshot(self):
+        """
+        store a tracemalloc snapshot
+        :return: path of the snapshot file
+        """
+        file = os.path.join(self._tracemalloc_directory,
+                            "tracemalloc_" + str(datetime.now()).replace(':', '-') + ".dump")
+        tracemalloc.take_snapshot().dump(file)
+        return file
+
+    def reset(self):
+        """
+        acknowledge that the camera backend was recycled
+        """
+        for key in self._violations:
+            self._recycles[key] = self._recycles.get(key, 0) + 1
+        self._violations.clear()
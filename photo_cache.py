@@ -0,0 +1,409 @@
+import os
+import mmap
+import struct
+import hashlib
+from collections import OrderedDict
+from threading import Thread, Condition, Lock
+
+import pygame
+
+from pygame_utils import decode_jpeg, convert_image, load_image
+
+MB = 1024 * 1024
+
+# magic, width, height, modification time of the photo
+SIDECAR_HEADER = struct.Struct('<4sHHd')
+SIDECAR_MAGIC = b'PBRW'
+
+
+def _buffer_view(data, offset, size):
+    """
+    view on a part of a buffer without copying it
+    """
+    try:
+        return buffer(data, offset, size)
+    except NameError:
+        # python 3
+        return memoryview(data)[offset:offset + size]
+
+
+def surface_memory(surface):
+    """
+    :param surface: pygame.Surface
+    :return: size of the pixel buffer in bytes
+    """
+    return surface.get_pitch() * surface.get_height()
+
+
+class SurfaceCache(object):
+    """
+    Thread safe least recently used cache of decoded photos, bounded by the memory of the pixel buffers
+    """
+
+    def __init__(self, max_memory_mb=64):
+        """
+        :param max_memory_mb: upper bound for the memory of all cached surfaces
+        """
+        self.max_memory = max_memory_mb * MB
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self._surfaces = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._surfaces
+
+    def get(self, key):
+        """
+        :param key: hashable key, e.g. tuple of file and size
+        :return: cached pygame.Surface or None
+        """
+        with self._lock:
+            surface = self._surfaces.pop(key, None)
+            if surface is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._surfaces[key] = surface
+            return surface
+
+    def put(self, key, surface):
+        with self._lock:
+            old = self._surfaces.pop(key, None)
+            if old is not None:
+                self.memory -= surface_memory(old)
+            self._surfaces[key] = surface
+            self.memory += surface_memory(surface)
+            # never drop the surface just added, even if it exceeds the limit on its own
+            while len(self._surfaces) > 1 and self.memory > self.max_memory:
+                _, dropped = self._surfaces.popitem(last=False)
+                self.memory -= surface_memory(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._surfaces.clear()
+            self.memory = 0
+
+
+class DerivativeCache(object):
+    """
+    Raw screen resolution pixel buffers (sidecars) of the photos, stored in a cache directory.
+    Loading a sidecar maps the file into memory and wraps it as pygame image, nothing has to be decoded.
+    A sidecar is valid for one photo, size and modification time of the photo, otherwise it is rewritten.
+    The sidecars of all photo directories share the cache directory, the least recently used ones are deleted if
+    they exceed max_size_mb together.
+    """
+
+    def __init__(self, cache_directory, max_size_mb=1000):
+        """
+        :param cache_directory: directory for the sidecar files, created if necessary
+        :param max_size_mb: upper bound for the size of all sidecar files
+        """
+        self.cache_directory = cache_directory
+        self.max_size = max_size_mb * MB
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+        self._rebuild_thread = None
+        self.rebuild_done = 0
+        self.rebuild_total = 0
+        # file size of the sidecars by name, the least recently used first
+        self._sizes = OrderedDict()
+        self.size = 0
+        self._lock = Lock()
+        self._scan()
+
+    def _scan(self):
+        """
+        index the existing sidecars, their modification time is the time of their last use
+        """
+        sidecars = []
+        for name in os.listdir(self.cache_directory):
+            path = os.path.join(self.cache_directory, name)
+            if name.endswith('.tmp'):
+                # left over by an interrupted write
+                self._remove(name)
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            sidecars.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(sidecars):
+            self._sizes[name] = size
+            self.size += size
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.cache_directory, name))
+        except OSError:
+            pass
+
+    def _touch(self, path):
+        """
+        mark a sidecar as recently used
+        """
+        name = os.path.basename(path)
+        with self._lock:
+            size = self._sizes.pop(name, None)
+            if size is not None:
+                self._sizes[name] = size
+        try:
+            # keeps the order across restarts
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _added(self, path):
+        """
+        account a written sidecar and delete the least recently used ones if the cache is too large
+        """
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        dropped = []
+        with self._lock:
+            self.size -= self._sizes.pop(name, 0)
+            self._sizes[name] = size
+            self.size += size
+            # never drop the sidecar just added
+            while len(self._sizes) > 1 and self.size > self.max_size:
+                old_name, old_size = self._sizes.popitem(last=False)
+                self.size -= old_size
+                dropped.append(old_name)
+        for old_name in dropped:
+            self._remove(old_name)
+
+    def sidecar_path(self, file, size):
+        """
+        :param file: photo file
+        :param size: size (width, height) of the sidecar
+        :return: path of the sidecar file
+        """
+        name = hashlib.md5(os.path.abspath(file).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_directory, "%s_%dx%d.raw" % (name, size[0], size[1]))
+
+    def load(self, file, size):
+        """
+        :param file: photo file
+        :param size: size (width, height) of the image
+        :return: pygame.image backed by the mapped sidecar or None if there is no valid sidecar
+        """
+        path = self.sidecar_path(file, size)
+        try:
+            mtime = os.path.getmtime(file)
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+        pixel_size = size[0] * size[1] * 3
+        if len(data) != SIDECAR_HEADER.size + pixel_size or \
+                SIDECAR_HEADER.unpack(data[:SIDECAR_HEADER.size]) != (SIDECAR_MAGIC, size[0], size[1], mtime):
+            data.close()
+            return None
+        self._touch(path)
+        # the image keeps the mapping alive
+        return pygame.image.frombuffer(_buffer_view(data, SIDECAR_HEADER.size, pixel_size), tuple(size), 'RGB')
+
+    def store(self, file, image):
+        """
+        write the sidecar of a photo
+        :param file: photo file
+        :param image: pygame.image of the photo at sidecar size
+        """
+        size = image.get_size()
+        path = self.sidecar_path(file, size)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SIDECAR_HEADER.pack(SIDECAR_MAGIC, size[0], size[1], os.path.getmtime(file)))
+            f.write(pygame.image.tostring(image, 'RGB'))
+        # readers never see partially written sidecars
+        os.rename(tmp_path, path)
+        self._added(path)
+
+    def store_async(self, file, image):
+        """
+        write the sidecar of a photo in a background thread, e.g. right after the capture
+        """
+        t = Thread(target=self._store_worker, args=(file, image))
+        t.daemon = True
+        t.start()
+
+    def _store_worker(self, file, image):
+        try:
+            self.store(file, image)
+        except Exception as e:
+            print("Writing sidecar of " + file + " failed: " + str(e))
+
+    def get(self, file, size, decode_callback):
+        """
+        :param file: photo file
+        :param size: size (width, height) of the image
+        :param decode_callback: function(file, size) decoding the photo if there is no valid sidecar yet
+        :return: pygame.image
+        """
+        image = self.load(file, size)
+        if image is None:
+            image = decode_callback(file, size)
+            try:
+                self.store(file, image)
+            except (IOError, OSError) as e:
+                print("Writing sidecar of " + file + " failed: " + str(e))
+        return image
+
+    def is_rebuilding(self):
+        return self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+
+    def start_rebuild(self, files, size, decode_callback):
+        """
+        Write all missing or outdated sidecars in a background thread and delete sidecars of these photos in other
+        sizes, sidecars of other photo directories are kept until they are the least recently used ones.
+        The rebuild stops once the sidecars written by it fill the cache.
+        :param files: all photo files
+        :param size: size (width, height) of the sidecars
+        :param decode_callback: function(file, size) decoding a photo
+        """
+        if self.is_rebuilding():
+            return
+        self.rebuild_done = 0
+        self.rebuild_total = len(files)
+        self._rebuild_thread = Thread(target=self._rebuild_worker, args=(list(files), tuple(size), decode_callback))
+        self._rebuild_thread.daemon = True
+        self._rebuild_thread.start()
+
+    def _rebuild_worker(self, files, size, decode_callback):
+        """
+        worker function for the rebuild thread
+        """
+        valid = set()
+        prefixes = set()
+        written = 0
+        for file in files:
+            try:
+                path = self.sidecar_path(file, size)
+                if self.load(file, size) is None:
+                    self.store(file, decode_callback(file, size))
+                    written += os.path.getsize(path)
+                name = os.path.basename(path)
+                valid.add(name)
+                # the hash of the photo path
+                prefixes.add(name.split('_')[0])
+            except Exception as e:
+                print("Rebuilding sidecar of " + file + " failed: " + str(e))
+            self.rebuild_done += 1
+            if written > self.max_size:
+                print("Photo cache is full, rebuilding stopped after %d photos" % self.rebuild_done)
+                break
+
+        with self._lock:
+            outdated = [name for name in self._sizes if name not in valid and name.split('_')[0] in prefixes]
+            for name in outdated:
+                self.size -= self._sizes.pop(name)
+        for name in outdated:
+            self._remove(name)
+
+
+class PhotoPrefetcher(object):
+    """
+    Decodes the upcoming photos of a slide show at screen size in a background thread.
+    The slide show passes its upcoming order with prefetch() and gets the photos with get(),
+    which only decodes on the calling thread if the photo was not prefetched in time.
+    """
+
+    def __init__(self, size, max_memory_mb=64, prefetch_count=3, derivative_cache=None):
+        """
+        :param size: size (width, height) the photos are decoded at
+        :param max_memory_mb: upper bound for the memory of the decoded photos
+        :param prefetch_count: number of upcoming photos that are decoded in advance
+        :param derivative_cache: optional DerivativeCache, photos are loaded from their sidecars if possible
+        """
+        self.size = tuple(size)
+        self.prefetch_count = prefetch_count
+        self.derivative_cache = derivative_cache
+        self.cache = SurfaceCache(max_memory_mb)
+        self._queue = []
+        self._in_progress = None
+        self._condition = Condition()
+        self._thread = Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_size(self, size):
+        """
+        change the decoding size, e.g. after the screen resolution changed
+        """
+        size = tuple(size)
+        if size != self.size:
+            with self._condition:
+                self.size = size
+                self._queue = []
+            self.cache.clear()
+
+    def prefetch(self, files):
+        """
+        replace the queue of photos to decode in advance
+        :param files: photo files in the order they are needed, e.g. the next prefetch_count photos
+        """
+        with self._condition:
+            self._queue = list(files)
+            self._condition.notify_all()
+
+    def get(self, file):
+        """
+        :param file: photo file
+        :return: pygame.image of the photo at the decoding size
+        """
+        key = (file, self.size)
+        with self._condition:
+            # the photo is just being decoded, no need to do it twice
+            while self._in_progress == key:
+                self._condition.wait()
+        surface = self.cache.get(key)
+        if surface is None:
+            surface = self._load(file, self.size)
+            self.cache.put(key, surface)
+        return surface
+
+    def _load(self, file, size):
+        if self.derivative_cache:
+            return self.derivative_cache.get(file, size, self.decode)
+        return self.decode(file, size)
+
+    @staticmethod
+    def decode(file, size):
+        """
+        decode a photo file
+        :param file: photo file
+        :param size: size (width, height) of the image
+        :return: pygame.image in display format
+        """
+        if os.path.splitext(file)[1].lower() in ('.jpg', '.jpeg'):
+            with open(file, 'rb') as f:
+                return convert_image(decode_jpeg(f.read(), size))
+        return load_image(file, size)
+
+    def _worker(self):
+        """
+        worker function for the prefetch thread
+        """
+        while True:
+            with self._condition:
+                key = None
+                while key is None:
+                    while self._queue:
+                        candidate = (self._queue.pop(0), self.size)
+                        if candidate not in self.cache:
+                            key = candidate
+                            break
+                    else:
+                        self._condition.wait()
+                self._in_progress = key
+
+            try:
+                self.cache.put(key, self._load(*key))
+            except Exception as e:
+                print("Prefetching " + key[0] + " failed: " + str(e))
+
+            with self._condition:
+                self._in_progress = None
+                self._condition.notify_all()
@@ -0,0 +1,147 @@
+import os
+import time
+import sqlite3
+
+CATALOG_FILE = '.photobooth_catalog.sqlite'
+
+PHOTO_EXTENSIONS = ('.jpg',)
+
+FILTERED_SUFFIX = '_filtered'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS photos (
+           name TEXT PRIMARY KEY,
+           original TEXT,
+           filter TEXT,
+           capture_time REAL,
+           print_count INTEGER NOT NULL DEFAULT 0)''',
+    'CREATE INDEX IF NOT EXISTS photos_capture_time ON photos (capture_time)',
+    'CREATE INDEX IF NOT EXISTS photos_original ON photos (original)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)',
+]
+
+
+class PhotoCatalog(object):
+    """
+    Persistent catalog of the photos in a photo directory, stored as SQLite database in the directory itself.
+    It contains the originals and their filtered variants with capture time, filter and print count.
+    The catalog is updated when photos are taken, filtered or printed, reconcile() adds and removes photos
+    that were changed by others. It only scans the directory if its modification time changed.
+    """
+
+    def __init__(self, photo_directory):
+        """
+        :param photo_directory: directory of the photos
+        """
+        self.photo_directory = photo_directory
+        self._db = sqlite3.connect(os.path.join(photo_directory, CATALOG_FILE))
+        # file names as native strings like os.listdir returns them
+        self._db.text_factory = str
+        # keep the journal file, creating and deleting it would change the directory modification time
+        self._db.execute('PRAGMA journal_mode=PERSIST')
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._count = self._db.execute('SELECT COUNT(*) FROM photos').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def _name(self, file):
+        return os.path.basename(file)
+
+    def _path(self, name):
+        return os.path.join(self.photo_directory, name)
+
+    def _get_meta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _insert(self, name, capture_time=None, original=None, filter_name=None):
+        if original is None and os.path.splitext(name)[0].endswith(FILTERED_SUFFIX):
+            base, ext = os.path.splitext(name)
+            original = base[:-len(FILTERED_SUFFIX)] + ext
+        cursor = self._db.execute('INSERT OR IGNORE INTO photos (name, original, filter, capture_time) '
+                                  'VALUES (?, ?, ?, ?)', (name, original, filter_name, capture_time))
+        if cursor.rowcount > 0:
+            self._count += 1
+        elif filter_name:
+            self._db.execute('UPDATE photos SET filter = ? WHERE name = ?', (filter_name, name))
+
+    def add_photo(self, file, capture_time=None, original=None, filter_name=None):
+        """
+        add a new photo of the photo directory
+        :param file: photo file
+        :param capture_time: time stamp of the capture, defaults to now
+        :param original: optional original photo file of a filtered variant,
+                         detected by the _filtered suffix if not given
+        :param filter_name: name of the filter of a filtered variant
+        """
+        self._insert(self._name(file), capture_time or time.time(),
+                     self._name(original) if original else None, filter_name)
+        # the new photo changed the directory, the catalog is still in sync with it
+        self._set_meta('directory_mtime', os.path.getmtime(self.photo_directory))
+        self._db.commit()
+
+    def increment_print_count(self, file):
+        self._db.execute('UPDATE photos SET print_count = print_count + 1 WHERE name = ?', (self._name(file),))
+        self._db.commit()
+
+    def count(self, originals_only=False):
+        """
+        :param originals_only: only count photos that are no filtered variants
+        :return: number of photos
+        """
+        if originals_only:
+            return self._db.execute('SELECT COUNT(*) FROM photos WHERE original IS NULL').fetchone()[0]
+        return self._count
+
+    def photos(self, originals_only=False):
+        """
+        :param originals_only: skip filtered variants
+        :return: list of photo files sorted by capture time
+        """
+        query = 'SELECT name FROM photos'
+        if originals_only:
+            query += ' WHERE original IS NULL'
+        query += ' ORDER BY capture_time'
+        return [self._path(row[0]) for row in self._db.execute(query)]
+
+    def photo_info(self, file):
+        """
+        :param file: photo file
+        :return: dict with original, filter, capture_time and print_count or None if the photo is not in the catalog
+        """
+        row = self._db.execute('SELECT original, filter, capture_time, print_count FROM photos WHERE name = ?',
+                               (self._name(file),)).fetchone()
+        if row is None:
+            return None
+        return {'original': self._path(row[0]) if row[0] else None, 'filter': row[1], 'capture_time': row[2],
+                'print_count': row[3]}
+
+    def reconcile(self):
+        """
+        Add photos that are missing in the catalog and remove photos that do not exist anymore.
+        The directory is only scanned if its modification time changed since the last reconciliation.
+        :return: True if the directory was scanned
+        """
+        directory_mtime = os.path.getmtime(self.photo_directory)
+        if self._get_meta('directory_mtime') == directory_mtime:
+            return False
+
+        files = set(name for name in os.listdir(self.photo_directory)
+                    if os.path.splitext(name)[1].lower() in PHOTO_EXTENSIONS)
+        cataloged = set(row[0] for row in self._db.execute('SELECT name FROM photos'))
+
+        for name in sorted(files - cataloged):
+            self._insert(name, capture_time=os.path.getmtime(self._path(name)))
+        removed = cataloged - files
+        for name in removed:
+            self._db.execute('DELETE FROM photos WHERE name = ?', (name,))
+        self._count -= len(removed)
+        self._set_meta('directory_mtime', directory_mtime)
+        self._db.commit()
+        return True
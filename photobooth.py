@@ -1,9 +1,9 @@
 #! /usr/bin/env python
 import time
-from threading import Thread
-import glob
-import random
+from threading import Thread, Lock, Event, BoundedSemaphore
+from multiprocessing.pool import ThreadPool
 import os
+import shutil
 import socket
 import gettext
 import traceback
@@ -16,9 +16,16 @@ from subprocess import check_output
 from pygame_utils import *
 from user_io import get_user_io_factory, LedState, LedType
 from camera import get_camera_factory
+from memory_watchdog import MemoryWatchdog
+from compositor import Compositor
+from photo_cache import PhotoPrefetcher, DerivativeCache
+from photo_catalog import PhotoCatalog
+from playlist import Playlist
 from instagram_filters.filters import Gotham, Kelvin, Nashville, Lomo, Toaster, BlackAndWhite
 from instagram_filters.decorations import Logo
-from instagram_filters.filter import Filter
+from instagram_filters.filter import Filter, BACKEND_IMAGEMAGICK, BACKEND_LUT, BACKEND_AUTO, resolve_backend, \
+    apply_filters
+from instagram_filters.lut import lut_cache
 import print_utils
 import storage
 
@@ -36,10 +43,10 @@ MAX_PREVIEW_FAILURE_CNT = 10
 BUTTON_BAR_Y_OFFSET = 80
 
 
-def draw_wait_box(screen, text):
-    draw_text_box(screen=screen, text=text, pos=(None, None),
+def draw_wait_box(render_target, text):
+    draw_text_box(screen=render_target.surface, text=text, pos=(None, None),
                   size=INFO_FONT_SIZE, border_color=COLOR_GREY)
-    pygame.display.update()
+    render_target.update()
 
 class PhotoBoothState(object):
     """
@@ -48,8 +55,15 @@ class PhotoBoothState(object):
     with the switch_* methods. A specific state implementation inherits from this class and implements its logic
     either in the counter_callback handler or in the update_callback function or both. The update is periodically
     triggered by the main application.
+    Animated states are updated with their frame_rate, idle states (needs_redraw returns False) are only updated on
+    input events, new camera frames and counter ticks, but at least every idle_timeout seconds.
     """
 
+    # max updates per second while the state needs redraws
+    frame_rate = 30
+    # max seconds between two updates of an idle state
+    idle_timeout = 1.0
+
     def __init__(self, photobooth, next_state, failure_state=None, counter_callback=None, counter_callback_args=None, counter=-1):
         """
         :param photobooth: Reference to the main application
@@ -78,6 +92,12 @@ class PhotoBoothState(object):
         self.counter_last_update_time = time.time()
         self.photobooth.io_manager.reset_button_states()
 
+    def leave(self):
+        """
+        Called when the photobooth switches from this state to another one, override to stop background work
+        """
+        pass
+
     def set_counter(self, value):
         self.counter_last_update_time = time.time()
         self.counter = value
@@ -128,6 +148,24 @@ class PhotoBoothState(object):
 
         return False
 
+    def needs_redraw(self):
+        """
+        Override this function for states that only change on events
+        :return: True if the state has to be updated with its frame_rate, e.g. for animations
+        """
+        return True
+
+    def next_update_delay(self):
+        """
+        :return: seconds until the state needs the next update if no event arrives
+        """
+        if self.needs_redraw():
+            return 0
+        delay = self.idle_timeout
+        if self.counter > 0:
+            delay = min(delay, self.counter_last_update_time + self.counter_sleep_time - time.time())
+        return max(0, delay)
+
     def is_counter_expired(self):
         """
         Check if the count down counter is expired
@@ -179,6 +217,8 @@ class PhotoBoothState(object):
         """
         self._is_processing = False
         thead.join()
+        # the wait message was drawn directly to the screen
+        self.photobooth.compositor.invalidate()
 
     def _wait_worker(self):
         """
@@ -187,7 +227,7 @@ class PhotoBoothState(object):
         point_count = 0
         led_counter = 0
         while self._is_processing:
-            draw_wait_box(self.photobooth.screen, _("Please wait, processing") + '.' * point_count)
+            draw_wait_box(self.photobooth.render_target, _("Please wait, processing") + '.' * point_count)
             point_count += 1
             led_counter += 1
             point_count = point_count % 4
@@ -202,8 +242,11 @@ class PhotoBooth(object):
     Important objects in this class:
     state: the current state of the photobooth state machine
     cam: The camera object
-    screen: The pygame screen for drawing
+    screen: The pygame screen for drawing, an offscreen surface if a fixed render resolution is configured
+    render_target: Holds the screen and scales it to the display
     event_manager: Cache/handler for pygame events like button presses, mouse clicks etc
+    catalog: Persistent catalog of the photos in the current photo directory
+    compositor: Collects the drawing of the current state and updates only changed screen regions
     io_manager: Handling and enbaling ALL user input output, like external buttons, leds etc
     config: Access configuration values
     """
@@ -212,6 +255,16 @@ class PhotoBooth(object):
 
         self.cam = None
         self.screen = None
+        self.render_target = None
+        # catalog of the photos in the photo directory
+        self.catalog = None
+        # shuffled slide show order of the photos in the catalog
+        self.playlist = Playlist(recent_weight=config.get('slide_show_recent_weight', 0),
+                                 recent_count=config.get('slide_show_recent_count', 10),
+                                 state_file=config.get('slide_show_playlist_file'),
+                                 save_interval=config.get('slide_show_playlist_save_interval', 60))
+        self.compositor = Compositor()
+        self.clock = pygame.time.Clock()
         self._state = None
         self._last_state = None
         # tuple of (pygame.image, image path)
@@ -225,6 +278,28 @@ class PhotoBooth(object):
         self.tmp_dir = config['temp_directory']
 
         self.fullscreen=bool(config['fullscreen'])
+        # bits per pixel of the display, 0 uses the best available mode, 16 halves surface memory on small boards
+        self.display_depth = config.get('display_depth', 0)
+        # optional fixed internal resolution, all states draw at this size and the result is scaled to the display
+        self.render_resolution = config.get('render_resolution')
+        # backend of the photo filters, see instagram_filters.filter
+        self.filter_backend = config.get('filter_backend', BACKEND_IMAGEMAGICK)
+        # compiled color lookup tables of the lut filter backend are reused across restarts
+        if self.filter_backend in (BACKEND_LUT, BACKEND_AUTO):
+            lut_cache.set_directory(config.get('filter_lut_directory'))
+        # worker threads applying photo filters in parallel, imagemagick runs as separate processes
+        filter_workers = config.get('filter_workers', 4)
+        self.filter_pool = ThreadPool(processes=filter_workers)
+        # every filter job of both pools holds a slot, so at most filter_workers filters run at the same time
+        self.filter_slots = BoundedSemaphore(filter_workers)
+        # worker threads filtering new photos in full resolution before the guest selected a filter, None disables it,
+        # at least one slot stays free for the previews
+        self.speculative_filter_pool = None
+        self.speculative_filter_workers = min(config.get('filter_speculative_workers', 0), filter_workers - 1)
+        # memory in MB the speculative jobs may use together, fewer jobs are started for large photos
+        self.speculative_filter_max_memory = config.get('filter_speculative_max_memory', 300)
+        if self.speculative_filter_workers > 0:
+            self.speculative_filter_pool = ThreadPool(processes=self.speculative_filter_workers)
         # Detect the screen resolution
         info_object = pygame.display.Info()
         self.screen_resolution = [info_object.current_w, info_object.current_h]
@@ -234,6 +309,19 @@ class PhotoBooth(object):
         self.app_resolution = self.screen.get_size()
 
         self.screen.fill((128, 128, 128))
+
+        # optional raw screen resolution copies of the photos, shown without decoding
+        self.derivative_cache = None
+        if config.get('photo_cache_directory'):
+            self.derivative_cache = DerivativeCache(config['photo_cache_directory'],
+                                                    max_size_mb=config.get('photo_cache_max_size', 1000))
+
+        # decodes the upcoming slide show photos at screen size
+        self.photo_prefetcher = PhotoPrefetcher(size=self.app_resolution,
+                                                max_memory_mb=config.get('slide_show_cache_memory', 64),
+                                                prefetch_count=config.get('slide_show_prefetch_count', 3),
+                                                derivative_cache=self.derivative_cache)
+        self.playlist.lookahead = self.photo_prefetcher.prefetch_count
             
         self.event_manager = PyGameEventManager()
 
@@ -241,20 +329,38 @@ class PhotoBooth(object):
 
         self.change_photo_dir(new_directory=config['photo_directory'], reinit_camera=False)
 
+        self.watchdog = None
+        if config.get('watchdog_enabled', False):
+            self.watchdog = MemoryWatchdog(max_memory_mb=config.get('watchdog_max_memory', 600),
+                                           max_child_memory_mb=config.get('watchdog_max_child_memory', 300),
+                                           max_open_fds=config.get('watchdog_max_open_fds', 512),
+                                           max_zombies=config.get('watchdog_max_zombies', 10),
+                                           check_interval=config.get('watchdog_interval', 30),
+                                           max_recycles=config.get('watchdog_max_recycles', 3),
+                                           camera_pids=self.camera_pids,
+                                           tracemalloc_directory=config.get('watchdog_tracemalloc_directory'))
+
     def set_fullscreen(self, fullscreen):
         if fullscreen:
-            self.screen = pygame.display.set_mode(self.screen_resolution, pygame.FULLSCREEN)
+            display = pygame.display.set_mode(self.screen_resolution, pygame.FULLSCREEN, self.display_depth)
             pygame.mouse.set_visible(False)
         else:
             if self.cam:
-                picture = self.cam.get_preview()
+                with self.cam.camera_lock:
+                    picture = self.cam.get_preview()
                 if picture:
-                    self.screen = pygame.display.set_mode(picture.get_size())
+                    display = pygame.display.set_mode(picture.get_size(), 0, self.display_depth)
                 else:
                     raise Exception("Failed to get camera preview")
             else:
-                self.screen = pygame.display.set_mode(DEFAULT_RESOLUTION)
+                display = pygame.display.set_mode(DEFAULT_RESOLUTION, 0, self.display_depth)
+
+        self.render_target = RenderTarget(display, self.render_resolution)
+        self.screen = self.render_target.surface
 
+        # cached text and widgets were rendered for the old display
+        get_render_cache().clear()
+        self.compositor.set_target(self.render_target)
         self.app_resolution = self.screen.get_size()
 
     def change_photo_dir(self, new_directory, reinit_camera=True):
@@ -263,28 +369,103 @@ class PhotoBooth(object):
         # create photo directory if necessary
         if not os.path.exists(self.photo_directory):
             os.makedirs(self.photo_directory)
+        self.close_catalog()
+        self.catalog = PhotoCatalog(self.photo_directory)
+        # catch up with photos added or deleted while the photobooth was not running
+        self.catalog.reconcile()
+        self.playlist.set_items(self.catalog.photos())
         if reinit_camera:
             self.init_camera()
 
+    def close_catalog(self):
+        """
+        close the catalog database of the photo directory, required before the directory can be unmounted
+        """
+        if self.catalog:
+            self.catalog.close()
+            self.catalog = None
+
+    def add_photo(self, file, **kwargs):
+        """
+        add a new photo of the photo directory to the catalog and the slide show
+        :param file: photo file
+        :param kwargs: optional arguments of PhotoCatalog.add_photo
+        """
+        self.catalog.add_photo(file, **kwargs)
+        self.playlist.add(file)
+
     def init_camera(self):
         if self.cam:
+            self.cam.stop_preview_stream()
             self.cam.close()
 
-        self.cam = get_camera_factory().create_algorithm(id_class=self.config['camera_type'], photo_directory=self.photo_directory, tmp_directory=self.tmp_dir)
+        self.cam = get_camera_factory().create_algorithm(id_class=self.config['camera_type'], photo_directory=self.photo_directory, tmp_directory=self.tmp_dir,
+                                                         preview_mode=self.config.get('camera_preview_mode', 'shell'),
+                                                         capture_mode=self.config.get('camera_capture_mode', 'process'),
+                                                         server_backend=self.config.get('camera_server_backend', 'gphoto2cffi'),
+                                                         max_memory_mb=self.config.get('camera_server_max_memory', 300))
         self.cam.disable_live_autofocus()
         self.set_fullscreen(self.fullscreen)
 
+    def start_preview(self):
+        """
+        Start the background preview acquisition of the camera if it is enabled in the configuration,
+        otherwise previews are acquired synchronously by the states
+        """
+        if self.cam and self.config.get('camera_preview_thread', True):
+            # frames are decoded at screen size and mirrored in the producer thread
+            self.cam.start_preview_stream(size=self.app_resolution, mirror=True, frame_callback=post_wake_event)
+
+    def stop_preview(self):
+        if self.cam:
+            self.cam.stop_preview_stream()
+
+    def camera_pids(self):
+        """
+        :return: ids of camera processes the watchdog can not recognize by their name, e.g. the camera server
+        """
+        pid = getattr(self.cam, 'server_pid', None)
+        return [pid] if pid else []
+
+    def recycle_camera_if_necessary(self):
+        """
+        Recreate the camera backend if the watchdog detected a resource problem,
+        call this only between photo sessions
+        """
+        if self.watchdog and self.watchdog.recycle_reasons:
+            print("Recycling camera: " + ", ".join(self.watchdog.recycle_reasons))
+            self.watchdog.reset()
+            try:
+                self.init_camera()
+            except Exception as e:
+                print("Recycling camera failed: " + str(e))
+
+    def wait_for_next_update(self):
+        """
+        Sleep until the current state needs an update, input events and new camera frames wake up earlier
+        """
+        self.event_manager.wait_events(self.state.next_update_delay())
+        self.clock.tick(self.state.frame_rate)
+
     def update(self):
         self.event_manager.update_events()
         self.state.update()
         #order is important here
         self.io_manager.update()
+        if self.watchdog:
+            self.watchdog.update()
 
     def close(self):
         if self.cam:
+            self.cam.stop_preview_stream()
             self.cam.set_idle()
         if self.io_manager:
             self.io_manager.set_all_led(LedState.OFF)
+        self.filter_pool.terminate()
+        self.close_catalog()
+        self.playlist.flush()
+        if self.speculative_filter_pool:
+            self.speculative_filter_pool.terminate()
         pygame.quit()
 
     @property
@@ -309,9 +490,19 @@ class PhotoBooth(object):
         set new photo
         :param value: tuple of (pygame.image, image path)
         """
+        self.set_last_photo(value)
+
+    def set_last_photo(self, value, resized_photo=None):
+        """
+        set new photo
+        :param value: tuple of (pygame.image, image path)
+        :param resized_photo: optional pygame.image of the photo already resized to screen
+        """
         self._last_photo = value
         #resize photo to screen
-        self._last_photo_resized = (pygame.transform.scale(value[0], self.screen.get_size()), value[1])
+        if not resized_photo or resized_photo.get_size() != self.screen.get_size():
+            resized_photo = pygame.transform.scale(value[0], self.screen.get_size())
+        self._last_photo_resized = (convert_image(resized_photo), value[1])
 
     @property
     def state(self):
@@ -323,6 +514,8 @@ class PhotoBooth(object):
             self.state = value.next_state
             return
 
+        if self._state:
+            self._state.leave()
         self._last_state = self._state
         self._state = value
         self._state.reset()
@@ -342,11 +535,15 @@ class StateWaitingForCamera(PhotoBoothState):
         super(StateWaitingForCamera, self).__init__(photobooth=photobooth, next_state=next_state)
         self.admin_state = admin_state
 
+    def needs_redraw(self):
+        # retries are slowed down by the failing camera initialisation anyway
+        return False
+
     def update_callback(self):
         # try initialisation again
         try:
             #background color
-            draw_rect(self.photobooth.screen, (0, 0), self.photobooth.app_resolution)
+            self.photobooth.compositor.draw(draw_rect, (0, 0), self.photobooth.app_resolution)
             if self.photobooth.io_manager.admin_button_pressed():
                 if self.admin_state:
                     self.photobooth.state = self.admin_state
@@ -354,10 +551,10 @@ class StateWaitingForCamera(PhotoBoothState):
             self.switch_next()
         except Exception as e:
             pos = get_text_mid_position(self.photobooth.app_resolution)
-            show_text_mid(self.photobooth.screen, _("Camera not connected:"), pos,
-                           size=INFO_FONT_SIZE, color=COLOR_ORANGE)
-            show_text_mid(self.photobooth.screen, str(e), (pos[0],pos[1]+40),
-                           size=INFO_FONT_SIZE, color=COLOR_ORANGE)
+            self.photobooth.compositor.draw(show_text_mid, _("Camera not connected:"), pos,
+                                            size=INFO_FONT_SIZE, color=COLOR_ORANGE)
+            self.photobooth.compositor.draw(show_text_mid, str(e), (pos[0],pos[1]+40),
+                                            size=INFO_FONT_SIZE, color=COLOR_ORANGE)
             print(str(e))
             time.sleep(1)
 
@@ -368,8 +565,6 @@ class StateShowSlideShow(PhotoBoothState):
     """
     def __init__(self, photobooth, next_state, counter):
 
-        self._photo_set = []
-        self._photo_set_already_shown = []
         self.current_photo = None, None
 
         super(StateShowSlideShow, self).__init__(photobooth=photobooth, next_state=next_state, counter=counter,
@@ -377,7 +572,7 @@ class StateShowSlideShow(PhotoBoothState):
 
         logo = self.photobooth.config['logo']
         if logo:
-            self._logo_img = pygame.image.load(logo)
+            self._logo_img = load_image(logo)
         else:
             self._logo_img = None
 
@@ -386,58 +581,58 @@ class StateShowSlideShow(PhotoBoothState):
             self.switch_next()
 
         if self.current_photo[0]:
-            show_cam_picture(self.photobooth.screen, self.current_photo[0])
+            self.photobooth.compositor.draw_background(show_cam_picture, self.current_photo[0])
             if self._logo_img:
                 self.draw_logo(self._logo_img)
 
         self.photobooth.io_manager.show_led_coutdown(self.counter)
 
-        draw_text_box(screen=self.photobooth.screen, text=_("Slideshow, press any button to continue"),
-                      pos=(None, self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET), size=INFO_FONT_SIZE)
+        self.photobooth.compositor.draw(draw_text_box, text=_("Slideshow, press any button to continue"),
+                                        pos=(None, self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET),
+                                        size=INFO_FONT_SIZE)
+
+    def needs_redraw(self):
+        # photos only change on counter ticks and button presses
+        return False
 
     def draw_logo(self, logo):
         offset = 15
         img_size = logo.get_size()
         pos = (self.photobooth.app_resolution[0] - img_size[0] - offset, offset)
-        self.photobooth.screen.blit(logo, pos)
+        self.photobooth.compositor.draw(draw_image, logo, pos)
+
+    def _show_photo(self, photo_file):
+        if photo_file and photo_file != self.current_photo[1]:
+            print("Next photo: " + photo_file)
+            self.current_photo = self.photobooth.photo_prefetcher.get(photo_file), photo_file
+        self._prefetch()
+        super(StateShowSlideShow, self).reset()  # reset counter
 
     def _last_photo(self):
-        if len(self._photo_set_already_shown) > 0:
-            if self.current_photo:
-                self._photo_set.append(self.current_photo[1])
-            last = self._photo_set_already_shown[-1]
-            self._photo_set_already_shown.remove(last)
-            print("Next photo: " + last)
-            print("Old ", self._photo_set_already_shown)
-            print("New ", self._photo_set)
-            self.current_photo = pygame.image.load(last), last
-            super(StateShowSlideShow, self).reset()  # reset counter
+        self._show_photo(self.photobooth.playlist.prev())
 
     def _next_photo(self):
-        #save already shown photos
-        if self.current_photo:
-            self._photo_set_already_shown.append(self.current_photo[1])
+        self._show_photo(self.photobooth.playlist.next())
 
-        if len(self._photo_set) > 0:
-            photo_file = random.choice(self._photo_set)
-            self._photo_set.remove(photo_file)
-            print("Next photo: " + photo_file)
-            print("Old ", self._photo_set_already_shown)
-            print("New ", self._photo_set)
-            self.current_photo =  pygame.image.load(photo_file), photo_file
-        else:
-            self._reload_photo_set() # check for new photos
-        super(StateShowSlideShow, self).reset()  # reset counter
+    def _prefetch(self):
+        """
+        decode the upcoming photos and the previous one in the background
+        """
+        playlist = self.photobooth.playlist
+        self.photobooth.photo_prefetcher.prefetch(playlist.peek() + [photo for photo in [playlist.previous] if photo])
 
     def _reload_photo_set(self):
-        # load all images from directory
-        self._photo_set = glob.glob(self.photobooth.photo_directory + "/*.jpg")
-        self._photo_set_already_shown = []
+        # the catalog only scans the directory if it was changed by others, photos taken by the photobooth are
+        # already in the playlist
+        if self.photobooth.catalog.reconcile():
+            self.photobooth.playlist.set_items(self.photobooth.catalog.photos())
 
     def reset(self):
         super(StateShowSlideShow, self).reset()
         if self.photobooth.cam:
+            self.photobooth.stop_preview()
             self.photobooth.cam.set_idle()
+        self.photobooth.photo_prefetcher.set_size(self.photobooth.app_resolution)
         self._reload_photo_set()
         self._next_photo()
         print("Loading Slideshow images")
@@ -451,7 +646,7 @@ class StateAdvancedSlideShow(StateShowSlideShow):
     def update_callback(self):
 
         if self.current_photo[0]:
-            show_cam_picture(self.photobooth.screen, self.current_photo[0])
+            self.photobooth.compositor.draw_background(show_cam_picture, self.current_photo[0])
             if self._logo_img:
                 self.draw_logo(self._logo_img)
 
@@ -467,10 +662,10 @@ class StateAdvancedSlideShow(StateShowSlideShow):
             self.photobooth.last_photo = self.current_photo
             self.switch_state(self.print_state)
 
-        draw_text_box(screen=self.photobooth.screen, text=_("Slideshow"), pos=(40, 40), size=CAPTION_FONT_SIZE)
+        self.photobooth.compositor.draw(draw_text_box, text=_("Slideshow"), pos=(40, 40), size=CAPTION_FONT_SIZE)
 
-        draw_button_bar(self.photobooth.screen, text=[_("Return"), _("Prev"), _("Next"), _("Print")],
-                        pos=(None, self.photobooth.app_resolution[1] - BUTTON_BAR_Y_OFFSET))
+        self.photobooth.compositor.draw(draw_button_bar, text=[_("Return"), _("Prev"), _("Next"), _("Print")],
+                                        pos=(None, self.photobooth.app_resolution[1] - BUTTON_BAR_Y_OFFSET))
 
 
 class StateWaitingForPhotoTrigger(PhotoBoothState):
@@ -483,7 +678,6 @@ class StateWaitingForPhotoTrigger(PhotoBoothState):
                                                           counter_callback=self._switch_timeout_state)
         self.timeout_state = timeout_state
         self.admin_state = admin_state
-        self._preview_failure_cnt = 0
 
     def update_callback(self):
         if self.photobooth.io_manager.admin_button_pressed():
@@ -491,23 +685,20 @@ class StateWaitingForPhotoTrigger(PhotoBoothState):
                 self.photobooth.state = self.admin_state
         elif self.photobooth.event_manager.mouse_pressed() or self.photobooth.io_manager.any_button_pressed(reset=True):
             self.switch_next()
-        preview_img = None
-        try:
-            preview_img = self.photobooth.cam.get_preview()
-        except:
-            self._preview_failure_cnt += 1
+        preview_img = self.photobooth.cam.latest_frame(size=self.photobooth.app_resolution, mirror=True)
         if preview_img:
-            show_cam_picture(self.photobooth.screen, preview_img)
-            self._preview_failure_cnt = 0
-        elif self._preview_failure_cnt > MAX_PREVIEW_FAILURE_CNT:
+            self.photobooth.compositor.draw_background(show_cam_picture, preview_img, flip=False)
+        elif self.photobooth.cam.preview_failure_count > MAX_PREVIEW_FAILURE_CNT:
             raise Exception("Preview failed")
-        else:
-            self._preview_failure_cnt += 1
 
-        draw_button_bar(self.photobooth.screen, text=[_("Photo"),_("Photo"),_("Photo"),_("Photo")],
-                        pos=(None,self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET))
+        self.photobooth.compositor.draw(draw_button_bar, text=[_("Photo"),_("Photo"),_("Photo"),_("Photo")],
+                                        pos=(None,self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET))
         self.photobooth.io_manager.set_all_led(LedState.ON) #TODO maybe not necessary, but needs to be tested
 
+    def needs_redraw(self):
+        # a running preview stream wakes up the main loop for each new frame
+        return not self.photobooth.cam.is_preview_stream_running()
+
     def _switch_timeout_state(self):
         if self.timeout_state:
             self.photobooth.state = self.timeout_state
@@ -517,85 +708,122 @@ class StateWaitingForPhotoTrigger(PhotoBoothState):
     def reset(self):
         super(StateWaitingForPhotoTrigger, self).reset()
         self.photobooth.io_manager.set_all_led(LedState.ON)
-        self._preview_failure_cnt = 0
+        # nobody is using the photobooth right now
+        self.photobooth.recycle_camera_if_necessary()
+        self.photobooth.start_preview()
 
 class StatePhotoTrigger(PhotoBoothState):
     """
     Count down photo trigger state
     """
-    def __init__(self, photobooth, next_state, failure_state=None, counter=-1):
+    def __init__(self, photobooth, next_state, failure_state=None, counter=-1, state_filter=None):
         super(StatePhotoTrigger, self).__init__(photobooth=photobooth, next_state=next_state,
                                                 failure_state=failure_state, counter=counter,
                                                 counter_callback=self._take_photo)
-        self._arrow_img = pygame.image.load('res/arrow.png')
+        # filter state that starts filtering the new photo in the background
+        self.state_filter = state_filter
+        self._arrow_img = load_image('res/arrow.png')
         self._mid_position = get_text_mid_position(self.photobooth.app_resolution)
         self._last_preview = None
-        self._preview_failure_cnt = 0
         self._autofocus_enabled = True
+        self._capture = None
+        self._capture_start_time = 0
 
     def update_callback(self):
 
+        if self._capture:
+            self._update_capture()
+            return
+
         self.photobooth.io_manager.show_led_coutdown(self.counter)
 
         if self.counter == 1:
             self.show_final_view()
-            pygame.display.update()
+            # show the final view before the camera gets busy
+            self.photobooth.compositor.update()
             if self._autofocus_enabled:
+                # the final view does not need previews, release the camera for the photo
+                self.photobooth.stop_preview()
                 self.photobooth.cam.disable_live_autofocus()
                 self._autofocus_enabled = False
         else:
-            preview_img = None
-            try:
-                preview_img = self.photobooth.cam.get_preview()
-            except:
-                self._preview_failure_cnt += 1
+            preview_img = self.photobooth.cam.latest_frame(size=self.photobooth.app_resolution, mirror=True)
             if preview_img:
-                show_cam_picture(self.photobooth.screen, preview_img)
+                self.photobooth.compositor.draw_background(show_cam_picture, preview_img, flip=False)
                 self._last_preview = preview_img
-                self._preview_failure_cnt = 0
-            elif self._preview_failure_cnt > MAX_PREVIEW_FAILURE_CNT:
+            elif self.photobooth.cam.preview_failure_count > MAX_PREVIEW_FAILURE_CNT:
                 raise Exception("Preview failed")
-            else:
-                self._preview_failure_cnt += 1
             # Show countdown
-            show_text_mid(self.photobooth.screen, str(self.counter), self._mid_position, COUNTER_FONT_SIZE, COLOR_WHITE,
-                          shadow_size=16)
+            self.photobooth.compositor.draw(show_text_mid, str(self.counter), self._mid_position, COUNTER_FONT_SIZE,
+                                            COLOR_WHITE, shadow_size=16)
 
             #cancel photo if necessary
-            draw_button_bar(self.photobooth.screen, text=[_("Cancel"), "", "", ""],
-                            pos=(None, self.photobooth.app_resolution[1] - BUTTON_BAR_Y_OFFSET))
+            self.photobooth.compositor.draw(draw_button_bar, text=[_("Cancel"), "", "", ""],
+                                            pos=(None, self.photobooth.app_resolution[1] - BUTTON_BAR_Y_OFFSET))
         if self.photobooth.io_manager.cancel_button_pressed():
-            self.photobooth.cam.disable_live_autofocus()
+            with self.photobooth.cam.camera_lock:
+                self.photobooth.cam.disable_live_autofocus()
             self.switch_last()
 
     def show_final_view(self):
         arrow_size = self._arrow_img.get_size()
         offset = 50
         pos = (self._mid_position[0] - (arrow_size[0] // 2), offset)
-        draw_rect(self.photobooth.screen, (0, 0),
-                  (self.photobooth.app_resolution[0], self.photobooth.app_resolution[1]))
-        self.photobooth.screen.blit(self._arrow_img, pos)
-        show_text_mid(self.photobooth.screen, _("Smile :-)"), (self._mid_position[0], arrow_size[1]+50 + offset),
-                      COUNTER_FONT_SIZE, color=COLOR_DARK_GREY)
+        compositor = self.photobooth.compositor
+        compositor.draw(draw_rect, (0, 0), (self.photobooth.app_resolution[0], self.photobooth.app_resolution[1]))
+        compositor.draw(draw_image, self._arrow_img, pos)
+        compositor.draw(show_text_mid, _("Smile :-)"), (self._mid_position[0], arrow_size[1]+50 + offset),
+                        COUNTER_FONT_SIZE, color=COLOR_DARK_GREY)
+
+    def show_developing_view(self):
+        """
+        animation shown while the photo is downloaded and decoded
+        """
+        point_count = int((time.time() - self._capture_start_time) * 2) % 4
+        compositor = self.photobooth.compositor
+        compositor.draw(draw_rect, (0, 0), (self.photobooth.app_resolution[0], self.photobooth.app_resolution[1]))
+        compositor.draw(show_text_mid, _("Developing photo") + '.' * point_count, self._mid_position,
+                        INFO_FONT_SIZE, color=COLOR_DARK_GREY)
+
+    def _update_capture(self):
+        """
+        keep the ui alive until the asynchronous capture has finished
+        """
+        self.show_developing_view()
+        self.photobooth.io_manager.show_led_coutdown(int((time.time() - self._capture_start_time) * 2))
+
+        if self._capture.done():
+            capture = self._capture
+            self._capture = None
+            # raises in case the capture failed
+            photo = capture.result()
+            self.photobooth.set_last_photo(photo, resized_photo=capture.screen_photo)
+            self.photobooth.add_photo(photo[1])
+            if self.photobooth.derivative_cache:
+                self.photobooth.derivative_cache.store_async(photo[1], self.photobooth.last_photo_resized[0])
+            if self.state_filter and self.state_filter.enabled:
+                self.state_filter.start_speculative_filtering(photo)
+            self.photobooth.io_manager.set_all_led(LedState.ON)
+            self.switch_next()
 
     def reset(self):
         super(StatePhotoTrigger, self).reset()
+        self._capture = None
         self._mid_position = get_text_mid_position(self.photobooth.app_resolution) # update in case resolution changed
-        self._preview_failure_cnt = 0
         if self.photobooth.cam:
             self._autofocus_enabled = True
-            self.photobooth.cam.enable_live_autofocus()
+            with self.photobooth.cam.camera_lock:
+                self.photobooth.cam.enable_live_autofocus()
+            self.photobooth.start_preview()
         
     def _take_photo(self):
 
         self.photobooth.io_manager.show_led_coutdown(self.counter)
 
-        # take photo
-        self.photobooth.last_photo = self.photobooth.cam.take_photo()
-
-        self.photobooth.io_manager.set_all_led(LedState.ON)
-
-        self.switch_next()
+        # take photo, returns once the shutter was released, download and decoding continue in the background
+        self.photobooth.stop_preview()
+        self._capture_start_time = time.time()
+        self._capture = self.photobooth.cam.take_photo_async(screen_size=self.photobooth.screen.get_size())
 
 
 class StateShowPhoto(PhotoBoothState):
@@ -606,7 +834,10 @@ class StateShowPhoto(PhotoBoothState):
         super(StateShowPhoto, self).__init__(photobooth=photobooth, next_state=next_state, counter=counter, counter_callback=self.switch_next)
 
     def update_callback(self):
-        show_cam_picture(self.photobooth.screen, self.photobooth.last_photo_resized[0])
+        self.photobooth.compositor.draw_background(show_cam_picture, self.photobooth.last_photo_resized[0])
+
+    def needs_redraw(self):
+        return False
 
 class StatePrinting(PhotoBoothState):
     """
@@ -623,7 +854,7 @@ class StatePrinting(PhotoBoothState):
         try:
             if self.logo_file:
                 printfile = self.photobooth.tmp_dir + "/logo_print_file.jpg"
-                fil = Filter(filename=photo_file, output_filename=printfile)
+                fil = Filter(filename=photo_file, output_filename=printfile, backend=self.photobooth.filter_backend)
                 decoration = Logo(logo_path=self.logo_file)
                 fil.add_post_decoration(decoration=decoration)
                 if fil:
@@ -637,7 +868,7 @@ class StatePrinting(PhotoBoothState):
             return False
 
     def update_callback(self):
-        show_cam_picture(self.photobooth.screen, self.photobooth.last_photo_resized[0])
+        self.photobooth.compositor.draw_background(show_cam_picture, self.photobooth.last_photo_resized[0])
 
         self.photobooth.io_manager.set_led(led_type=LedType.GREEN,led_state=LedState.ON)
         self.photobooth.io_manager.set_led(led_type=LedType.RED, led_state=LedState.ON)
@@ -645,12 +876,15 @@ class StatePrinting(PhotoBoothState):
         self.photobooth.io_manager.set_led(led_type=LedType.YELLOW, led_state=LedState.OFF)
 
         if self._error_txt:
-            show_text_left(self.photobooth.screen, _("Print failure:"), (20, 240), size=INFO_FONT_SIZE, color=COLOR_ORANGE)
-            show_text_left(self.photobooth.screen, self._error_txt, (20, 270), size=INFO_FONT_SIZE, color=COLOR_ORANGE)
+            self.photobooth.compositor.draw(show_text_left, _("Print failure:"), (20, 240), size=INFO_FONT_SIZE,
+                                            color=COLOR_ORANGE)
+            self.photobooth.compositor.draw(show_text_left, self._error_txt, (20, 270), size=INFO_FONT_SIZE,
+                                            color=COLOR_ORANGE)
 
         if self.photobooth.event_manager.mouse_pressed() or self.photobooth.io_manager.accept_button_pressed():
             wait_thread = self._enable_wait_message()
             if self.print_photo(self.photobooth.last_photo[1]):
+                self.photobooth.catalog.increment_print_count(self.photobooth.last_photo[1])
                 self.switch_next()
                 self._error_txt = None
             else: # failure
@@ -659,10 +893,14 @@ class StatePrinting(PhotoBoothState):
         elif self.photobooth.io_manager.cancel_button_pressed():
             self.switch_next()
 
-        draw_text_box(screen=self.photobooth.screen, text=_("Print photo?"), pos=(None, INFO_TEXT_Y_POS), size=INFO_FONT_SIZE)
-        draw_button_bar(self.photobooth.screen, text=[_("Cancel"), "", "", _("Print")],
-                        pos=(None, self.photobooth.app_resolution[1] - BUTTON_BAR_Y_OFFSET))
+        self.photobooth.compositor.draw(draw_text_box, text=_("Print photo?"), pos=(None, INFO_TEXT_Y_POS),
+                                        size=INFO_FONT_SIZE)
+        self.photobooth.compositor.draw(draw_button_bar, text=[_("Cancel"), "", "", _("Print")],
+                                        pos=(None, self.photobooth.app_resolution[1] - BUTTON_BAR_Y_OFFSET))
      
+    def needs_redraw(self):
+        return False
+
     def reset(self):
         super(StatePrinting, self).reset()
 
@@ -671,13 +909,28 @@ class StateFilter(PhotoBoothState):
     """
     State for providing several filter options of the photo
     """
+
+    # filter classes by selection index, the first option is the unfiltered photo
+    FILTERS = [None, Nashville, Toaster, BlackAndWhite]
     def __init__(self, photobooth, next_state, counter=-1):
-        super(StateFilter, self).__init__(photobooth=photobooth, next_state=next_state, counter=counter, counter_callback=self.switch_next)
+        super(StateFilter, self).__init__(photobooth=photobooth, next_state=next_state, counter=counter, counter_callback=self._timeout)
 
         self.filter_photos = []
         self._picture_size = ()
         self._current_filter_idx = 0
-        self._filter_count = 4
+        self._filter_count = len(self.FILTERS)
+        # indices of the previews still created by the filter pool
+        self._pending_previews = set()
+        # results of previews of an older photo are dropped
+        self._preview_generation = 0
+        self._preview_lock = Lock()
+        # full resolution filtering started right after the capture, see start_speculative_filtering
+        self._speculative_jobs = {}
+        self._speculative_results = {}
+        self._speculative_photo = None
+        self._speculative_generation = 0
+        self._speculative_cancel = Event()
+        self._speculative_lock = Lock()
 
 
     def filter_photo_fullsize(self, photo, idx, dest):
@@ -693,7 +946,15 @@ class StateFilter(PhotoBoothState):
         width  = photo[0].get_size()[0]
         height = photo[0].get_size()[1]
 
-        if self.apply_photo_filter(input_file=photo[1], idx=idx, output_file=dest, width=width, height=height):
+        try:
+            applied = self.apply_photo_filter(input_file=photo[1], idx=idx, output_file=dest, width=width,
+                                              height=height)
+        except Exception as e:
+            # the unfiltered photo is used
+            print("Filtering photo with filter " + str(idx) + " failed: " + str(e))
+            return photo
+
+        if applied:
 
             photo_obj = pygame.image.load(filter_file)
 
@@ -701,26 +962,202 @@ class StateFilter(PhotoBoothState):
         else:
             return photo
 
-    def filter_photo_preview(self, photo, idx):
+    def start_speculative_filtering(self, photo):
+        """
+        Start filtering a new photo in full resolution with all filters in the background, e.g. right after the
+        capture while the guest still looks at the photo. The selected variant is promoted, the others are dropped.
+        :param photo: tuple (pygame.image, path) of the new photo
+        """
+        pool = self.photobooth.speculative_filter_pool
+        if not pool:
+            return
+        self.cancel_speculative_filtering()
+
+        width, height = photo[0].get_size()
+        budget = self.photobooth.speculative_filter_max_memory * 1024 * 1024
+        job_memory = self._job_memory(width, height)
+        max_jobs = min(self.photobooth.speculative_filter_workers, budget // job_memory)
+        memory_limit = None
+        if resolve_backend(self.photobooth.filter_backend) == BACKEND_IMAGEMAGICK:
+            # all filters run in a single convert process, a large photo is cached on disk instead of skipped
+            max_jobs = 1
+            if job_memory > budget:
+                memory_limit = budget
+        elif max_jobs < 1:
+            print("Speculative filtering skipped, a photo of " + str(width) + "x" + str(height) +
+                  " exceeds the memory limit")
+            return
+        screen_size = self.photobooth.screen.get_size()
+        self._speculative_photo = photo[1]
+        generation = self._speculative_generation
+        cancel_event = self._speculative_cancel
+        for indices in self._filter_groups(max_jobs):
+            dests = [self.photobooth.tmp_dir + "/speculative_filter" + str(generation) + "_" + str(idx) + ".jpg"
+                     for idx in indices]
+            job = pool.apply_async(self._speculative_worker,
+                                   (photo[1], indices, dests, width, height, screen_size, generation, cancel_event,
+                                    memory_limit))
+            for idx in indices:
+                self._speculative_jobs[idx] = job
+
+    def _speculative_worker(self, input_file, indices, dests, width, height, screen_size, generation, cancel_event,
+                            memory_limit):
+        """
+        worker function filtering the photo in full resolution in the speculative filter pool
+        """
+        results = {}
+        try:
+            with self.photobooth.filter_slots:
+                if cancel_event.is_set():
+                    # cancelled before the job started
+                    return
+                applied = self.apply_photo_filters(input_file, indices, dests, width=width, height=height,
+                                                   cancel_event=cancel_event, memory_limit=memory_limit)
+            for idx, dest in zip(indices, dests):
+                if idx in applied:
+                    # only the screen sized photo is kept in memory, the full resolution is needed as file only
+                    with open(dest, 'rb') as f:
+                        results[idx] = (convert_image(decode_jpeg(f.read(), screen_size)), dest)
+        except Exception as e:
+            if not cancel_event.is_set():
+                print("Speculative filtering with filters " + str(indices) + " failed: " + str(e))
+
+        with self._speculative_lock:
+            if generation == self._speculative_generation:
+                self._speculative_results.update(results)
+                return
+        for dest in dests:
+            if os.path.exists(dest):
+                os.remove(dest)
+
+    def cancel_speculative_filtering(self):
+        """
+        Drop all speculative results and stop the running jobs, they remove their files once they stopped
+        """
+        with self._speculative_lock:
+            self._speculative_generation += 1
+            self._speculative_cancel.set()
+            self._speculative_cancel = Event()
+            results = self._speculative_results
+            self._speculative_results = {}
+        self._speculative_jobs = {}
+        self._speculative_photo = None
+        for _, file in results.values():
+            if os.path.exists(file):
+                os.remove(file)
+
+    def is_speculative_result_ready(self, idx):
+        """
+        :param idx: filter_idx
+        :return: True if the speculative filtering of the last photo with this filter is finished
+        """
+        job = self._speculative_jobs.get(idx)
+        return job is not None and job.ready() and self._speculative_photo == self.photobooth.last_photo[1]
+
+    def promote_speculative_result(self, idx, dest):
+        """
+        Use the speculative result of a filter, waits if the filter is still running
+        :param idx: filter_idx
+        :param dest: destination path of the filtered photo
+        :return: tuple of the filtered photo (pygame.image, path) in full resolution and its screen sized
+                 pygame.image or None if there is no speculative result
         """
-        create a small preview filter img
+        job = self._speculative_jobs.get(idx)
+        if job is None or self._speculative_photo != self.photobooth.last_photo[1]:
+            return None
+        job.wait()
+        with self._speculative_lock:
+            result = self._speculative_results.pop(idx, None)
+        if result is None:
+            return None
+        shutil.move(result[1], dest)
+        return (pygame.image.load(dest), dest), result[0]
+
+    def filter_photo_previews(self, photo, indices, input_file, generation):
+        """
+        create small preview filter imgs, this is called by the threads of the filter pool
         :param photo: tuple (pygame.image,path)
-        :param idx: filter_idx to apply
-        :return: tuple (pygame.image,path) of new photo
+        :param indices: filter_idx of each preview
+        :param input_file: the small photo saved as file
+        :param generation: preview generation, previews of different photos never share a file
+        :return: list of tuple (pygame.image,path) of the new photos
         """
 
-        filter_file = self.photobooth.tmp_dir + "/filter" + str(idx) + ".jpg"
+        filter_files = [self._preview_file(generation, idx) for idx in indices]
 
-        pygame.image.save(photo[0], filter_file)
+        width, height = photo[0].get_size()
 
-        if self.apply_photo_filter(filter_file, idx):
+        applied = self.apply_photo_filters(input_file, indices, filter_files, width=width, height=height)
 
-            photo_obj = pygame.image.load(filter_file)
-            
-            return photo_obj, filter_file
+        return [(load_image(filter_file), filter_file) if idx in applied else photo
+                for idx, filter_file in zip(indices, filter_files)]
 
-        else:
-            return photo
+    def _preview_worker(self, photo, indices, input_file, generation):
+        """
+        worker function creating filter previews in the filter pool
+        """
+        try:
+            with self.photobooth.filter_slots:
+                filtered_photos = self.filter_photo_previews(photo=photo, indices=indices, input_file=input_file,
+                                                             generation=generation)
+        except Exception as e:
+            print("Creating filter previews " + str(indices) + " failed: " + str(e))
+            # the tiles keep showing the unfiltered photo
+            filtered_photos = [photo] * len(indices)
+        with self._preview_lock:
+            if generation == self._preview_generation:
+                for idx, filtered_photo in zip(indices, filtered_photos):
+                    self.filter_photos[idx] = filtered_photo
+                    self._pending_previews.discard(idx)
+                post_wake_event()
+                return
+        # previews of an older photo are dropped
+        self._remove_files([self._preview_file(generation, idx) for idx in indices])
+
+    def _preview_file(self, generation, idx):
+        """
+        :param generation: preview generation
+        :param idx: filter_idx
+        :return: path of the filter preview
+        """
+        return self.photobooth.tmp_dir + "/filter" + str(generation) + "_" + str(idx) + ".jpg"
+
+    def _remove_files(self, files):
+        """
+        delete files of filtered photos that are not used anymore
+        :param files: list of paths
+        """
+        for file in files:
+            if os.path.exists(file):
+                os.remove(file)
+
+    def _filter_groups(self, max_jobs=None, progressive=False):
+        """
+        :param max_jobs: optional maximum number of jobs, the filters are distributed over them
+        :param progressive: every filter is a job of its own, e.g. previews that are shown as soon as they are done
+        :return: lists of filter indices that are applied together in one job
+        """
+        indices = list(range(1, self._filter_count))
+        # imagemagick runs all filters in one process that decodes the photo once and parallelizes each step itself,
+        # its results are only available together once the process is done, native filters run in parallel jobs
+        if not progressive and resolve_backend(self.photobooth.filter_backend) == BACKEND_IMAGEMAGICK:
+            return [indices]
+        if max_jobs and max_jobs < len(indices):
+            return [indices[i::max_jobs] for i in range(max_jobs)]
+        return [[idx] for idx in indices]
+
+    def _job_memory(self, width, height):
+        """
+        rough peak memory of one filter job
+        :param width: width of the photo
+        :param height: height of the photo
+        :return: bytes
+        """
+        if resolve_backend(self.photobooth.filter_backend) == BACKEND_IMAGEMAGICK:
+            # 16 bit RGBA pixel cache of the mpr:source register, the image of the chain and one clone of a step
+            return width * height * 8 * 3
+        # 8 bit RGB photo and the float32 strips
+        return width * height * 3 * 2
 
     def apply_photo_filter(self, input_file, idx, output_file=None, width=None, height=None):
         """
@@ -733,20 +1170,36 @@ class StateFilter(PhotoBoothState):
         :return: True if a filter was applied
         """
 
-        fil = None
-        if idx == 1:
-            fil = Nashville(filename=input_file, output_filename=output_file, width=width, height=height)
-        if idx == 2:
-            fil = Toaster(filename=input_file, output_filename=output_file, width=width, height=height)
-        if idx == 3:
-            fil = BlackAndWhite(filename=input_file, output_filename=output_file, width=width, height=height)
+        return idx in self.apply_photo_filters(input_file, [idx], [output_file], width=width, height=height)
 
-        if fil:
-            fil.apply()
+    def apply_photo_filters(self, input_file, indices, output_files, width=None, height=None, cancel_event=None,
+                            memory_limit=None):
+        """
+        apply several photo filters to the same photo, the photo is decoded only once
+        :param input_file: the photo file to filter
+        :param indices: the idx of each filter to use
+        :param output_files: the created file of each filter
+        :param width: optional width of image to save some image loading
+        :param height: optional height of image to save some image loading
+        :param cancel_event: optional threading.Event, setting it stops the filtering with an exception
+        :param memory_limit: optional limit in bytes of the imagemagick pixel cache in memory
+        :return: list of the idx of the applied filters
+        """
+
+        filters = []
+        applied = []
+        for idx, output_file in zip(indices, output_files):
+            filter_class = self.FILTERS[idx]
+            if filter_class:
+                filters.append(filter_class(filename=input_file, output_filename=output_file, width=width,
+                                            height=height, backend=self.photobooth.filter_backend,
+                                            cancel_event=cancel_event, memory_limit=memory_limit))
+                applied.append(idx)
+
+        apply_filters(filters, backend=self.photobooth.filter_backend)
+        for fil in filters:
             fil.close_image()
-            return True
-        else:
-            return False
+        return applied
 
     def create_filtered_photo_collection(self):
         """
@@ -759,42 +1212,49 @@ class StateFilter(PhotoBoothState):
         mirrored_photo = pygame.transform.flip(small_size,True,False)
         
         scaled_original_photo = (mirrored_photo, last_photo[1])
-       
-        self.filter_photos = [
-            scaled_original_photo,
-            self.filter_photo_preview(photo=scaled_original_photo, idx=1),
-            self.filter_photo_preview(photo=scaled_original_photo, idx=2),
-            self.filter_photo_preview(photo=scaled_original_photo, idx=3)
-        ]
+
+        # all previews filter the same small file, it is replaced at once since jobs of the last photo might still
+        # read it
+        preview_file = self.photobooth.tmp_dir + "/filter_preview.jpg"
+        pygame.image.save(mirrored_photo, self.photobooth.tmp_dir + "/filter_preview_new.jpg")
+        os.rename(self.photobooth.tmp_dir + "/filter_preview_new.jpg", preview_file)
+
+        # the original is shown in every tile until its filtered preview is done
+        with self._preview_lock:
+            self._preview_generation += 1
+            generation = self._preview_generation
+            old_photos = self.filter_photos
+            self.filter_photos = [scaled_original_photo] * self._filter_count
+            self._pending_previews = set(range(1, self._filter_count))
+        # the previews of the last photo are in memory already
+        self._remove_files([file for _, file in old_photos[1:] if file != old_photos[0][1]])
+
+        for indices in self._filter_groups(progressive=True):
+            self.photobooth.filter_pool.apply_async(self._preview_worker, (scaled_original_photo, indices,
+                                                                           preview_file, generation))
 
     def draw_filtered_photos(self):
         """
         draw filter previews to screen
         """
         if len(self.filter_photos) > 0:
-            image_pos = (0, 0)
-            rect_pos = image_pos
-            self.photobooth.screen.blit(self.filter_photos[0][0], image_pos)
-            if self._current_filter_idx == 0:
-                rect_pos = image_pos
-            image_pos = (self._picture_size[0], 0)
-            self.photobooth.screen.blit(self.filter_photos[1][0], image_pos)
-            if self._current_filter_idx == 1:
-                rect_pos = image_pos
-            image_pos = ( 0, self._picture_size[1])
-            self.photobooth.screen.blit(self.filter_photos[2][0], image_pos)
-            if self._current_filter_idx == 2:
-                rect_pos = image_pos
-            image_pos = self._picture_size
-            self.photobooth.screen.blit(self.filter_photos[3][0], image_pos)
-            if self._current_filter_idx == 3:
-                rect_pos = image_pos
-            draw_rect(self.photobooth.screen, rect_pos, self._picture_size, color=None, color_border=COLOR_ORANGE,
-                      size_border=8)
+            compositor = self.photobooth.compositor
             text_margin = 10
+            tile_positions = [(0, 0), (self._picture_size[0], 0), (0, self._picture_size[1]), self._picture_size]
+            rect_pos = tile_positions[0]
+            for idx, image_pos in enumerate(tile_positions):
+                compositor.draw(draw_image, self.filter_photos[idx][0], image_pos)
+                if idx in self._pending_previews:
+                    compositor.draw(draw_text_box, text=_("Please wait, processing"),
+                                    pos=(image_pos[0] + text_margin, image_pos[1] + self._picture_size[1] // 2),
+                                    size=INFO_FONT_SIZE)
+                if self._current_filter_idx == idx:
+                    rect_pos = image_pos
+            compositor.draw(draw_rect, rect_pos, self._picture_size, color=None, color_border=COLOR_ORANGE,
+                            size_border=8)
             selected_image_text_pos = (rect_pos[0] + text_margin,rect_pos[1]+ text_margin)
-            draw_text_box(screen=self.photobooth.screen, text=_("Selected"), pos= selected_image_text_pos,
-                          size=INFO_FONT_SIZE, box_color=None, border_color=COLOR_ORANGE, size_border=5, text_color=COLOR_ORANGE)
+            compositor.draw(draw_text_box, text=_("Selected"), pos= selected_image_text_pos,
+                            size=INFO_FONT_SIZE, box_color=None, border_color=COLOR_ORANGE, size_border=5, text_color=COLOR_ORANGE)
 
     def update_callback(self):
 
@@ -817,6 +1277,7 @@ class StateFilter(PhotoBoothState):
         self._current_filter_idx = self._current_filter_idx % self._filter_count
 
         if self.photobooth.io_manager.cancel_button_pressed():
+            self.cancel_speculative_filtering()
             self.switch_state(self.failure_state)
             return
 
@@ -826,34 +1287,60 @@ class StateFilter(PhotoBoothState):
             self.switch_next()
             return
 
-        draw_text_box(screen=self.photobooth.screen, text=_("Select photo?"), pos=(None, INFO_TEXT_Y_POS), size=INFO_FONT_SIZE)
+        self.photobooth.compositor.draw(draw_text_box, text=_("Select photo?"), pos=(None, INFO_TEXT_Y_POS),
+                                        size=INFO_FONT_SIZE)
 
-        draw_button_bar(self.photobooth.screen, text=[_("Cancel"), _("Prev"), _("Next"), _("Select")],
-                        pos=(None,self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET))
+        self.photobooth.compositor.draw(draw_button_bar, text=[_("Cancel"), _("Prev"), _("Next"), _("Select")],
+                                        pos=(None,self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET))
 
 
+    def needs_redraw(self):
+        return False
+
+    def _timeout(self):
+        # the guest did not select a filter, the unfiltered photo is used
+        self.cancel_speculative_filtering()
+        self.switch_next()
+
     def filter_selected_photo(self):
         # create final file name
         path, ext = os.path.splitext(self.photobooth.last_photo[1])
         filter_file = path + '_filtered' + ext
 
-        wait_thread = self._enable_wait_message()
-        # redo filtering on full image resolution
-        self.photobooth.last_photo = self.filter_photo_fullsize(photo=self.photobooth.last_photo,
-                                                                idx=self._current_filter_idx, dest=filter_file)
-        self._disable_wait_message(wait_thread)
+        # no need to wait if the photo was already filtered in the background
+        wait_thread = None
+        if self._current_filter_idx and not self.is_speculative_result_ready(self._current_filter_idx):
+            wait_thread = self._enable_wait_message()
+        original_file = self.photobooth.last_photo[1]
+        result = self.promote_speculative_result(idx=self._current_filter_idx, dest=filter_file)
+        if result:
+            photo, resized_photo = result
+            self.photobooth.set_last_photo(photo, resized_photo=resized_photo)
+        else:
+            # redo filtering on full image resolution
+            self.photobooth.last_photo = self.filter_photo_fullsize(photo=self.photobooth.last_photo,
+                                                                    idx=self._current_filter_idx, dest=filter_file)
+        self.cancel_speculative_filtering()
+        if self.photobooth.last_photo[1] == filter_file:
+            self.photobooth.add_photo(filter_file, original=original_file,
+                                      filter_name=self.FILTERS[self._current_filter_idx].__name__)
+        if wait_thread:
+            self._disable_wait_message(wait_thread)
+
+    def leave(self):
+        # speculative results are only useful while the guest selects a filter
+        self.cancel_speculative_filtering()
 
     def reset(self):
         super(StateFilter, self).reset()
 
-        wait_thread = self._enable_wait_message()
         self._current_filter_idx = 0
 
         self._picture_size = (self.photobooth.screen.get_size()[0] // 2, self.photobooth.screen.get_size()[1] // 2)
 
+        # the previews are created in the background and drawn as soon as they are done
         if self.photobooth.last_photo_resized:
             self.create_filtered_photo_collection()
-        self._disable_wait_message(wait_thread)
 
 
 class StateAdmin(PhotoBoothState):
@@ -884,15 +1371,29 @@ class StateAdmin(PhotoBoothState):
             (_("Stop printer"), self.stop_printer),
             (_("Mount/Umount USB storage"), self.toggle_usb_storage),
         ]
+        if self.photobooth.derivative_cache:
+            self._options.append((_("Rebuild photo cache"), self.rebuild_photo_cache))
 
     def create_new_image_dir(self):
         if self.photobooth.photo_directory == self.photobooth.config['photo_directory']:
             os.rename(self.photobooth.photo_directory, self.photobooth.photo_directory + '-' + str(datetime.now()).replace(':','-'))
-            os.makedirs(self.photobooth.photo_directory)
+            # creates the directory and a new catalog
+            self.photobooth.change_photo_dir(self.photobooth.photo_directory, reinit_camera=False)
 
     def enable_input(self):
         self.input_handling = True
 
+    def rebuild_photo_cache(self):
+        """
+        Write the screen resolution sidecars of all photos in the background
+        """
+        self.photobooth.catalog.reconcile()
+        self.photobooth.derivative_cache.start_rebuild(self.photobooth.catalog.photos(),
+                                                       self.photobooth.app_resolution, PhotoPrefetcher.decode)
+
+    def needs_redraw(self):
+        return False
+
     def toggle_state_showphoto(self):
         """
         Enable/Disable show_photo state
@@ -923,12 +1424,19 @@ class StateAdmin(PhotoBoothState):
             self.state_printing.enabled = not self.state_printing.enabled
 
     def toggle_usb_storage(self):
-        if self.photobooth.photo_directory == self.photobooth.config['photo_directory']:
-            storage.umount_device(self.photobooth.config['usb_device'])
-            self.photobooth.change_photo_dir(storage.mount_device(self.photobooth.config['usb_device']))
-        else:
-            storage.umount_device(self.photobooth.config['usb_device'])
-            self.photobooth.change_photo_dir(self.photobooth.config['photo_directory'])
+        # the open catalog database would keep the usb storage busy
+        self.photobooth.close_catalog()
+        try:
+            if self.photobooth.photo_directory == self.photobooth.config['photo_directory']:
+                storage.umount_device(self.photobooth.config['usb_device'])
+                self.photobooth.change_photo_dir(storage.mount_device(self.photobooth.config['usb_device']))
+            else:
+                storage.umount_device(self.photobooth.config['usb_device'])
+                self.photobooth.change_photo_dir(self.photobooth.config['photo_directory'])
+        finally:
+            if not self.photobooth.catalog:
+                # switching failed, keep using the current directory
+                self.photobooth.change_photo_dir(self.photobooth.photo_directory, reinit_camera=False)
 
         self.refresh_information()
 
@@ -974,70 +1482,76 @@ class StateAdmin(PhotoBoothState):
         return ssid
 
     def get_number_taken_photos(self):
-        return len(glob.glob(self.photobooth.photo_directory + "/*.jpg"))
+        return self.photobooth.catalog.count()
 
     def update_callback(self):
+        compositor = self.photobooth.compositor
         # Background
-        draw_rect(self.photobooth.screen,(10,10),(self.photobooth.app_resolution[0]-20, self.photobooth.app_resolution[1]-20))
+        compositor.draw(draw_rect,(10,10),(self.photobooth.app_resolution[0]-20, self.photobooth.app_resolution[1]-20))
 
         x_pos = 20
         y_pos= INFO_TEXT_Y_POS
 
         # Caption
-        show_text_left(self.photobooth.screen, _("Administration"), (x_pos, y_pos), INFO_FONT_SIZE)
+        compositor.draw(show_text_left, _("Administration"), (x_pos, y_pos), INFO_FONT_SIZE)
         y_pos+=30
         #Infos
-        show_text_left(self.photobooth.screen, _("Fullscreen: ") + str(self.photobooth.fullscreen), (x_pos, y_pos),
-                       INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+        compositor.draw(show_text_left, _("Fullscreen: ") + str(self.photobooth.fullscreen), (x_pos, y_pos),
+                        INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
         y_pos += 30
-        show_text_left(self.photobooth.screen, _("Free space: ") + str(self._free_space) + "MB", (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+        compositor.draw(show_text_left, _("Free space: ") + str(self._free_space) + "MB", (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
         y_pos += 30
-        show_text_left(self.photobooth.screen, _("Network: ") + str(self._network), (x_pos, y_pos), INFO_SMALL_FONT_SIZE,
-                       color=COLOR_DARK_GREY)
+        compositor.draw(show_text_left, _("Network: ") + str(self._network), (x_pos, y_pos), INFO_SMALL_FONT_SIZE,
+                        color=COLOR_DARK_GREY)
         y_pos += 30
-        show_text_left(self.photobooth.screen, _("IP: ") + str(self._ip_address), (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+        compositor.draw(show_text_left, _("IP: ") + str(self._ip_address), (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
         y_pos += 30
-        show_text_left(self.photobooth.screen, _("Printer available: ") + str(self._printer_state), (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+        compositor.draw(show_text_left, _("Printer available: ") + str(self._printer_state), (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
         y_pos += 30
-        show_text_left(self.photobooth.screen, _("Photo directory: ") + str(self.photobooth.photo_directory), (x_pos, y_pos),
-                       INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+        compositor.draw(show_text_left, _("Photo directory: ") + str(self.photobooth.photo_directory), (x_pos, y_pos),
+                        INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
         y_pos += 30
-        show_text_left(self.photobooth.screen, _("Taken photos: ") + str(self._taken_photos), (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+        compositor.draw(show_text_left, _("Taken photos: ") + str(self._taken_photos), (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
         y_pos += 30
+        cache = self.photobooth.derivative_cache
+        if cache and (cache.is_rebuilding() or cache.rebuild_total):
+            compositor.draw(show_text_left, _("Photo cache: ") + "%d/%d" % (cache.rebuild_done, cache.rebuild_total),
+                            (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+            y_pos += 30
         if self.state_showphoto:
-            show_text_left(self.photobooth.screen, _("State 'ShowPhotos' enabled: ") + str(self.state_showphoto.enabled), (x_pos, y_pos),
-                           INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+            compositor.draw(show_text_left, _("State 'ShowPhotos' enabled: ") + str(self.state_showphoto.enabled), (x_pos, y_pos),
+                            INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
             y_pos += 30
         if self.state_filter:
-            show_text_left(self.photobooth.screen, _("State 'Filter' enabled: ") + str(self.state_filter.enabled),
-                           (x_pos, y_pos),
-                           INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+            compositor.draw(show_text_left, _("State 'Filter' enabled: ") + str(self.state_filter.enabled),
+                            (x_pos, y_pos),
+                            INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
             y_pos += 30
         if self.state_printing:
-            show_text_left(self.photobooth.screen, _("State 'Printing' enabled: ") + str(self.state_printing.enabled),
-                           (x_pos, y_pos),
-                           INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+            compositor.draw(show_text_left, _("State 'Printing' enabled: ") + str(self.state_printing.enabled),
+                            (x_pos, y_pos),
+                            INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
             y_pos += 30
 
-        show_text_left(self.photobooth.screen, _("Select option:"), (x_pos, y_pos), INFO_FONT_SIZE, color=COLOR_WHITE)
+        compositor.draw(show_text_left, _("Select option:"), (x_pos, y_pos), INFO_FONT_SIZE, color=COLOR_WHITE)
         y_pos += 30
         # Current selected option
-        show_text_left(self.photobooth.screen, self._options[self._current_option_idx][0], (x_pos, y_pos), size=INFO_FONT_SIZE, color=COLOR_GREEN)
+        compositor.draw(show_text_left, self._options[self._current_option_idx][0], (x_pos, y_pos), size=INFO_FONT_SIZE, color=COLOR_GREEN)
 
         if not self._request_confirmation:
-            draw_button_bar(self.photobooth.screen, text=[_("Back"), _("Prev"), _("Next"), _("Select")],
+            compositor.draw(draw_button_bar, text=[_("Back"), _("Prev"), _("Next"), _("Select")],
                             pos=(None,self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET))
         y_pos += 60
         #Confirmation request
         if self._request_confirmation:
-            show_text_left(self.photobooth.screen, "Please confirm selection: " + self._options[self._current_option_idx][0],
-                           (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
-            draw_button_bar(self.photobooth.screen, text=[_("Cancel"), "", "", _("Accept")],
+            compositor.draw(show_text_left, "Please confirm selection: " + self._options[self._current_option_idx][0],
+                            (x_pos, y_pos), INFO_SMALL_FONT_SIZE, color=COLOR_DARK_GREY)
+            compositor.draw(draw_button_bar, text=[_("Cancel"), "", "", _("Accept")],
                             pos=(None,self.photobooth.app_resolution[1]-BUTTON_BAR_Y_OFFSET))
 
         #Error
-        show_text_left(self.photobooth.screen, self._error_text, (x_pos, y_pos),
-                       size=INFO_FONT_SIZE, color=COLOR_ORANGE)
+        compositor.draw(show_text_left, self._error_text, (x_pos, y_pos),
+                        size=INFO_FONT_SIZE, color=COLOR_ORANGE)
 
         if(not self.input_handling):
             return
@@ -1134,7 +1648,8 @@ if __name__ == '__main__':
 
     state_admin = StateAdmin(photobooth=app, next_state=None, state_showphoto=state_show_photo, state_filter=state_filter_photo, state_printing=state_printing)
 
-    state_trigger_photo = StatePhotoTrigger(photobooth=app, next_state=state_show_photo, counter=cfg['photo_countdown'])
+    state_trigger_photo = StatePhotoTrigger(photobooth=app, next_state=state_show_photo, counter=cfg['photo_countdown'],
+                                            state_filter=state_filter_photo)
 
     if cfg['slide_show_advanced'] is True:
         state_timeout_slide_show = StateAdvancedSlideShow(photobooth=app, next_state=None, counter=cfg['slide_show_next_photo_timeout'], print_state=state_printing)
@@ -1172,18 +1687,20 @@ if __name__ == '__main__':
     #initial app state
     app.state = state_waiting_for_camera
 
-    clock = pygame.time.Clock()
-
     # Main program loop
     while not app.event_manager.quit_pressed():
 
         try:
-            clock.tick(30)
+            app.compositor.begin_frame()
             app.update()
+            app.compositor.update()
 
         except Exception as e:
             print(e)
             show_text_mid(app.screen, _("Error"), get_text_mid_position(app.app_resolution))
-        pygame.display.update()
+            app.compositor.invalidate()
+            app.render_target.update()
+
+        app.wait_for_next_update()
 
     app.close()
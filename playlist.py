@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import random
+from collections import deque
+
+
+class Playlist(object):
+    """
+    Endless shuffled playlist, e.g. of the slide show photos.
+
+    Every round shows each item once in random order using a lazy Fisher-Yates shuffle: the items array is split
+    into a not yet shown part at the front and the shown part at the back, drawing an item swaps a random unshown
+    item to the border. Drawing, adding items, next and prev are O(1).
+    A few items are drawn in advance, hence the upcoming items are known (see peek), and a bounded history allows
+    going back. Optionally recently added items are preferred and the playlist position is saved to a file.
+    Saving writes all items, hence changes are saved at most every save_interval seconds and by flush(), e.g. on exit.
+    """
+
+    def __init__(self, items=(), recent_weight=0, recent_count=10, max_history=100, lookahead=3, state_file=None,
+                 save_interval=60):
+        """
+        :param items: initial items, the newest last
+        :param recent_weight: probability in range 0..1 that an item is drawn from the recently added items
+        :param recent_count: number of items that count as recently added
+        :param max_history: number of items prev() can go back
+        :param lookahead: number of items drawn in advance
+        :param state_file: optional file the playlist state is saved to and restored from
+        :param save_interval: minimum seconds between two saves of changes
+        """
+        self.recent_weight = recent_weight
+        self.lookahead = lookahead
+        self.state_file = state_file
+        self.save_interval = save_interval
+        self._dirty = False
+        self._last_save_time = time.time()
+        self._items = []
+        self._index = {}
+        self._remaining = 0
+        self._recent = deque(maxlen=recent_count)
+        self._history = deque(maxlen=max_history)
+        self._position = -1
+        self._upcoming = deque()
+        if not (state_file and os.path.exists(state_file) and self.load(state_file)):
+            for item in items:
+                self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._index
+
+    @property
+    def current(self):
+        """
+        :return: currently shown item or None
+        """
+        if self._position >= 0:
+            return self._history[self._position]
+        return None
+
+    @property
+    def previous(self):
+        """
+        :return: item prev() will return or None
+        """
+        if self._position > 0:
+            return self._history[self._position - 1]
+        return None
+
+    def _swap(self, i, j):
+        items = self._items
+        items[i], items[j] = items[j], items[i]
+        self._index[items[i]] = i
+        self._index[items[j]] = j
+
+    def add(self, item):
+        """
+        add a new item to the current round, e.g. a newly taken photo
+        """
+        if item in self._index:
+            return
+        self._index[item] = len(self._items)
+        self._items.append(item)
+        # move it to the not yet shown part
+        self._swap(self._remaining, len(self._items) - 1)
+        self._remaining += 1
+        self._recent.append(item)
+        self._changed()
+
+    def _draw(self):
+        """
+        :return: next random item or None if the playlist is empty
+        """
+        if not self._items:
+            return None
+        last = self._upcoming[-1] if self._upcoming else self.current
+        # the recent items are empty after set_items() removed them or load() restored an older state
+        if self.recent_weight and self._recent and random.random() < self.recent_weight:
+            item = random.choice(self._recent)
+            if item != last or len(self._recent) == 1:
+                return item
+        if self._remaining == 0:
+            # next round
+            self._remaining = len(self._items)
+        i = random.randrange(self._remaining)
+        if self._items[i] == last and self._remaining > 1:
+            # do not show the same item twice in a row at the border of two rounds
+            i = (i + 1) % self._remaining
+        self._swap(i, self._remaining - 1)
+        self._remaining -= 1
+        return self._items[self._remaining]
+
+    def _fill_upcoming(self, count=None):
+        count = max(self.lookahead, count or 0)
+        while len(self._upcoming) < count and self._items:
+            self._upcoming.append(self._draw())
+
+    def peek(self, count=None):
+        """
+        :param count: number of items, defaults to lookahead
+        :return: list of the items next() will return next
+        """
+        count = self.lookahead if count is None else count
+        replay = [self._history[i] for i in range(self._position + 1, min(len(self._history),
+                                                                         self._position + 1 + count))]
+        self._fill_upcoming(count - len(replay))
+        return (replay + list(self._upcoming))[:count]
+
+    def next(self):
+        """
+        :return: next item or None if the playlist is empty
+        """
+        if self._position < len(self._history) - 1:
+            # going forward again after prev()
+            self._position += 1
+        else:
+            self._fill_upcoming()
+            if not self._upcoming:
+                return None
+            self._history.append(self._upcoming.popleft())
+            self._position = len(self._history) - 1
+        self._fill_upcoming()
+        self._changed()
+        return self.current
+
+    def prev(self):
+        """
+        :return: previous item, the current item if the history is exhausted
+        """
+        if self._position > 0:
+            self._position -= 1
+            self._changed()
+        return self.current
+
+    def set_items(self, items):
+        """
+        Synchronize with the given items, e.g. after photos were added or deleted by others.
+        The round and the history are kept for the remaining items. Unlike the other operations this is O(n).
+        :param items: all items, the newest last
+        """
+        items = list(items)
+        valid = set(items)
+        if valid == set(self._items):
+            return
+        unshown = [item for item in self._items[:self._remaining] if item in valid]
+        shown = [item for item in self._items[self._remaining:] if item in valid]
+        self._items = unshown + shown
+        self._index = dict((item, i) for i, item in enumerate(self._items))
+        self._remaining = len(unshown)
+        self._recent = deque([item for item in self._recent if item in valid], maxlen=self._recent.maxlen)
+        self._upcoming = deque(item for item in self._upcoming if item in valid)
+
+        # keep the position on the current item or the nearest item before it
+        position = len([i for i in range(self._position + 1) if self._history[i] in valid]) - 1
+        history = [item for item in self._history if item in valid]
+        self._history = deque(history, maxlen=self._history.maxlen)
+        self._position = position
+
+        for item in items:
+            self.add(item)
+        self._changed()
+
+    def _changed(self):
+        """
+        save the changed state unless the last save was less than save_interval seconds ago
+        """
+        self._dirty = True
+        if time.time() - self._last_save_time >= self.save_interval:
+            self.save()
+
+    def flush(self):
+        """
+        save changes that were not saved yet
+        """
+        if self._dirty:
+            self.save()
+
+    def save(self):
+        """
+        save the playlist state to the state file if one is set, this writes all items
+        """
+        self._dirty = False
+        self._last_save_time = time.time()
+        if not self.state_file:
+            return
+        state = {'items': self._items, 'remaining': self._remaining, 'recent': list(self._recent),
+                 'history': list(self._history), 'position': self._position, 'upcoming': list(self._upcoming)}
+        tmp_file = self.state_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp_file, self.state_file)
+        except (IOError, OSError) as e:
+            print("Saving playlist failed: " + str(e))
+
+    def load(self, state_file):
+        """
+        restore the playlist state
+        :param state_file: file written by save()
+        :return: True if the state was restored
+        """
+        try:
+            with open(state_file) as f:
+                state = json.load(f)
+            self._items = [str(item) for item in state['items']]
+            self._index = dict((item, i) for i, item in enumerate(self._items))
+            self._remaining = state['remaining']
+            self._recent.extend(str(item) for item in state['recent'])
+            self._history.extend(str(item) for item in state['history'])
+            self._position = min(state['position'], len(self._history) - 1)
+            self._upcoming.extend(str(item) for item in state['upcoming'])
+            return True
+        except (IOError, OSError, ValueError, KeyError) as e:
+            print("Couldn't restore playlist, starting a new one: " + str(e))
+            self._items = []
+            self._index = {}
+            self._remaining = 0
+            self._recent.clear()
+            self._history.clear()
+            self._position = -1
+            self._upcoming.clear()
+            return False
@@ -1,5 +1,10 @@
+import io
+import imp
+import sys
 import pygame
+from collections import OrderedDict
 from pygame.gfxdraw import filled_circle, aacircle
+from PIL import Image
 
 DEFAULT_FONT_SIZE = 72
 
@@ -13,6 +18,97 @@ COLOR_ORANGE = (210,105,30)
 COLOR_DARK_GREY = (105, 105, 105)
 COLOR_BLACK = (0, 0, 0)
 
+# PIL raw modes writing RGB pixels in the byte order of a 32 bit display on little endian machines, by RGB masks
+DISPLAY_RAW_MODES = {(0xff0000, 0xff00, 0xff): 'BGRX', (0xff, 0xff00, 0xff0000): 'RGBX'}
+
+try:
+    imp.find_module('numpy')
+    found_numpy_module = True
+except ImportError:
+    found_numpy_module = False
+    print("Couldn't find numpy module, proceeding without (pictures are mirrored using new surfaces)")
+
+if found_numpy_module:
+    import numpy
+
+
+class RenderCache(object):
+    """
+    Caches font objects per size and rendered text and widget surfaces in a least recently used cache.
+    Keys contain everything the surface depends on (text, size, colors, ...), hence a translated text
+    has a different key. Clear it if the screen resolution or the language changes.
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        :param max_entries: max number of cached surfaces
+        """
+        self.max_entries = max_entries
+        self._fonts = {}
+        self._surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_font(self, size):
+        """
+        :param size: font size
+        :return: pygame.font.Font of the default font
+        """
+        font = self._fonts.get(size)
+        if font is None:
+            font = self._fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    def get(self, key, create_callback):
+        """
+        Get a cached surface or create it
+        :param key: hashable key identifying the surface
+        :param create_callback: function creating the surface if it is not cached
+        :return: pygame.Surface
+        """
+        surface = self._surfaces.pop(key, None)
+        if surface is None:
+            self.misses += 1
+            surface = create_callback()
+            while self._surfaces and len(self._surfaces) >= self.max_entries:
+                self._surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+        self._surfaces[key] = surface
+        return surface
+
+    def clear(self):
+        self._fonts.clear()
+        self._surfaces.clear()
+
+
+render_cache = RenderCache()
+
+
+def get_render_cache():
+    """
+    Provide external access to the render cache instance
+    :return: RenderCache
+    """
+    return render_cache
+
+
+# wakes up the main loop, e.g. posted by button callbacks and the preview thread
+WAKE_EVENT = pygame.USEREVENT + 1
+# internal timer event ending the wait for events
+TIMER_EVENT = pygame.USEREVENT + 2
+
+
+def post_wake_event():
+    """
+    Wake up the main loop waiting in PyGameEventManager.wait_events, can be called from any thread
+    """
+    try:
+        pygame.event.post(pygame.event.Event(WAKE_EVENT))
+    except pygame.error:
+        # queue full or video system not initialized, the main loop wakes up anyway
+        pass
+
 
 class PyGameEventManager(object):
     """
@@ -24,18 +120,35 @@ class PyGameEventManager(object):
 
     def __init__(self):
         self.events = []
+        self._pending_events = []
         pygame.event.set_allowed(None)
         pygame.event.set_allowed(pygame.MOUSEBUTTONUP)
         pygame.event.set_allowed(pygame.KEYDOWN)
         pygame.event.set_allowed(pygame.QUIT)
+        pygame.event.set_allowed(WAKE_EVENT)
+        pygame.event.set_allowed(TIMER_EVENT)
 
     def update_events(self):
         """
         Update method has to be called every cycle in python main loop
         """
-        self.events = pygame.event.get()
+        self.events = self._pending_events + pygame.event.get()
+        self._pending_events = []
         pygame.event.pump()
 
+    def wait_events(self, timeout):
+        """
+        Sleep until an event arrives or the timeout elapsed. The events are kept for the next update_events call.
+        :param timeout: max time to sleep in seconds
+        """
+        self._pending_events.extend(pygame.event.get())
+        if self._pending_events or timeout <= 0:
+            return
+        # pygame.event.wait has no timeout, a timer event ends the wait
+        pygame.time.set_timer(TIMER_EVENT, max(1, int(timeout * 1000)))
+        self._pending_events.append(pygame.event.wait())
+        pygame.time.set_timer(TIMER_EVENT, 0)
+
     def key_pressed(self, keys):
         """
         check if a key from the given key list is pressed
@@ -72,20 +185,212 @@ class PyGameEventManager(object):
 def get_text_mid_position(resolution):
     return (resolution[0]/2,resolution[1]/2)
 
+def decode_jpeg(data, size=None, mirror=False):
+    """
+    Decode jpeg data to a pygame image.
+    With a target size libjpeg only decodes a DCT-domain downscaled version (1/2, 1/4, 1/8) that is just large enough,
+    the remaining scaling and the optional mirroring are done in a single resampling pass.
+    If the display uses 32 bit pixels, the decoder writes them in the byte order of the display, the image needs no
+    conversion and blitting it is a plain copy. Otherwise the decoded buffer is handed to pygame without copying it.
+    :param data: jpeg file content
+    :param size: optional target size (width, height)
+    :param mirror: mirror image horizontally
+    :return: pygame.image
+    """
+    image = Image.open(io.BytesIO(data))
+    if size:
+        size = (int(size[0]), int(size[1]))
+        image.draft('RGB', size)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    if size and image.size != size:
+        if mirror:
+            # affine transform maps destination to source coordinates, negative x scale mirrors while scaling
+            scale_x = float(image.size[0]) / size[0]
+            scale_y = float(image.size[1]) / size[1]
+            image = image.transform(size, Image.AFFINE, (-scale_x, 0, image.size[0], 0, scale_y, 0),
+                                    resample=Image.BILINEAR)
+        else:
+            image = image.resize(size, Image.BILINEAR)
+    elif mirror:
+        image = image.transpose(Image.FLIP_LEFT_RIGHT)
+
+    display = pygame.display.get_surface()
+    if display and display.get_bytesize() == 4 and sys.byteorder == 'little':
+        raw_mode = DISPLAY_RAW_MODES.get(display.get_masks()[:3])
+        if raw_mode:
+            surface = pygame.Surface(image.size, 0, display)
+            if surface.get_pitch() == image.size[0] * 4:
+                surface.get_buffer().write(image.tobytes('raw', raw_mode), 0)
+                return surface
+
+    return pygame.image.frombuffer(image.tobytes(), image.size, 'RGB')
+
+class PreviewRenderer(object):
+    """
+    Scales and mirrors pictures into reusable destination surfaces instead of allocating new full screen
+    surfaces for every frame. The buffers have the pixel format of the pictures and are shared by all states.
+    The last result is kept, hence drawing the same picture again (e.g. for partial screen updates) is free.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        self._mirror_buffers = {}
+        self._last = None
+
+    def _get_buffer(self, size, picture):
+        key = (size, picture.get_bitsize(), picture.get_masks(), picture.get_flags() & pygame.SRCALPHA)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = pygame.Surface(size, picture.get_flags() & pygame.SRCALPHA, picture)
+        return buffer
+
+    def _mirror(self, surface):
+        """
+        mirror a surface horizontally in place, swapping the image halves through a preallocated buffer
+        :return: the mirrored surface
+        """
+        if not found_numpy_module:
+            return pygame.transform.flip(surface, True, False)
+        if surface.get_bytesize() == 3:
+            pixels = pygame.surfarray.pixels3d(surface)
+        else:
+            # whole pixels are moved as integers
+            pixels = pygame.surfarray.pixels2d(surface)
+        half = pixels.shape[0] // 2
+        key = (half,) + pixels.shape[1:]
+        tmp = self._mirror_buffers.get(key)
+        if tmp is None:
+            tmp = self._mirror_buffers[key] = numpy.empty(key, dtype=pixels.dtype)
+        left = pixels[:half]
+        right = pixels[pixels.shape[0] - half:][::-1]
+        tmp[...] = left
+        left[...] = right
+        right[...] = tmp
+        del pixels
+        return surface
+
+    def render(self, picture, size, mirror=False):
+        """
+        :param picture: pygame.image
+        :param size: target size
+        :param mirror: mirror horizontally
+        :return: picture at the given size, mostly a reused buffer that is valid until the next call
+        """
+        size = tuple(size)
+        last = self._last
+        if last and last[0] is picture and last[1] == size and last[2] == mirror:
+            return last[3]
+
+        result = picture
+        if picture.get_size() != size:
+            result = self._get_buffer(size, picture)
+            pygame.transform.scale(picture, size, result)
+        if mirror:
+            if result is picture:
+                result = self._get_buffer(size, picture)
+                result.blit(picture, (0, 0))
+            result = self._mirror(result)
+
+        self._last = (picture, size, mirror, result)
+        return result
+
+
+preview_renderer = PreviewRenderer()
+
+
+class RenderTarget(object):
+    """
+    Surface all states draw to. With a fixed render resolution it is an offscreen surface in display format that is
+    scaled to the display once per update, hence the drawing work does not depend on the display resolution.
+    Otherwise it is the display surface itself.
+    """
+
+    def __init__(self, display, render_resolution=None):
+        """
+        :param display: display surface returned by pygame.display.set_mode
+        :param render_resolution: optional internal resolution (width, height)
+        """
+        self.display = display
+        if render_resolution and tuple(render_resolution) != display.get_size():
+            self.surface = pygame.Surface(tuple(render_resolution), 0, display)
+        else:
+            self.surface = display
+
+    def is_scaled(self):
+        return self.surface is not self.display
+
+    def to_display_rect(self, rect):
+        """
+        :param rect: pygame.Rect in render coordinates
+        :return: pygame.Rect in display coordinates, inflated by the scaling rounding
+        """
+        sx = self.display.get_width() / float(self.surface.get_width())
+        sy = self.display.get_height() / float(self.surface.get_height())
+        left, top = int(rect.left * sx), int(rect.top * sy)
+        right, bottom = int(rect.right * sx + 1), int(rect.bottom * sy + 1)
+        return pygame.Rect(left, top, right - left, bottom - top).clip(self.display.get_rect())
+
+    def update(self, rects=None):
+        """
+        Push the drawn regions to the display
+        :param rects: list of pygame.Rect in render coordinates, None updates the entire display
+        """
+        if self.is_scaled():
+            pygame.transform.scale(self.surface, self.display.get_size(), self.display)
+            if rects is not None:
+                rects = [self.to_display_rect(rect) for rect in rects]
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+
 def show_cam_picture(screen, picture, fullscreen=True, flip=True):
     if fullscreen:
-        img = pygame.transform.scale(picture, screen.get_size())
+        size = screen.get_size()
     else:
-        img = picture
+        size = picture.get_size()
 
-    if flip:
-        img = pygame.transform.flip(img,True,False)
-    screen.blit(img, (0, 0))
+    screen.blit(preview_renderer.render(picture, size, flip), (0, 0))
 
-def get_text_img(text, size, color):
-    font = pygame.font.Font(None, size)
+def convert_image(image, alpha=None):
+    """
+    Convert an image to the pixel format of the display, blitting it afterwards does not need a per pixel conversion
+    :param image: pygame.image
+    :param alpha: keep per pixel alpha, None keeps it if the image has per pixel alpha
+    :return: converted pygame.image, or the image itself if no display mode is set yet
+    """
+    display = pygame.display.get_surface()
+    if display is None:
+        return image
+    if alpha is None:
+        alpha = image.get_flags() & pygame.SRCALPHA
+    if alpha:
+        return image.convert_alpha()
+    if image.get_bitsize() == display.get_bitsize() and image.get_masks() == display.get_masks():
+        return image
+    return image.convert()
+
+def load_image(file, size=None, alpha=None):
+    """
+    Load an image in display pixel format, use this for all images that are drawn to the screen
+    :param file: image file
+    :param size: optional size (width, height) the image is scaled to before converting it
+    :param alpha: keep per pixel alpha, None keeps it if the image has per pixel alpha
+    :return: pygame.image
+    """
+    image = pygame.image.load(file)
+    if size and image.get_size() != tuple(size):
+        image = pygame.transform.scale(image, size)
+    return convert_image(image, alpha)
+
+def draw_image(screen, image, pos):
+    screen.blit(image, pos)
 
-    return font.render(text, True, color)
+def get_text_img(text, size, color):
+    return render_cache.get(('text', text, size, tuple(color)),
+                            lambda: render_cache.get_font(size).render(text, True, color))
 
 def draw_rect(screen, pos, size, color=COLOR_GREY, color_border=None, size_border = 1):
     if color:
@@ -121,6 +426,14 @@ def draw_text_box(screen, text, pos, size=DEFAULT_FONT_SIZE, text_color=COLOR_DA
 
     rect_size = (txt_img.get_width() + margin*2, txt_img.get_height() + margin*2)
 
+    box_img = None
+    if box_color:
+        # the opaque box including its text is rendered once
+        key = ('text_box', text, size, tuple(text_color), tuple(box_color), border_color and tuple(border_color),
+               margin, size_border)
+        box_img = render_cache.get(key, lambda: _render_text_box(txt_img, rect_size, box_color, border_color,
+                                                                 margin, size_border))
+
     #vertical center alignment
     if pos[0] is None:
         pos_x = get_text_mid_position(screen.get_size())[0] - rect_size[0]//2
@@ -135,9 +448,17 @@ def draw_text_box(screen, text, pos, size=DEFAULT_FONT_SIZE, text_color=COLOR_DA
 
     rect_pos = (pos_x - margin, pos_y - margin)
 
-    draw_rect(screen=screen, pos=rect_pos, size=rect_size, color=box_color, color_border=border_color, size_border=size_border)
-
-    screen.blit(txt_img,(pos_x,pos_y))
+    if box_img:
+        screen.blit(box_img, rect_pos)
+    else:
+        draw_rect(screen=screen, pos=rect_pos, size=rect_size, color=box_color, color_border=border_color, size_border=size_border)
+        screen.blit(txt_img,(pos_x,pos_y))
+
+def _render_text_box(txt_img, rect_size, box_color, border_color, margin, size_border):
+    box_img = pygame.Surface(rect_size)
+    draw_rect(screen=box_img, pos=(0, 0), size=rect_size, color=box_color, color_border=border_color, size_border=size_border)
+    box_img.blit(txt_img, (margin, margin))
+    return box_img
 
 def show_text_mid(screen, text, mid_pos, size=DEFAULT_FONT_SIZE, color=COLOR_WHITE, color_shadow=COLOR_DARK_GREY, shadow_size=0):
     """
@@ -13,19 +13,26 @@ def mount_device(device_name, media_label='images'):
 
 
 def umount_device(device_name):
+    """
+    :return: True if the device was unmounted
+    """
     command = "pumount {device_name}".format(device_name=r'"%s"' % device_name)
 
-    execute_process(command=command)
+    if execute_process(command=command) != 0:
+        print("Unmounting " + device_name + " failed, the device might be busy")
+        return False
+    return True
 
 def execute_process(command):
     """
     Execute the command
     :param command: full command string
+    :return: exit status of the command
     """
     cmd = shlex.split(command)
 
     p = subprocess.Popen(cmd, shell=False, stderr=subprocess.STDOUT)
-    p.wait()
+    return p.wait()
 
 
 if __name__ == '__main__':
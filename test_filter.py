@@ -1,4 +1,5 @@
 from instagram_filters.filters import Nashville, Toaster, BlackAndWhite
+from instagram_filters.filter import apply_filters
 from timeit import default_timer as timer
 
 start = timer()
@@ -13,4 +14,14 @@ filter = BlackAndWhite(filename='tmp/dummy_snap.jpg', output_filename='/tmp/dumm
 filter.apply()
 
 end = timer()
-print(end - start)
\ No newline at end of file
+print(end - start)
+
+# the same filters in a single convert process that decodes the photo only once
+start = timer()
+
+apply_filters([Nashville(filename='tmp/dummy_snap.jpg', output_filename='/tmp/dummy_snap_nashville_filtered.jpg'),
+               Toaster(filename='tmp/dummy_snap.jpg', output_filename='/tmp/dummy_snap_toaster_filtered.jpg'),
+               BlackAndWhite(filename='tmp/dummy_snap.jpg', output_filename='/tmp/dummy_snap_bw_filtered.jpg')])
+
+end = timer()
+print(end - start)
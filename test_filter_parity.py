@@ -0,0 +1,86 @@
+"""
+Parity test of the filter backends on the dummy photo.
+Every filter is applied with the ImageMagick reference, the native (NumPy/PIL) and the lut backend, the outputs are
+written lossless (PNG) so the comparison is not blurred by JPEG artifacts.
+Compared are native and lut with ImageMagick and lut with native (the interpolation error of the lookup tables).
+Exits with 1 if a backend exceeds the tolerance and with 2 if ImageMagick is not available, since parity with the
+reference can not be shown then. The native and lut backends are opt-in until this test passes.
+"""
+import sys
+from distutils.spawn import find_executable
+from timeit import default_timer as timer
+
+from PIL import Image
+
+from instagram_filters import native
+from instagram_filters.filter import BACKEND_IMAGEMAGICK, BACKEND_NATIVE, BACKEND_LUT
+from instagram_filters.filters import Gotham, Kelvin, Nashville, Lomo, Toaster, BlackAndWhite
+
+INPUT_FILE = 'tmp/dummy_preview00.jpg'
+
+# mean and maximum absolute difference per channel in range 0..255
+MAX_MEAN_ERROR = 1.0
+MAX_ERROR = 4
+
+FILTERS = [Gotham, Kelvin, Nashville, Lomo, Toaster, BlackAndWhite]
+
+
+def run_filter(filter_class, backend):
+    output_file = '/tmp/dummy_preview_%s_%s.png' % (filter_class.__name__.lower(), backend)
+    start = timer()
+    fil = filter_class(filename=INPUT_FILE, output_filename=output_file)
+    fil.apply(backend=backend)
+    fil.close_image()
+    return output_file, timer() - start
+
+
+def difference(file_a, file_b):
+    image_a = Image.open(file_a).convert('RGB')
+    image_b = Image.open(file_b).convert('RGB')
+    if image_a.size != image_b.size:
+        return None
+    diff = abs(native.numpy.asarray(image_a, dtype=native.numpy.int16) -
+               native.numpy.asarray(image_b, dtype=native.numpy.int16))
+    return diff.mean(), diff.max()
+
+
+def compare(filter_name, comparison, file_a, file_b, time_a, time_b):
+    """
+    print one result line
+    :return: True if the difference is within the tolerance
+    """
+    result = difference(file_a, file_b)
+    if result is None:
+        print("%-14s %-20s size differs" % (filter_name, comparison))
+        return False
+    mean_error, max_error = result
+    ok = mean_error <= MAX_MEAN_ERROR and max_error <= MAX_ERROR
+    print("%-14s %-20s %8.2f %6d %10.3f %10.3f %s" % (filter_name, comparison, mean_error, max_error,
+                                                      time_a, time_b, '' if ok else 'FAILED'))
+    return ok
+
+
+if __name__ == '__main__':
+    if not native.is_available():
+        print("Native filter backend is not available, nothing to compare")
+        sys.exit(2)
+    has_imagemagick = find_executable('convert') is not None
+
+    failed = False
+    print("%-14s %-20s %8s %6s %10s %10s" % ('filter', 'comparison', 'mean', 'max', 'a[s]', 'b[s]'))
+    for filter_class in FILTERS:
+        name = filter_class.__name__
+        native_file, native_time = run_filter(filter_class, BACKEND_NATIVE)
+        lut_file, lut_time = run_filter(filter_class, BACKEND_LUT)
+        failed = not compare(name, 'native - lut', native_file, lut_file, native_time, lut_time) or failed
+        if has_imagemagick:
+            magick_file, magick_time = run_filter(filter_class, BACKEND_IMAGEMAGICK)
+            failed = not compare(name, 'imagemagick - native', magick_file, native_file, magick_time,
+                                 native_time) or failed
+            failed = not compare(name, 'imagemagick - lut', magick_file, lut_file, magick_time, lut_time) or failed
+
+    if failed:
+        sys.exit(1)
+    if not has_imagemagick:
+        print("Couldn't find ImageMagick convert, parity with the reference is not verified")
+        sys.exit(2)
@@ -0,0 +1,59 @@
+"""
+Test of the shuffled slide show playlist.
+Every round has to show each photo once, also with recently added photos preferred, and the preferred photos
+must not be required, e.g. right after set_items() removed them or load() restored a state without them.
+Exits with 1 if a check fails.
+"""
+import os
+import sys
+import tempfile
+
+from playlist import Playlist
+
+ITEMS = ['photo%02d.jpg' % i for i in range(20)]
+
+
+def check(name, ok):
+    print("%-40s %s" % (name, 'ok' if ok else 'FAILED'))
+    return ok
+
+
+def test_rounds():
+    playlist = Playlist(ITEMS)
+    first = [playlist.next() for _ in ITEMS]
+    second = [playlist.next() for _ in ITEMS]
+    return check("every photo once per round", sorted(first) == ITEMS and sorted(second) == ITEMS)
+
+
+def test_empty_recent_after_set_items():
+    playlist = Playlist(ITEMS[:5], recent_weight=1.0, recent_count=5)
+    # removes every recently added photo
+    playlist.set_items(ITEMS[5:])
+    items = [playlist.next() for _ in range(30)]
+    return check("empty recent photos after set_items", all(item in ITEMS[5:] for item in items))
+
+
+def test_empty_recent_after_load():
+    state_file = os.path.join(tempfile.mkdtemp(), 'playlist.json')
+    playlist = Playlist(ITEMS, state_file=state_file)
+    playlist.next()
+    playlist._recent.clear()
+    playlist.save()
+    restored = Playlist(recent_weight=1.0, state_file=state_file)
+    items = [restored.next() for _ in range(30)]
+    os.remove(state_file)
+    return check("empty recent photos after load", all(item in ITEMS for item in items))
+
+
+def test_prev_next():
+    playlist = Playlist(ITEMS)
+    items = [playlist.next() for _ in range(5)]
+    back = [playlist.prev() for _ in range(4)]
+    forward = [playlist.next() for _ in range(4)]
+    return check("prev and next replay the history", back == items[-2::-1] and forward == items[1:])
+
+
+if __name__ == '__main__':
+    results = [test_rounds(), test_empty_recent_after_set_items(), test_empty_recent_after_load(), test_prev_next()]
+    if not all(results):
+        sys.exit(1)
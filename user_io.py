@@ -235,6 +235,8 @@ if found_rpi_module:
 
         def _release_callback(self, channel):
             self.button_event_state = ButtonState.BUTTON_PRESSED
+            # called from the GPIO thread, the main loop might be sleeping
+            post_wake_event()
 
         def is_pressed(self):
             return GPIO.input(self.button_pin) == GPIO.LOW
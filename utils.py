@@ -33,6 +33,13 @@ class GenericClassFactory(object):
         else:
             self._algorithms[id_class] = class_obj
 
+    def get_algorithm_ids(self):
+        """
+        Get the IDs of all registered algorithms
+        :return: list of IDs
+        """
+        return sorted(self._algorithms.keys())
+
     def create_algorithm(self, id_class, **kwargs):
         """
         Initialize the algorithm with the given ID